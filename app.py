@@ -10,6 +10,18 @@ import math
 # --- 页面配置 ---
 st.set_page_config(page_title="DataTrace Pro", layout="wide", page_icon="🕸️")
 
+@st.cache_resource
+def _init_db():
+    # 建表 / 迁移只需每个进程执行一次，不随每次页面重跑执行
+    db.init_db()
+
+_init_db()
+
+# Search & Explore 每次检索展示的数据集条数
+SEARCH_PAGE_SIZE = 50
+# Time Series Lab 图表最多绘制的点数，超出时自动改用汇总粒度
+TS_MAX_POINTS = 2000
+
 # 自定义样式
 st.markdown("""
 <style>
@@ -30,13 +42,14 @@ with st.sidebar:
         st.subheader("🔎 Search Filters")
         search_query = st.text_input("Keywords", placeholder="Name or Description...")
         
-        # 动态获取所有标签供筛选
-        all_ds = db.get_all_datasets()
-        all_tags = set()
-        for d in all_ds:
-            if d['tags']: all_tags.update(d['tags'].split(","))
-        
-        selected_tags = st.multiselect("Filter by Tags", options=list(all_tags))
+        # 标签分面（预计算计数，无需扫描数据集）
+        tag_facets = {f["tag"]: f["count"] for f in db.get_tag_counts()}
+        selected_tags = st.multiselect(
+            "Filter by Tags",
+            options=list(tag_facets.keys()),
+            format_func=lambda t: f"{t} ({tag_facets[t]})",
+        )
+        tag_mode = st.radio("Tag Match", ["any", "all"], horizontal=True, format_func=lambda m: "Any tag" if m == "any" else "All tags")
         
     elif page == "Lineage Intelligence":
         st.subheader("🕸️ Graph Filters")
@@ -66,14 +79,15 @@ with st.sidebar:
             start_d = datetime.combine(date_range[0], datetime.min.time())
             end_d = datetime.combine(date_range[1], datetime.max.time())
 
-        candidate_records = db.get_filtered_records(start_date=start_d, end_date=end_d)
         if focus_dataset_id:
-            record_ids, _ = db.collect_lineage_record_ids(
-                focus_dataset_id, candidate_records, direction=lineage_direction, depth=int(lineage_depth)
+            op_stats = db.get_operation_stats(
+                start_date=start_d, end_date=end_d,
+                dataset_id=focus_dataset_id, direction=lineage_direction, depth=int(lineage_depth),
             )
-            candidate_records = [r for r in candidate_records if r.get("id") in record_ids]
+        else:
+            op_stats = db.get_operation_stats(start_date=start_d, end_date=end_d)
 
-        all_ops = sorted({r.get("operation_name") for r in candidate_records if r.get("operation_name")})
+        all_ops = sorted(s["operation"] for s in op_stats)
         selected_ops = st.multiselect("Operation Types", options=all_ops, default=all_ops)
     elif page == "Time Series Lab":
         st.subheader("⏱️ Time Series Lab")
@@ -100,7 +114,7 @@ with st.sidebar:
 if page == "Search & Explore":
     st.markdown('<div class="main-header">📦 Dataset Hub</div>', unsafe_allow_html=True)
 
-    with st.expander("➕ Register New Dataset", expanded=(len(all_ds) == 0)):
+    with st.expander("➕ Register New Dataset", expanded=(db.get_dataset_count() == 0)):
         with st.form("create_dataset_form"):
             new_ds_name = st.text_input("Dataset Name")
             new_ds_desc = st.text_area("Description", height=100)
@@ -117,11 +131,11 @@ if page == "Search & Explore":
                     st.success(f"Dataset '{new_ds_name}' created (ID: {new_id}).")
                     st.rerun()
     
-    # 执行搜索
-    results = db.search_datasets(query=search_query, tags=selected_tags)
+    # 执行搜索（全文索引 + 相关度排序，只取前 SEARCH_PAGE_SIZE 条）
+    results, more_cursor = db.search_datasets_page(query=search_query, tags=selected_tags, tag_mode=tag_mode, limit=SEARCH_PAGE_SIZE)
     
     col1, col2 = st.columns([3, 1])
-    col1.caption(f"Showing {len(results)} datasets")
+    col1.caption(f"Showing top {len(results)} datasets" if more_cursor else f"Showing {len(results)} datasets")
     
     if not results:
         st.info("No datasets match your search criteria.")
@@ -204,14 +218,15 @@ elif page == "Workstation":
                     tag_list = sorted(tags)
                     
                     created_outputs = []
+                    uow = db.UnitOfWork()
                     for cfg in output_configs:
                         new_id = str(uuid.uuid4())[:8]
                         desc = cfg['desc'] or f"Generated via {op_name} from {', '.join(input_names)}."
-                        db.add_dataset(new_id, cfg['name'], desc, tag_list)
+                        uow.add_dataset(new_id, cfg['name'], desc, tag_list)
                         created_outputs.append({"id": new_id, "name": cfg['name']})
-                        db.copy_timeseries(input_ids, new_id, prefix_metric=(len(input_ids) > 1))
+                        uow.inherit_timeseries(input_ids, new_id, prefix_metric=(len(input_ids) > 1))
                     
-                    db.add_record(
+                    uow.add_record(
                         str(uuid.uuid4())[:8],
                         input_ids,
                         op_name,
@@ -221,6 +236,7 @@ elif page == "Workstation":
                         source="web",
                         run_id=run_id.strip() or None,
                     )
+                    uow.commit()
                     
                     st.success(f"Created {len(created_outputs)} dataset(s): {', '.join([o['name'] for o in created_outputs])}")
                     st.rerun()
@@ -236,13 +252,17 @@ elif page == "Lineage Intelligence":
         end_d = datetime.combine(date_range[1], datetime.max.time())
     
     # 获取过滤后的记录
-    records = db.get_filtered_records(start_date=start_d, end_date=end_d, op_types=selected_ops)
-
     if focus_dataset_id:
-        record_ids, _ = db.collect_lineage_record_ids(
-            focus_dataset_id, records, direction=lineage_direction, depth=int(lineage_depth)
+        records, _ = db.get_lineage_scope(
+            focus_dataset_id,
+            direction=lineage_direction,
+            depth=int(lineage_depth),
+            start_date=start_d,
+            end_date=end_d,
+            op_types=selected_ops,
         )
-        records = [r for r in records if r.get("id") in record_ids]
+    else:
+        records = db.get_filtered_records(start_date=start_d, end_date=end_d, op_types=selected_ops)
     
     scope_hint = ""
     if focus_dataset_id:
@@ -394,10 +414,13 @@ elif page == "Time Series Lab":
 
         ts_start = datetime.now() - timedelta(days=int(ts_days))
         ts_end = datetime.now()
-        series = db.get_timeseries(ts_dataset_id, start=ts_start, end=ts_end, metric=ts_metric, limit=5000)
+        ts_resolution = db.choose_timeseries_resolution(ts_dataset_id, start=ts_start, end=ts_end, metric=ts_metric, max_points=TS_MAX_POINTS)
+        series = db.get_timeseries(ts_dataset_id, start=ts_start, end=ts_end, metric=ts_metric, resolution=ts_resolution, max_points=TS_MAX_POINTS)
         if not series:
             st.warning("No time series data found. Try generating sample series.")
         else:
+            if ts_resolution != "raw":
+                st.caption(f"Showing {ts_resolution} averages ({len(series)} buckets).")
             df = pd.DataFrame(series)
             df["timestamp"] = pd.to_datetime(df["timestamp"])
             df = df.sort_values("timestamp")
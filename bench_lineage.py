@@ -0,0 +1,100 @@
+"""
+血缘图内存 / 延迟对比：DictLineageGraph（dict 邻接表，默认）vs CompactLineageGraph（整数化 + CSR）。
+
+用法：python bench_lineage.py --records 200000 --queries 200
+不依赖数据库，直接在内存中生成合成血缘记录。
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from lineage_graph import CompactLineageGraph, DictLineageGraph
+
+def make_records(n_records, seed=0):
+    """生成合成记录：每条记录 1~3 个输入（偏向最近产出的数据集），1~2 个输出"""
+    rng = random.Random(seed)
+    datasets = [f"raw{i:05d}" for i in range(max(10, n_records // 20))]
+    records = []
+    for k in range(n_records):
+        window = datasets[-2000:]
+        inputs = rng.sample(window, rng.randint(1, min(3, len(window))))
+        outputs = [f"ds{k:07d}_{j}" for j in range(rng.randint(1, 2))]
+        datasets.extend(outputs)
+        records.append({
+            "id": f"r{k:07d}",
+            "timestamp": f"2026-{1 + (k // 100000) % 12:02d}-{1 + (k // 3000) % 28:02d} {k % 24:02d}:{k % 60:02d}:00",
+            "operation_name": rng.choice(["Clean", "Merge", "Split", "Augment"]),
+            "operation_desc": "synthetic",
+            "actor": rng.choice(["alice", "bob", "carol"]),
+            "source": "bench",
+            "run_id": None,
+            "input_ids": inputs,
+            "output_ids": outputs,
+        })
+    return records
+
+def dict_build(records):
+    graph = DictLineageGraph()
+    graph.extend(records)
+    return graph
+
+def compact_build(records):
+    graph = CompactLineageGraph()
+    graph.extend(records)
+    return graph
+
+def measure(label, build, bfs, make, queries):
+    # 计时与内存分两轮：tracemalloc 会显著拖慢分配密集的构建过程
+    records = make()
+    t0 = time.perf_counter()
+    structure = build(records)
+    build_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    touched = 0
+    for ds_id, direction, depth in queries:
+        record_ids, _ = bfs(structure, ds_id, direction, depth)
+        touched += len(record_ids)
+    query_ms = (time.perf_counter() - t0) * 1000 / max(1, len(queries))
+    del records, structure
+
+    # 内存：两种结构都只保留自己的副本（精简记录 / 整数数组和 id 表），输入的 record dict 不计入
+    tracemalloc.start()
+    records = make()
+    structure = build(records)
+    del records
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"label": label, "memory_mb": current / 1e6, "build_s": build_s, "query_ms": query_ms, "touched": touched}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare dict-based vs CSR lineage traversal.")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=4)
+    args = parser.parse_args()
+
+    sample = make_records(args.records)
+    rng = random.Random(1)
+    picks = rng.sample(sample, min(args.queries, len(sample)))
+    queries = [(rng.choice(r["input_ids"] + r["output_ids"]), rng.choice(["upstream", "downstream", "both"]), args.depth) for r in picks]
+    del sample
+
+    make = lambda: make_records(args.records)
+    results = [
+        measure("dict", dict_build, lambda g, d, dr, dp: g.bfs(d, dr, dp), make, queries),
+        measure("compact", compact_build, lambda g, d, dr, dp: g.bfs(d, dr, dp), make, queries),
+    ]
+    assert results[0]["touched"] == results[1]["touched"], "traversal results differ"
+
+    print(f"records={args.records} queries={len(queries)} depth={args.depth}")
+    print(f"{'structure':<10}{'memory(MB)':>12}{'build(s)':>10}{'query(ms)':>11}")
+    for r in results:
+        print(f"{r['label']:<10}{r['memory_mb']:>12.1f}{r['build_s']:>10.2f}{r['query_ms']:>11.3f}")
+    base, compact = results
+    print(f"compact/dict: memory x{compact['memory_mb'] / base['memory_mb']:.2f}, "
+          f"build x{compact['build_s'] / base['build_s']:.2f}, query x{compact['query_ms'] / base['query_ms']:.2f}")
+
+if __name__ == "__main__":
+    main()
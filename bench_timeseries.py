@@ -0,0 +1,86 @@
+"""
+时间序列存储对比：每点一行（rows）vs 列式分块（chunked）。
+
+用法：python bench_timeseries.py --datasets 20 --points 50000 --queries 50
+在临时目录中各建一个 SQLite 库，写入同样的合成序列，比较写入耗时、每点字节数（含汇总表）、
+范围查询延迟与整段窗口按 max_points 降采样的延迟。
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database as db
+
+def make_points(n_points, seed):
+    rng = random.Random(seed)
+    base = datetime(2026, 1, 1)
+    return [(base + timedelta(minutes=i), rng.gauss(0, 1)) for i in range(n_points)]
+
+def measure(storage, workdir, args, queries):
+    db.close_connection()
+    db.DB_FILE = os.path.join(workdir, f"{storage}.db")
+    db.TIMESERIES_STORAGE = storage
+    db.init_db()
+
+    t0 = time.perf_counter()
+    for k in range(args.datasets):
+        points = make_points(args.points, seed=k)
+        for i in range(0, len(points), args.batch):
+            db.add_timeseries_points(f"ds{k:03d}", points[i : i + args.batch])
+    write_s = time.perf_counter() - t0
+
+    conn = db._connect()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    size = os.path.getsize(db.DB_FILE)
+
+    t0 = time.perf_counter()
+    returned = 0
+    for ds_id, start, end in queries:
+        returned += len(db.get_timeseries(ds_id, start=start, end=end, limit=10000))
+    query_ms = (time.perf_counter() - t0) * 1000 / max(1, len(queries))
+
+    # 整段窗口：由 max_points 自动选择汇总粒度
+    t0 = time.perf_counter()
+    for k in range(args.datasets):
+        db.get_timeseries(f"ds{k:03d}", max_points=args.max_points)
+    window_ms = (time.perf_counter() - t0) * 1000 / args.datasets
+    db.close_connection()
+    return {
+        "label": storage, "bytes_per_point": size / (args.datasets * args.points), "write_s": write_s,
+        "query_ms": query_ms, "window_ms": window_ms, "returned": returned,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare row-per-point vs chunked columnar time series storage.")
+    parser.add_argument("--datasets", type=int, default=20)
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--span", type=int, default=1440, help="每次查询覆盖的分钟数")
+    parser.add_argument("--max-points", type=int, default=1000, help="整段窗口查询的 max_points")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    base = datetime(2026, 1, 1)
+    queries = []
+    for _ in range(args.queries):
+        offset = rng.randint(0, max(0, args.points - args.span))
+        start = base + timedelta(minutes=offset)
+        end = start + timedelta(minutes=args.span - 1)
+        queries.append((f"ds{rng.randrange(args.datasets):03d}", start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [measure(storage, workdir, args, queries) for storage in ("rows", "chunked")]
+    assert results[0]["returned"] == results[1]["returned"], "query results differ"
+
+    print(f"datasets={args.datasets} points/dataset={args.points} queries={len(queries)} span={args.span}min")
+    print(f"{'storage':<10}{'bytes/point':>13}{'write(s)':>10}{'query(ms)':>11}{'window(ms)':>12}")
+    for r in results:
+        print(f"{r['label']:<10}{r['bytes_per_point']:>13.1f}{r['write_s']:>10.2f}{r['query_ms']:>11.3f}{r['window_ms']:>12.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -90,11 +90,23 @@ def commit(inputs, op, msg, outputs, out_name, out_desc, actor, run_id):
 
 @cli.command()
 @click.argument('query', required=False)
-def search(query):
-    """搜索数据集"""
+@click.option("--limit", type=int, default=20, show_default=True)
+@click.option("--cursor", help="上一页输出的 next cursor")
+@click.option("--tags", help="Comma separated tags")
+@click.option("--all-tags", is_flag=True, help="要求包含全部标签（默认包含任一即可）")
+def search(query, limit, cursor, tags, all_tags):
+    """搜索数据集（按相关度排序，分页）"""
     params = {"q": query} if query else {}
+    params["limit"] = limit
+    if cursor:
+        params["cursor"] = cursor
+    if tags:
+        params["tags"] = tags
+        params["tag_mode"] = "all" if all_tags else "any"
     r = requests.get(f"{API_URL}/datasets/search", params=params)
-    results = r.json()['results']
+    r.raise_for_status()
+    payload = r.json()
+    results = payload['results']
     
     if not results:
         click.echo("No datasets found.")
@@ -103,6 +115,25 @@ def search(query):
     click.echo(f"Found {len(results)} datasets:")
     for d in results:
         click.echo(f"[{d['id']}] {click.style(d['name'], bold=True)} (Tags: {d['tags']})")
+    if payload.get("next_cursor"):
+        click.echo(f"More results: --cursor {payload['next_cursor']}")
+
+@cli.command()
+@click.option("--prefix", help="只列出以此开头的标签")
+@click.option("--limit", type=int, default=50, show_default=True)
+def tags(prefix, limit):
+    """列出标签及其数据集数量"""
+    params = {"limit": limit}
+    if prefix:
+        params["prefix"] = prefix
+    r = requests.get(f"{API_URL}/tags", params=params)
+    r.raise_for_status()
+    results = r.json()["results"]
+    if not results:
+        click.echo("No tags found.")
+        return
+    for t in results:
+        click.echo(f"{t['tag']:<30}{t['count']:>6}")
 
 @cli.command()
 @click.argument("dataset_id")
@@ -137,6 +168,23 @@ def lineage(dataset_id, direction, depth, start, end, op_types, q, pretty):
     else:
         click.echo(json.dumps(data, ensure_ascii=False))
 
+@cli.command()
+@click.argument("dataset_id")
+@click.option("--upstream", is_flag=True, help="列出上游（祖先）而不是下游（后代）")
+@click.option("--depth", type=int, default=None, help="最大跳数（默认不限）")
+def impact(dataset_id, upstream, depth):
+    """影响分析：列出某个数据集的全部下游（或 --upstream 上游）数据集。"""
+    params = {"depth": depth} if depth is not None else {}
+    kind = "ancestors" if upstream else "descendants"
+    r = requests.get(f"{API_URL}/datasets/{dataset_id}/{kind}", params=params)
+    if r.status_code != 200:
+        click.echo(click.style(f"✘ Error: {r.text}", fg="red"))
+        sys.exit(1)
+    data = r.json()
+    click.echo(f"Found {data['count']} {kind}:")
+    for d in data.get("results", []):
+        click.echo(f"  [{d['distance']}] {d['id']} {click.style(d.get('name') or '', bold=True)}")
+
 @cli.command(name="ops")
 @click.option("--start", help="YYYY-MM-DD or ISO datetime")
 @click.option("--end", help="YYYY-MM-DD or ISO datetime")
@@ -0,0 +1,77 @@
+"""
+pytest 公共夹具：每个测试使用 tmp_path 下的独立 SQLite 文件，互不影响，也不碰仓库里的 datatrace.db。
+"""
+import pytest
+
+import database as db
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "datatrace.db")
+    monkeypatch.setattr(db, "DB_FILE", path)
+    db.init_db()
+    yield path
+    db.close_connection()
+
+@pytest.fixture
+def api(db_file):
+    """绑定到临时数据库的 TestClient（进入上下文以触发 lifespan，加载常驻血缘图）"""
+    from fastapi.testclient import TestClient
+    import api_server
+
+    with TestClient(api_server.app) as client:
+        yield client
+
+class ApiShim:
+    """
+    代替 datatrace.Client：请求转给 TestClient，返回 requests.Response。
+    down=True 模拟 API 不可达（抛 ConnectionError），calls 记录 (method, path)。
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.down = False
+        self.calls = []
+
+    def request(self, method, path, json=None, retry=True, **kwargs):
+        import io
+        import requests
+
+        self.calls.append((method, path))
+        if self.down:
+            raise requests.ConnectionError("API unavailable (simulated)")
+        for key in ("timeout", "stream"):
+            kwargs.pop(key, None)
+        res = self.client.request(method, path, json=json, **kwargs)
+        out = requests.Response()
+        out.status_code = res.status_code
+        out._content = res.content
+        out.headers.update(res.headers)
+        out.url = path
+        out.raw = io.BytesIO(res.content)
+        return out
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def sdk(api, monkeypatch):
+    """datatrace 模块：HTTP 调用经 ApiShim 转给临时数据库上的 API（sdk.shim），暂存关闭，测试结束后停掉后台线程"""
+    import datatrace as dt
+
+    shim = ApiShim(api)
+    monkeypatch.setattr(dt, "CONFIG", dict(dt.CONFIG, SPOOL_PATH=None, ASYNC_LOG=False))
+    monkeypatch.setattr(dt, "get_client", lambda: shim)
+    monkeypatch.setattr(dt, "_spool", None)
+    dt.clear_dataset_cache()
+    dt.shim = shim
+    yield dt
+    dt._stop_log_queue()
+    dt.clear_dataset_cache()
+    del dt.shim
@@ -1,71 +1,408 @@
 import sqlite3
 import json
+import re
+import base64
+import heapq
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
 from datetime import datetime
 
+import timeseries_store
+
 DB_FILE = "datatrace.db"
 
+# --- 连接管理 ---
+# 每个线程复用一条长连接（FastAPI 线程池 / Streamlit 会话线程各自持有），避免每条语句都重新建连。
+# WAL 模式下读写互不阻塞，synchronous=NORMAL 只在 checkpoint 时 fsync，显著降低写入延迟。
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=30000",
+)
+# sqlite3 模块按 SQL 文本缓存预编译语句（prepared statements）
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+def _open_connection(check_same_thread=True):
+    # isolation_level=None：由 transaction() 显式控制事务边界
+    conn = sqlite3.connect(
+        DB_FILE,
+        timeout=30,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=check_same_thread,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 def _connect():
-    conn = sqlite3.connect(DB_FILE, timeout=30)
+    """返回当前线程的复用连接；DB_FILE 被修改时自动重连。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db_file != DB_FILE:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection()
+        _local.conn = conn
+        _local.db_file = DB_FILE
+        _local.tx_depth = 0
     return conn
 
-def init_db():
+def close_connection():
+    """关闭当前线程持有的连接（测试 / 切换数据库文件时使用）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+        _local.tx_depth = 0
+
+@contextmanager
+def transaction():
+    """
+    写事务：最外层使用 BEGIN IMMEDIATE（提前拿写锁，避免 WAL 下的锁升级冲突），
+    嵌套调用使用 SAVEPOINT，因此多个写函数可以组合进同一个事务。
+    """
     conn = _connect()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS datasets
-                 (id TEXT PRIMARY KEY, 
-                  name TEXT, 
-                  description TEXT, 
-                  tags TEXT, 
-                  created_at TEXT)''')
-    # input_ids 存储为逗号分隔字符串
-    c.execute('''CREATE TABLE IF NOT EXISTS records
-                 (id TEXT PRIMARY KEY, 
-                  timestamp TEXT, 
-                  input_ids TEXT, 
-                  operation_name TEXT, 
-                  operation_desc TEXT, 
-                  output_id TEXT,
-                  actor TEXT,
-                  source TEXT,
-                  run_id TEXT)''')
-    # 兼容旧库：增量补充列
-    c.execute("PRAGMA table_info(records)")
-    existing_cols = {row[1] for row in c.fetchall()}
-    for col, col_type in (("actor", "TEXT"), ("source", "TEXT"), ("run_id", "TEXT")):
-        if col not in existing_cols:
-            c.execute(f"ALTER TABLE records ADD COLUMN {col} {col_type}")
-    # 索引：提升常见查询性能
-    c.execute("CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records(timestamp)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_records_operation_name ON records(operation_name)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_records_run_id ON records(run_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_records_actor ON records(actor)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_records_source ON records(source)")
-
-    # 时间序列数据表（面向时间序列工具集）
-    c.execute('''CREATE TABLE IF NOT EXISTS timeseries
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  dataset_id TEXT,
-                  timestamp TEXT,
-                  value REAL,
-                  metric TEXT)''')
-    c.execute("CREATE INDEX IF NOT EXISTS idx_ts_dataset_time ON timeseries(dataset_id, timestamp)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_ts_metric ON timeseries(metric)")
-    conn.commit()
-    conn.close()
+    depth = _local.tx_depth
+    savepoint = f"sp_{depth}"
+    conn.execute("BEGIN IMMEDIATE" if depth == 0 else f"SAVEPOINT {savepoint}")
+    _local.tx_depth = depth + 1
+    try:
+        yield conn
+        conn.execute("COMMIT" if depth == 0 else f"RELEASE {savepoint}")
+    except BaseException:
+        # COMMIT / RELEASE 本身失败（如 SQLITE_BUSY）时同样回滚，连接不会停留在打开的事务中；
+        # SQLite 已自动回滚整个事务时 in_transaction 为 False，无需再回滚
+        if conn.in_transaction:
+            if depth == 0:
+                conn.execute("ROLLBACK")
+            else:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+        raise
+    finally:
+        _local.tx_depth = depth
+
+def init_db():
+    """建表与迁移（幂等）。导入本模块不会触碰数据库文件，由 api_server / app.py / SDK 嵌入模式在设置好 DB_FILE 后调用。"""
+    with transaction() as conn:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS datasets
+                     (id TEXT PRIMARY KEY, 
+                      name TEXT, 
+                      description TEXT, 
+                      tags TEXT, 
+                      created_at TEXT)''')
+        # input_ids 存储为逗号分隔字符串
+        c.execute('''CREATE TABLE IF NOT EXISTS records
+                     (id TEXT PRIMARY KEY, 
+                      timestamp TEXT, 
+                      input_ids TEXT, 
+                      operation_name TEXT, 
+                      operation_desc TEXT, 
+                      output_id TEXT,
+                      actor TEXT,
+                      source TEXT,
+                      run_id TEXT)''')
+        # 兼容旧库：增量补充列
+        c.execute("PRAGMA table_info(records)")
+        existing_cols = {row[1] for row in c.fetchall()}
+        for col, col_type in (("actor", "TEXT"), ("source", "TEXT"), ("run_id", "TEXT")):
+            if col not in existing_cols:
+                c.execute(f"ALTER TABLE records ADD COLUMN {col} {col_type}")
+        # 索引：提升常见查询性能
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records(timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_operation_name ON records(operation_name)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_run_id ON records(run_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_actor ON records(actor)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_source ON records(source)")
+        # keyset 分页：(timestamp, id) 作为游标
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_ts_id ON records(timestamp, id)")
+
+        # 时间序列数据表（面向时间序列工具集）
+        c.execute('''CREATE TABLE IF NOT EXISTS timeseries
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      dataset_id TEXT,
+                      timestamp TEXT,
+                      value REAL,
+                      metric TEXT)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ts_dataset_time ON timeseries(dataset_id, timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ts_metric ON timeseries(metric)")
+        # 时间序列继承（不复制数据）：child 的序列 = 自有数据 + 各来源数据集中 id <= watermark 的点，
+        # 指标名加上 metric_prefix。链接在创建时即展开到实际存储数据的数据集，读取时无需递归。
+        c.execute('''CREATE TABLE IF NOT EXISTS timeseries_links
+                     (child_id TEXT NOT NULL,
+                      position INTEGER NOT NULL,
+                      source_id TEXT NOT NULL,
+                      metric_prefix TEXT NOT NULL,
+                      watermark INTEGER NOT NULL,
+                      chunk_watermark INTEGER NOT NULL DEFAULT 0,
+                      PRIMARY KEY (child_id, position)) WITHOUT ROWID''')
+        c.execute("PRAGMA table_info(timeseries_links)")
+        if "chunk_watermark" not in {row[1] for row in c.fetchall()}:
+            c.execute("ALTER TABLE timeseries_links ADD COLUMN chunk_watermark INTEGER NOT NULL DEFAULT 0")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ts_links_source ON timeseries_links(source_id)")
+        # 列式分块存储：每块为同一 (dataset, metric) 的一段按时间排序的点，
+        # ts / vals 为小端 int64（纪元微秒）/ float64 数组（codec 非 0 时为压缩编码，见 timeseries_store.py），
+        # t_min / t_max 用于跳过不相交的块
+        c.execute('''CREATE TABLE IF NOT EXISTS timeseries_chunks
+                     (chunk_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      dataset_id TEXT NOT NULL,
+                      metric TEXT NOT NULL,
+                      t_min INTEGER NOT NULL,
+                      t_max INTEGER NOT NULL,
+                      n INTEGER NOT NULL,
+                      ts BLOB NOT NULL,
+                      vals BLOB NOT NULL,
+                      codec INTEGER NOT NULL DEFAULT 0)''')
+        c.execute("PRAGMA table_info(timeseries_chunks)")
+        if "codec" not in {row[1] for row in c.fetchall()}:
+            c.execute("ALTER TABLE timeseries_chunks ADD COLUMN codec INTEGER NOT NULL DEFAULT 0")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ts_chunks_range ON timeseries_chunks(dataset_id, metric, t_min)")
+        # 多粒度汇总（minute / hour / day），写入时间序列时同步维护；bucket 为桶起点（纪元微秒）
+        c.execute('''CREATE TABLE IF NOT EXISTS timeseries_rollups
+                     (dataset_id TEXT NOT NULL,
+                      metric TEXT NOT NULL,
+                      tier TEXT NOT NULL,
+                      bucket INTEGER NOT NULL,
+                      n INTEGER NOT NULL,
+                      total REAL NOT NULL,
+                      vmin REAL NOT NULL,
+                      vmax REAL NOT NULL,
+                      last_ts INTEGER NOT NULL,
+                      last_value REAL NOT NULL,
+                      PRIMARY KEY (dataset_id, tier, metric, bucket)) WITHOUT ROWID''')
+        # 每个序列各粒度是否维护汇总：桶宽不大于序列本身的采样间隔时每桶只有一个点，
+        # 汇总表不比原始块小，这类粒度（stored = 0）读取时由原始块现场聚合；没有记录的序列维护全部粒度
+        c.execute('''CREATE TABLE IF NOT EXISTS timeseries_rollup_tiers
+                     (dataset_id TEXT NOT NULL,
+                      metric TEXT NOT NULL,
+                      tier TEXT NOT NULL,
+                      stored INTEGER NOT NULL,
+                      PRIMARY KEY (dataset_id, metric, tier)) WITHOUT ROWID''')
+
+        # 血缘边表：records.input_ids / output_id 的规范化形式，按 dataset_id 建索引，
+        # “哪些记录消费/产出了数据集 X”因此是一次索引查找而不是全表扫描
+        c.execute('''CREATE TABLE IF NOT EXISTS record_inputs
+                     (record_id TEXT NOT NULL,
+                      dataset_id TEXT NOT NULL,
+                      PRIMARY KEY (record_id, dataset_id)) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE IF NOT EXISTS record_outputs
+                     (record_id TEXT NOT NULL,
+                      dataset_id TEXT NOT NULL,
+                      PRIMARY KEY (record_id, dataset_id)) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_record_inputs_dataset ON record_inputs(dataset_id, record_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_record_outputs_dataset ON record_outputs(dataset_id, record_id)")
+
+        # 传递闭包表：每对 (祖先, 后代) 一行，min_distance 为最短数据集跳数；
+        # 祖先/后代查询（含 depth 上限）都是一次索引范围扫描
+        c.execute('''CREATE TABLE IF NOT EXISTS lineage_closure
+                     (ancestor_id TEXT NOT NULL,
+                      descendant_id TEXT NOT NULL,
+                      min_distance INTEGER NOT NULL,
+                      PRIMARY KEY (ancestor_id, descendant_id)) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_lineage_closure_descendant ON lineage_closure(descendant_id, ancestor_id)")
+
+        # 幂等键登记表：客户端生成的 client_id -> record_id，重放同一 client_id 的变换时返回已有记录
+        c.execute("CREATE TABLE IF NOT EXISTS record_client_ids (client_id TEXT PRIMARY KEY, record_id TEXT NOT NULL) WITHOUT ROWID")
+
+        # 名称登记表：name 唯一，指向该名称对应的数据集（get-or-create 的原子性依赖此主键）
+        c.execute("CREATE TABLE IF NOT EXISTS dataset_names (name TEXT PRIMARY KEY, dataset_id TEXT NOT NULL) WITHOUT ROWID")
+
+        # 标签倒排表：每个 (tag, dataset_id) 一行，主键即按标签的索引；tag_counts 为预计算的标签计数
+        c.execute('''CREATE TABLE IF NOT EXISTS dataset_tags
+                     (tag TEXT NOT NULL,
+                      dataset_id TEXT NOT NULL,
+                      PRIMARY KEY (tag, dataset_id)) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_dataset_tags_dataset ON dataset_tags(dataset_id, tag)")
+        c.execute("CREATE TABLE IF NOT EXISTS tag_counts (tag TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID")
+
+        # 数据集全文索引（FTS5，rowid 与 datasets.rowid 对齐），由 add_dataset 同步写入
+        if _HAS_FTS5:
+            c.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS datasets_fts USING fts5(name, description, prefix='2 3')"
+            )
+
+        # 血缘版本号：每写入一条 record 加 1，供进程内缓存（api_server.LineageGraph）判断是否过期
+        c.execute("CREATE TABLE IF NOT EXISTS lineage_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        c.execute("INSERT OR IGNORE INTO lineage_meta (key, value) VALUES ('version', 0)")
+
+        _migrate(c)
+
+# --- 数据迁移（PRAGMA user_version 记录已执行到的版本） ---
+
+def _migrate_lineage_edges(c):
+    """把旧库 records 中逗号分隔的 input_ids / output_id 回填到边表。"""
+    c.execute("SELECT id, input_ids, output_id FROM records")
+    for row in c.fetchall():
+        _insert_record_edges(c, row[0], (row[1] or "").split(","), (row[2] or "").split(","))
+
+def _migrate_lineage_closure(c):
+    """按写入顺序回放所有记录，构建传递闭包表。"""
+    c.execute("SELECT id, input_ids, output_id FROM records ORDER BY rowid")
+    for row in c.fetchall():
+        _update_lineage_closure(c, (row[1] or "").split(","), (row[2] or "").split(","))
+
+def _migrate_dataset_fts(c):
+    """为已有数据集建立全文索引。"""
+    if not _HAS_FTS5:
+        return
+    c.execute("DELETE FROM datasets_fts")
+    c.execute("SELECT rowid, name, description FROM datasets")
+    for row in c.fetchall():
+        _index_dataset_fts(c, row[0], row[1], row[2])
+
+def _migrate_dataset_tags(c):
+    """把 datasets.tags 逗号字符串回填到标签倒排表。"""
+    c.execute("SELECT id, tags FROM datasets")
+    for row in c.fetchall():
+        _insert_dataset_tags(c, [(row[0], (row[1] or "").split(","))])
+
+def _migrate_dataset_names(c):
+    """按创建顺序登记已有数据集名称（同名时最新的一个生效）。"""
+    c.execute("SELECT id, name FROM datasets WHERE name IS NOT NULL ORDER BY created_at, rowid")
+    for row in c.fetchall():
+        c.execute(_REGISTER_NAME_SQL, (row[1], row[0]))
+
+def _migrate_timeseries_rollups(c):
+    """为已有的时间序列（逐行 + 分块）计算多粒度汇总。"""
+    c.execute("DELETE FROM timeseries_rollups")
+    c.execute("SELECT dataset_id FROM timeseries UNION SELECT dataset_id FROM timeseries_chunks")
+    for row in c.fetchall():
+        by_metric = {}
+        for times, values, label, _ in _source_segments(c, row[0], "", None, None):
+            times_out, values_out = by_metric.setdefault(label, ([], []))
+            for t, v in zip(times, values):
+                if t != _UNPARSED_TS:
+                    times_out.append(int(t))
+                    values_out.append(float(v))
+        for label, (times, values) in by_metric.items():
+            _update_rollups(c, row[0], label, times, values)
+
+_MIGRATIONS = (
+    _migrate_lineage_edges,
+    _migrate_lineage_closure,
+    _migrate_dataset_fts,
+    _migrate_dataset_tags,
+    _migrate_dataset_names,
+    _migrate_timeseries_rollups,
+)
+
+def _migrate(c):
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in enumerate(_MIGRATIONS, start=1):
+        if version < target:
+            step(c)
+            c.execute(f"PRAGMA user_version = {target}")
 
 # --- 基础写入操作 ---
 
-def add_dataset(ds_id, name, desc, tags):
-    conn = _connect()
-    c = conn.cursor()
-    tags_str = ",".join(tags)
+def _insert_datasets(conn, datasets):
+    """批量写入数据集及其全文索引 / 标签索引；datasets = [(ds_id, name, desc, tags), ...]"""
     created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT INTO datasets VALUES (?, ?, ?, ?, ?)", 
-              (ds_id, name, desc, tags_str, created_at))
-    conn.commit()
-    conn.close()
+    conn.executemany(
+        "INSERT INTO datasets VALUES (?, ?, ?, ?, ?)",
+        [(ds_id, name, desc, ",".join(tags), created_at) for ds_id, name, desc, tags in datasets],
+    )
+    if _HAS_FTS5:
+        conn.executemany(
+            "INSERT INTO datasets_fts (rowid, name, description) SELECT rowid, ?, ? FROM datasets WHERE id = ?",
+            [(_fts_text(name), _fts_text(desc), ds_id) for ds_id, name, desc, _ in datasets],
+        )
+    _insert_dataset_tags(conn, [(ds_id, tags) for ds_id, _, _, tags in datasets])
+
+_REGISTER_NAME_SQL = (
+    "INSERT INTO dataset_names (name, dataset_id) VALUES (?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET dataset_id = excluded.dataset_id"
+)
+
+def add_dataset(ds_id, name, desc, tags):
+    with transaction() as conn:
+        _insert_datasets(conn, [(ds_id, name, desc, tags)])
+        # 同名数据集（如重复运行的变换输出）允许存在，名称指向最新的一个
+        conn.execute(_REGISTER_NAME_SQL, (name, ds_id))
     return ds_id
 
+def get_dataset_id_by_name(name):
+    """按名称查找数据集 id（dataset_names 主键查找），不存在返回 None"""
+    row = _connect().execute("SELECT dataset_id FROM dataset_names WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def get_dataset_ids_by_names(names):
+    """批量按名称查找数据集 id：返回 {name: id}，未登记的名称不在结果中"""
+    conn = _connect()
+    result = {}
+    for batch in _chunked(set(names or [])):
+        placeholders = ",".join("?" * len(batch))
+        result.update(conn.execute(f"SELECT name, dataset_id FROM dataset_names WHERE name IN ({placeholders})", batch).fetchall())
+    return result
+
+def get_or_create_dataset(ds_id, name, desc, tags):
+    """
+    原子的 get-or-create：名称已登记则返回已有 id，否则以 ds_id 创建。
+    返回：(dataset_id, created)
+    - 已存在时只是一次主键查找，不拿写锁
+    - 创建路径在 BEGIN IMMEDIATE 事务内用 INSERT ... ON CONFLICT DO NOTHING 抢占名称，
+      并发写入同名时只有一方创建成功，其余方读到胜者的 id
+    """
+    existing = get_dataset_id_by_name(name)
+    if existing is not None:
+        return existing, False
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO dataset_names (name, dataset_id) VALUES (?, ?) ON CONFLICT(name) DO NOTHING",
+            (name, ds_id),
+        )
+        if cur.rowcount == 0:
+            row = conn.execute("SELECT dataset_id FROM dataset_names WHERE name = ?", (name,)).fetchone()
+            return row[0], False
+        _insert_datasets(conn, [(ds_id, name, desc, tags)])
+    return ds_id, True
+
+def _normalize_tags(tags):
+    """去空白、去空串、去重（保持顺序）"""
+    seen = []
+    for t in tags or []:
+        t = (t or "").strip()
+        if t and t not in seen:
+            seen.append(t)
+    return seen
+
+def _insert_dataset_tags(conn, dataset_tags):
+    """dataset_tags = [(ds_id, tags), ...]"""
+    rows = [(t, ds_id) for ds_id, tags in dataset_tags for t in _normalize_tags(tags)]
+    if not rows:
+        return
+    conn.executemany("INSERT OR IGNORE INTO dataset_tags (tag, dataset_id) VALUES (?, ?)", rows)
+    conn.executemany(
+        "INSERT INTO tag_counts (tag, count) VALUES (?, 1) ON CONFLICT(tag) DO UPDATE SET count = count + 1",
+        [(t,) for t, _ in rows],
+    )
+
+def get_tag_counts(prefix=None, limit=None):
+    """标签分面：返回 [{"tag", "count"}]，按数量倒序；直接读取预计算的 tag_counts，不扫描数据集"""
+    sql = "SELECT tag, count FROM tag_counts WHERE count > 0"
+    params = []
+    if prefix:
+        # 前缀范围扫描走主键索引（比 LIKE 更可控，不受通配符影响）
+        sql += " AND tag >= ? AND tag < ?"
+        params.extend([prefix, prefix + "\U0010ffff"])
+    sql += " ORDER BY count DESC, tag ASC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    rows = _connect().execute(sql, params).fetchall()
+    return [{"tag": r[0], "count": int(r[1])} for r in rows]
+
+def get_dataset_count():
+    return int(_connect().execute("SELECT COUNT(*) FROM datasets").fetchone()[0])
+
 def _normalize_ids(ids):
     if ids is None:
         return []
@@ -75,22 +412,71 @@ def _normalize_ids(ids):
         ids_list = list(ids)
     return [i.strip() for i in ids_list if i and i.strip()]
 
-def add_record(rec_id, input_id_list, op_name, op_desc, output_ids, actor=None, source=None, run_id=None):
-    conn = _connect()
-    c = conn.cursor()
+def _insert_record_edges(conn, rec_id, input_ids, output_ids):
+    conn.executemany(
+        "INSERT OR IGNORE INTO record_inputs (record_id, dataset_id) VALUES (?, ?)",
+        [(rec_id, i) for i in _normalize_ids(input_ids)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO record_outputs (record_id, dataset_id) VALUES (?, ?)",
+        [(rec_id, o) for o in _normalize_ids(output_ids)],
+    )
+
+# 新增边 i -> o 后：任一祖先 a(i) 到任一后代 d(o) 的最短距离 = dist(a, i) + 1 + dist(o, d)
+_CLOSURE_UPSERT_SQL = """
+INSERT INTO lineage_closure (ancestor_id, descendant_id, min_distance)
+SELECT a.id, d.id, MIN(a.dist + 1 + d.dist)
+FROM (SELECT ancestor_id AS id, min_distance AS dist FROM lineage_closure WHERE descendant_id = ?1
+      UNION ALL SELECT ?1, 0) AS a,
+     (SELECT descendant_id AS id, min_distance AS dist FROM lineage_closure WHERE ancestor_id = ?2
+      UNION ALL SELECT ?2, 0) AS d
+WHERE a.id <> d.id
+GROUP BY a.id, d.id
+ON CONFLICT(ancestor_id, descendant_id) DO UPDATE SET min_distance = MIN(min_distance, excluded.min_distance)
+"""
+
+def _update_lineage_closure(conn, input_ids, output_ids):
+    input_ids = list(dict.fromkeys(_normalize_ids(input_ids)))
+    output_ids = list(dict.fromkeys(_normalize_ids(output_ids)))
+    for i in input_ids:
+        for o in output_ids:
+            if i != o:
+                conn.execute(_CLOSURE_UPSERT_SQL, (i, o))
+
+def _insert_record(conn, rec_id, input_id_list, op_name, op_desc, output_ids, actor=None, source=None, run_id=None, client_id=None):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     input_ids = _normalize_ids(input_id_list)
     output_ids = _normalize_ids(output_ids)
     input_ids_str = ",".join(input_ids)
     output_ids_str = ",".join(output_ids)
-    c.execute(
+    conn.execute(
         "INSERT INTO records (id, timestamp, input_ids, operation_name, operation_desc, output_id, actor, source, run_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (rec_id, timestamp, input_ids_str, op_name, op_desc, output_ids_str, actor, source, run_id),
     )
-    conn.commit()
-    conn.close()
+    if client_id:
+        conn.execute("INSERT INTO record_client_ids (client_id, record_id) VALUES (?, ?)", (client_id, rec_id))
+    _insert_record_edges(conn, rec_id, input_ids, output_ids)
+    _update_lineage_closure(conn, input_ids, output_ids)
+    conn.execute("UPDATE lineage_meta SET value = value + 1 WHERE key = 'version'")
+
+def add_record(rec_id, input_id_list, op_name, op_desc, output_ids, actor=None, source=None, run_id=None, client_id=None):
+    with transaction() as conn:
+        _insert_record(conn, rec_id, input_id_list, op_name, op_desc, output_ids, actor=actor, source=source, run_id=run_id, client_id=client_id)
     return rec_id
 
+def get_record_by_client_id(client_id):
+    """按客户端幂等键查找已写入的记录，不存在时返回 None"""
+    row = _connect().execute("SELECT record_id FROM record_client_ids WHERE client_id = ?", (client_id,)).fetchone()
+    if not row:
+        return None
+    records = get_records_by_ids([row[0]])
+    return records[0] if records else None
+
+def get_lineage_version():
+    """血缘版本号（records 每次写入递增），任何写入方经由 add_record 都会推进它"""
+    row = _connect().execute("SELECT value FROM lineage_meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
 def _normalize_ts(ts):
     if isinstance(ts, datetime):
         return ts.strftime("%Y-%m-%d %H:%M:%S")
@@ -98,34 +484,211 @@ def _normalize_ts(ts):
         return ts.strip()
     return str(ts)
 
+# --- 时间序列存储 ---
+# "chunked"：按 (dataset, metric) 分块的列式存储（timeseries_chunks，编码见 timeseries_store.py）
+# "rows"：每个点一行（timeseries 表，旧格式）
+# 读取时两种格式的数据合并返回，因此旧库无需迁移即可继续使用。
+TIMESERIES_STORAGE = "chunked"
+# 同一 (dataset, metric) 的未满块累计到该数量时合并
+_COMPACT_MIN_CHUNKS = 8
+# 旧格式中无法解析的时间戳排在最前，原样返回
+_UNPARSED_TS = -(2 ** 63)
+# 汇总粒度：名称 -> 桶宽（微秒），由细到粗
+_ROLLUP_TIERS = {"minute": 60 * 10 ** 6, "hour": 3600 * 10 ** 6, "day": 86400 * 10 ** 6}
+TIMESERIES_RESOLUTIONS = ("raw",) + tuple(_ROLLUP_TIERS)
+
+_ROLLUP_UPSERT_SQL = """
+    INSERT INTO timeseries_rollups (dataset_id, metric, tier, bucket, n, total, vmin, vmax, last_ts, last_value)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (dataset_id, tier, metric, bucket) DO UPDATE SET
+        n = n + excluded.n,
+        total = total + excluded.total,
+        vmin = MIN(vmin, excluded.vmin),
+        vmax = MAX(vmax, excluded.vmax),
+        last_value = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_value ELSE last_value END,
+        last_ts = MAX(last_ts, excluded.last_ts)
+"""
+
+def parse_timeseries_points(points):
+    """[{"timestamp", "value"}] 或 [(ts, v)] -> (epoch 微秒列表, 数值列表)；时间戳非法时抛 ValueError"""
+    times = []
+    values = []
+    for p in points:
+        if isinstance(p, dict):
+            ts, val = p.get("timestamp"), p.get("value")
+        else:
+            ts, val = p[0], p[1]
+        times.append(timeseries_store.to_epoch_us(ts))
+        values.append(float(val))
+    return times, values
+
+def _stored_tiers(conn, dataset_id, metric, times):
+    """
+    该序列需要维护汇总的粒度。首次写入至少两个不同时间戳时按其采样间隔（相邻间距中位数）决定并登记：
+    桶宽不大于间隔的粒度不再维护（已有的汇总行删除），读取时由原始块现场聚合。
+    """
+    rows = dict(conn.execute(
+        "SELECT tier, stored FROM timeseries_rollup_tiers WHERE dataset_id = ? AND metric = ?", (dataset_id, metric)
+    ).fetchall())
+    if not rows:
+        spacing = timeseries_store.median_spacing(times)
+        if spacing is None:
+            return list(_ROLLUP_TIERS)
+        rows = {tier: int(width > spacing) for tier, width in _ROLLUP_TIERS.items()}
+        conn.executemany(
+            "INSERT INTO timeseries_rollup_tiers (dataset_id, metric, tier, stored) VALUES (?, ?, ?, ?)",
+            [(dataset_id, metric, tier, stored) for tier, stored in rows.items()],
+        )
+        conn.executemany(
+            "DELETE FROM timeseries_rollups WHERE dataset_id = ? AND tier = ? AND metric = ?",
+            [(dataset_id, tier, metric) for tier, stored in rows.items() if not stored],
+        )
+    return [tier for tier in _ROLLUP_TIERS if rows.get(tier, 1)]
+
+def _raw_served_metrics(conn, dataset_id, tier):
+    """该数据集在 tier 粒度上不维护汇总（由原始块现场聚合）的指标"""
+    return {
+        r[0] for r in conn.execute(
+            "SELECT metric FROM timeseries_rollup_tiers WHERE dataset_id = ? AND tier = ? AND stored = 0", (dataset_id, tier)
+        ).fetchall()
+    }
+
+def _update_rollups(conn, dataset_id, metric, times, values):
+    rows = []
+    for tier in _stored_tiers(conn, dataset_id, metric, times):
+        rows.extend((dataset_id, metric, tier) + stats for stats in timeseries_store.bucket_stats(times, values, _ROLLUP_TIERS[tier]))
+    conn.executemany(_ROLLUP_UPSERT_SQL, rows)
+
+def _write_points(conn, dataset_id, metric, times, values):
+    if not len(times):
+        return 0
+    _update_rollups(conn, dataset_id, metric, times, values)
+    if TIMESERIES_STORAGE == "rows":
+        conn.executemany(
+            "INSERT INTO timeseries (dataset_id, timestamp, value, metric) VALUES (?, ?, ?, ?)",
+            [(dataset_id, timeseries_store.format_epoch_us(t), float(v), metric) for t, v in zip(times, values)],
+        )
+        return len(times)
+    chunks = timeseries_store.make_chunks(times, values)
+    conn.executemany(
+        "INSERT INTO timeseries_chunks (dataset_id, metric, t_min, t_max, n, ts, vals, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(dataset_id, metric) + c for c in chunks],
+    )
+    _compact_chunks(conn, dataset_id, metric)
+    return len(times)
+
+def _compact_chunks(conn, dataset_id, metric):
+    """
+    合并同一 (dataset, metric) 的未满块（频繁的小批量写入会产生大量小块）。
+    子数据集按 chunk_watermark 引用本数据集时，合并不能跨越任何 watermark，
+    否则会改变子数据集看到的数据；合并后的块复用被合并块中较大的 chunk_id。
+    """
+    small = [
+        r[0]
+        for r in conn.execute(
+            "SELECT chunk_id FROM timeseries_chunks WHERE dataset_id = ? AND metric = ? AND n < ? ORDER BY chunk_id",
+            (dataset_id, metric, timeseries_store.CHUNK_POINTS),
+        ).fetchall()
+    ]
+    if len(small) < _COMPACT_MIN_CHUNKS:
+        return
+    marks = sorted({
+        r[0] for r in conn.execute("SELECT chunk_watermark FROM timeseries_links WHERE source_id = ?", (dataset_id,)).fetchall()
+    })
+    groups = {}
+    for chunk_id in small:
+        groups.setdefault(bisect_left(marks, chunk_id), []).append(chunk_id)
+    for ids in groups.values():
+        if len(ids) < 2:
+            continue
+        placeholders = ",".join("?" * len(ids))
+        times, values = [], []
+        for r in conn.execute(
+            f"SELECT ts, vals, codec FROM timeseries_chunks WHERE chunk_id IN ({placeholders}) ORDER BY chunk_id", ids
+        ).fetchall():
+            chunk_times, chunk_values = timeseries_store.unpack(r[0], r[1], r[2])
+            times.extend(chunk_times.tolist())
+            values.extend(chunk_values.tolist())
+        chunks = timeseries_store.make_chunks(times, values)
+        conn.execute(f"DELETE FROM timeseries_chunks WHERE chunk_id IN ({placeholders})", ids)
+        conn.executemany(
+            "INSERT INTO timeseries_chunks (chunk_id, dataset_id, metric, t_min, t_max, n, ts, vals, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(chunk_id, dataset_id, metric) + c for chunk_id, c in zip(ids[-len(chunks):], chunks)],
+        )
+
 def add_timeseries_points(dataset_id, points, metric="value"):
     """
     写入时间序列点：points = [{"timestamp": "...", "value": 1.23}, ...] 或 [(ts, v), ...]
+    数据集若仍引用着继承的序列，首次写入前先在同一事务内物化。
     """
     if not points:
         return 0
-    conn = _connect()
-    c = conn.cursor()
-    rows = []
-    for p in points:
-        if isinstance(p, dict):
-            ts = _normalize_ts(p.get("timestamp"))
-            val = p.get("value")
-        else:
-            ts = _normalize_ts(p[0])
-            val = p[1]
-        rows.append((dataset_id, ts, float(val), metric))
-    c.executemany("INSERT INTO timeseries (dataset_id, timestamp, value, metric) VALUES (?, ?, ?, ?)", rows)
-    conn.commit()
-    conn.close()
-    return len(rows)
-
-def get_timeseries(dataset_id, start=None, end=None, metric=None, limit=1000):
-    conn = _connect()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    sql = "SELECT * FROM timeseries WHERE dataset_id = ?"
-    params = [dataset_id]
+    return add_timeseries_series(dataset_id, {metric: parse_timeseries_points(points)})
+
+def add_timeseries_series(dataset_id, series):
+    """
+    在一个事务内写入多个指标：series = {metric: (times, values)}，times 为纪元微秒（列表或 numpy 数组）。
+    流式写入按块调用，每块一个事务。返回写入的点数。
+    """
+    series = {metric: (times, values) for metric, (times, values) in series.items() if len(times)}
+    if not series:
+        return 0
+    with transaction() as conn:
+        _materialize_links(conn, dataset_id)
+        return sum(_write_points(conn, dataset_id, metric, times, values) for metric, (times, values) in series.items())
+
+def _timeseries_links(conn, dataset_id):
+    """[(source_id, metric_prefix, watermark, chunk_watermark), ...]，按继承顺序"""
+    return [
+        tuple(r)
+        for r in conn.execute(
+            "SELECT source_id, metric_prefix, watermark, chunk_watermark FROM timeseries_links WHERE child_id = ? ORDER BY position",
+            (dataset_id,),
+        ).fetchall()
+    ]
+
+def _time_bounds(start, end):
+    """start / end -> (lo, hi) 纪元微秒（闭区间，None 表示不限）；非法时抛 ValueError"""
+    lo = timeseries_store.to_epoch_us(start) if start else None
+    hi = timeseries_store.to_epoch_us(end) if end else None
+    if isinstance(end, str) and len(end.strip()) == 10:
+        # 与原先的文本比较保持一致：end 只给日期时（timestamp <= 'YYYY-MM-DD'）不含当天
+        hi -= 1
+    return lo, hi
+
+def _source_segments(conn, source_id, prefix, watermark, chunk_watermark, metric=None, lo=None, hi=None, start=None, end=None):
+    """
+    单个来源的已排序片段：[(times, values, metric, texts), ...]。
+    - 列式块：只读取与 [lo, hi] 相交的块，块内二分截取
+    - 旧格式行：按 start / end 文本过滤，按指标分组成片段，texts 保留原始时间戳文本
+    watermark / chunk_watermark 为 None 表示不截断（数据集自有数据）。
+    """
+    segments = []
+    sql = "SELECT metric, ts, vals, codec FROM timeseries_chunks WHERE dataset_id = ?"
+    params = [source_id]
+    if chunk_watermark is not None:
+        sql += " AND chunk_id <= ?"
+        params.append(chunk_watermark)
+    if metric:
+        sql += " AND metric = ?"
+        params.append(metric)
+    if lo is not None:
+        sql += " AND t_max >= ?"
+        params.append(lo)
+    if hi is not None:
+        sql += " AND t_min <= ?"
+        params.append(hi)
+    for r in conn.execute(sql + " ORDER BY chunk_id", params).fetchall():
+        times, values = timeseries_store.unpack(r["ts"], r["vals"], r["codec"])
+        times, values = timeseries_store.slice_range(times, values, lo, hi)
+        if len(times):
+            segments.append((times, values, prefix + r["metric"], None))
+
+    sql = "SELECT timestamp, value, metric FROM timeseries WHERE dataset_id = ?"
+    params = [source_id]
+    if watermark is not None:
+        sql += " AND id <= ?"
+        params.append(watermark)
     if metric:
         sql += " AND metric = ?"
         params.append(metric)
@@ -135,91 +698,623 @@ def get_timeseries(dataset_id, start=None, end=None, metric=None, limit=1000):
     if end:
         sql += " AND timestamp <= ?"
         params.append(_normalize_ts(end))
-    sql += " ORDER BY timestamp ASC LIMIT ?"
-    params.append(int(limit or 1000))
-    c.execute(sql, params)
-    rows = c.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    by_metric = {}
+    for r in conn.execute(sql + " ORDER BY timestamp, id", params).fetchall():
+        try:
+            key = timeseries_store.to_epoch_us(r["timestamp"])
+        except ValueError:
+            key = _UNPARSED_TS
+        by_metric.setdefault(prefix + r["metric"], []).append((key, float(r["value"]), r["timestamp"]))
+    for label, rows in by_metric.items():
+        rows.sort(key=lambda x: x[0])
+        segments.append(([x[0] for x in rows], [x[1] for x in rows], label, [x[2] for x in rows]))
+    return segments
 
-def copy_timeseries(from_dataset_ids, to_dataset_id, prefix_metric=False):
+def _timeseries_sources(conn, dataset_id, metric=None, include_own=True):
+    """数据集序列的来源（自有 + 继承），指标过滤下推到来源：[(source_id, prefix, watermark, chunk_watermark, src_metric)]"""
+    sources = [(dataset_id, "", None, None)] if include_own else []
+    sources += _timeseries_links(conn, dataset_id)
+    results = []
+    for source_id, prefix, watermark, chunk_watermark in sources:
+        src_metric = None
+        if metric:
+            # 只有前缀匹配的来源才可能命中
+            if not metric.startswith(prefix):
+                continue
+            src_metric = metric[len(prefix):]
+        results.append((source_id, prefix, watermark, chunk_watermark, src_metric))
+    return results
+
+def _collect_segments(conn, dataset_id, start=None, end=None, metric=None, include_own=True):
+    """
+    收集数据集完整序列（自有 + 继承）的已排序片段：[(times, values, metric, texts), ...]。
+    继承来源按 watermark / chunk_watermark 截断，指标名加上 metric_prefix。
+    """
+    lo, hi = _time_bounds(start, end)
+    segments = []
+    for source_id, prefix, watermark, chunk_watermark, src_metric in _timeseries_sources(conn, dataset_id, metric, include_own):
+        segments.extend(_source_segments(conn, source_id, prefix, watermark, chunk_watermark, src_metric, lo, hi, start, end))
+    return segments
+
+def _source_has_newer(conn, source_id, watermark, chunk_watermark):
+    """继承登记之后来源是否又写入了数据（此时来源的汇总包含子数据集看不到的点）"""
+    return bool(
+        conn.execute("SELECT 1 FROM timeseries_chunks WHERE dataset_id = ? AND chunk_id > ? LIMIT 1", (source_id, chunk_watermark)).fetchone()
+        or conn.execute("SELECT 1 FROM timeseries WHERE dataset_id = ? AND id > ? LIMIT 1", (source_id, watermark)).fetchone()
+    )
+
+def _rollup_stats(conn, dataset_id, tier, start=None, end=None, metric=None):
+    """
+    按汇总粒度读取：返回与 [start, end] 相交的桶 [((bucket, metric), [n, total, vmin, vmax, last_ts, last_value]), ...]，
+    按 (bucket, metric) 排序（边界桶汇总整个桶）。
+    自有数据与登记后未再写入的来源直接读 timeseries_rollups；
+    登记后又写入过的来源，以及不维护该粒度汇总的指标（见 _stored_tiers），按 watermark 截断读取原始点并现场聚合。
+    同名指标跨来源合并。
+    """
+    width = _ROLLUP_TIERS[tier]
+    lo, hi = _time_bounds(start, end)
+    blo = lo - lo % width if lo is not None else None
+    bhi = hi - hi % width if hi is not None else None
+    buckets = {}
+
+    def add(label, stats):
+        bucket, n, total, vmin, vmax, last_ts, last_value = stats
+        cur = buckets.get((bucket, label))
+        if cur is None:
+            buckets[(bucket, label)] = [n, total, vmin, vmax, last_ts, last_value]
+            return
+        cur[0] += n
+        cur[1] += total
+        cur[2] = min(cur[2], vmin)
+        cur[3] = max(cur[3], vmax)
+        if last_ts >= cur[4]:
+            cur[4], cur[5] = last_ts, last_value
+
+    def add_raw(source_id, prefix, watermark, chunk_watermark, src_metric):
+        end_us = bhi + width - 1 if bhi is not None else None
+        segments = _source_segments(
+            conn, source_id, prefix, watermark, chunk_watermark, src_metric, blo, end_us,
+            timeseries_store.format_epoch_us(blo) if blo is not None else None,
+            timeseries_store.format_epoch_us(end_us) if end_us is not None else None,
+        )
+        by_metric = {}
+        for times, values, label, texts in segments:
+            times_out, values_out = by_metric.setdefault(label, ([], []))
+            for t, v in zip(times, values):
+                if t != _UNPARSED_TS:
+                    times_out.append(int(t))
+                    values_out.append(float(v))
+        for label, (times, values) in by_metric.items():
+            for stats in timeseries_store.bucket_stats(times, values, width):
+                add(label, stats)
+
+    for source_id, prefix, watermark, chunk_watermark, src_metric in _timeseries_sources(conn, dataset_id, metric):
+        if watermark is not None and _source_has_newer(conn, source_id, watermark, chunk_watermark):
+            add_raw(source_id, prefix, watermark, chunk_watermark, src_metric)
+            continue
+        raw_served = _raw_served_metrics(conn, source_id, tier)
+        if src_metric in raw_served:
+            add_raw(source_id, prefix, watermark, chunk_watermark, src_metric)
+            continue
+        if not src_metric:
+            # 这些指标没有汇总行，下面的查询不会重复计入
+            for raw_metric in sorted(raw_served):
+                add_raw(source_id, prefix, watermark, chunk_watermark, raw_metric)
+
+        sql = "SELECT metric, bucket, n, total, vmin, vmax, last_ts, last_value FROM timeseries_rollups WHERE dataset_id = ? AND tier = ?"
+        params = [source_id, tier]
+        if src_metric:
+            sql += " AND metric = ?"
+            params.append(src_metric)
+        if blo is not None:
+            sql += " AND bucket >= ?"
+            params.append(blo)
+        if bhi is not None:
+            sql += " AND bucket <= ?"
+            params.append(bhi)
+        for r in conn.execute(sql, params).fetchall():
+            add(prefix + r[0], tuple(r[1:]))
+
+    return sorted(buckets.items())
+
+def _rollup_buckets(conn, dataset_id, tier, start=None, end=None, metric=None, limit=1000):
+    """_rollup_stats 的结果格式化为点：value 为均值，另含 count/min/max/mean/last"""
+    items = _rollup_stats(conn, dataset_id, tier, start=start, end=end, metric=metric)[: int(limit or 1000)]
+    formatted = timeseries_store.format_epoch_us_many([key[0] for key, _ in items])
+    results = []
+    for ts, (key, stats) in zip(formatted, items):
+        n, total, vmin, vmax, _, last_value = stats
+        results.append({
+            "dataset_id": dataset_id, "timestamp": ts, "value": total / n, "metric": key[1],
+            "count": n, "min": vmin, "max": vmax, "mean": total / n, "last": last_value,
+        })
+    return results
+
+def choose_timeseries_resolution(dataset_id, start=None, end=None, metric=None, max_points=1000):
+    """
+    选出能在 max_points 个点内回答查询的最细粒度（raw -> minute -> hour -> day，都超出时取 day）。
+    点数按上界估算：原始点数为相交块的点数之和 + 旧格式行数，汇总桶数为各来源的桶数之和
+    （不维护该粒度汇总的指标按原始点数计），均不需要解码数据。
+    """
+    conn = _connect()
+    lo, hi = _time_bounds(start, end)
+    sources = _timeseries_sources(conn, dataset_id, metric)
+
+    def raw_count(source_id, watermark, chunk_watermark, src_metric):
+        """原始点数：相交块的点数之和 + 旧格式行数"""
+        sql = "SELECT COALESCE(SUM(n), 0) FROM timeseries_chunks WHERE dataset_id = ?"
+        params = [source_id]
+        if chunk_watermark is not None:
+            sql += " AND chunk_id <= ?"
+            params.append(chunk_watermark)
+        if src_metric:
+            sql += " AND metric = ?"
+            params.append(src_metric)
+        if lo is not None:
+            sql += " AND t_max >= ?"
+            params.append(lo)
+        if hi is not None:
+            sql += " AND t_min <= ?"
+            params.append(hi)
+        count = conn.execute(sql, params).fetchone()[0]
+        sql = "SELECT COUNT(*) FROM timeseries WHERE dataset_id = ?"
+        params = [source_id]
+        if watermark is not None:
+            sql += " AND id <= ?"
+            params.append(watermark)
+        if src_metric:
+            sql += " AND metric = ?"
+            params.append(src_metric)
+        if start:
+            sql += " AND timestamp >= ?"
+            params.append(_normalize_ts(start))
+        if end:
+            sql += " AND timestamp <= ?"
+            params.append(_normalize_ts(end))
+        return count + conn.execute(sql, params).fetchone()[0]
+
+    raw_counts = [raw_count(source_id, watermark, chunk_watermark, src_metric) for source_id, _, watermark, chunk_watermark, src_metric in sources]
+    if sum(raw_counts) <= max_points:
+        return "raw"
+
+    for tier, width in _ROLLUP_TIERS.items():
+        count = 0
+        for (source_id, _, _, _, src_metric), source_raw in zip(sources, raw_counts):
+            raw_served = _raw_served_metrics(conn, source_id, tier)
+            if src_metric in raw_served:
+                count += source_raw
+                continue
+            if not src_metric and raw_served:
+                # 上界：来源的全部原始点数（按指标分别计数会在旧格式行表上走全表扫描）
+                count += source_raw
+            sql = "SELECT COUNT(*) FROM timeseries_rollups WHERE dataset_id = ? AND tier = ?"
+            params = [source_id, tier]
+            if src_metric:
+                sql += " AND metric = ?"
+                params.append(src_metric)
+            if lo is not None:
+                sql += " AND bucket >= ?"
+                params.append(lo - lo % width)
+            if hi is not None:
+                sql += " AND bucket <= ?"
+                params.append(hi - hi % width)
+            count += conn.execute(sql, params).fetchone()[0]
+        if count <= max_points:
+            return tier
+    return "day"
+
+def iter_timeseries(dataset_id, metric="value", start=None, end=None, batch_points=timeseries_store.CHUNK_POINTS * 4):
+    """
+    按时间顺序逐批读取单个指标（自有 + 继承），每批 yield (times, values)（纪元微秒 / 数值，均为 numpy 数组）。
+    批次按块头 (t_min, n) 切分时间轴，每批约 batch_points 个点，只解码与该批时间窗相交的块；
+    无法解析时间戳的旧格式行会被跳过。供服务端分析（resample / rolling）使用。
+    """
+    conn = _connect()
+    lo, hi = _time_bounds(start, end)
+    sources = _timeseries_sources(conn, dataset_id, metric or "value")
+    headers = []
+    for source_id, _, _, chunk_watermark, src_metric in sources:
+        sql = "SELECT t_min, n FROM timeseries_chunks WHERE dataset_id = ? AND metric = ?"
+        params = [source_id, src_metric]
+        if chunk_watermark is not None:
+            sql += " AND chunk_id <= ?"
+            params.append(chunk_watermark)
+        if lo is not None:
+            sql += " AND t_max >= ?"
+            params.append(lo)
+        if hi is not None:
+            sql += " AND t_min <= ?"
+            params.append(hi)
+        headers.extend(tuple(r) for r in conn.execute(sql, params).fetchall())
+
+    # 窗口边界：按 t_min 顺序累计块的点数，满 batch_points 就在下一个块的 t_min 处切开
+    cuts = []
+    acc = 0
+    for t_min, n in sorted(headers):
+        if acc >= batch_points and (lo is None or t_min > lo) and (not cuts or t_min > cuts[-1]):
+            cuts.append(t_min)
+            acc = 0
+        acc += n
+    bounds = [lo] + cuts
+    for k, win_lo in enumerate(bounds):
+        win_hi = cuts[k] - 1 if k < len(cuts) else hi
+        segments = []
+        for source_id, prefix, watermark, chunk_watermark, src_metric in sources:
+            segments.extend(_source_segments(
+                conn, source_id, prefix, watermark, chunk_watermark, src_metric, win_lo, win_hi,
+                timeseries_store.format_epoch_us(win_lo) if win_lo is not None else None,
+                timeseries_store.format_epoch_us(win_hi) if win_hi is not None else None,
+            ))
+        times, values = timeseries_store.concat_sorted([(seg[0], seg[1]) for seg in segments])
+        keep = times != _UNPARSED_TS
+        if len(times) and not keep.all():
+            times, values = times[keep], values[keep]
+        if len(times):
+            yield times, values
+
+def _aligned_points(dataset_id, metric, start, end, resolution):
+    """单个序列按时间升序逐点 yield (t, v)；同一时间戳有多个点时只保留最后一个"""
+    if resolution and resolution != "raw":
+        for (bucket, _), stats in _rollup_stats(_connect(), dataset_id, resolution, start=start, end=end, metric=metric):
+            yield bucket, stats[1] / stats[0]
+        return
+    prev_t = prev_v = None
+    for times, values in iter_timeseries(dataset_id, metric=metric, start=start, end=end):
+        for t, v in zip(times.tolist(), values.tolist()):
+            if prev_t is not None and t != prev_t:
+                yield prev_t, prev_v
+            prev_t, prev_v = t, v
+    if prev_t is not None:
+        yield prev_t, prev_v
+
+def _tag_points(k, points):
+    for t, v in points:
+        yield t, k, v
+
+def get_aligned_timeseries(series, start=None, end=None, resolution="raw", how="outer", fill=None, limit=1000):
+    """
+    多序列按时间对齐：series = [(dataset_id, metric), ...]，各序列逐批读取后在一次 k 路归并中按时间戳合并。
+    - resolution：raw 按原始时间戳对齐；minute / hour / day 按汇总桶（取均值）对齐
+    - how：outer 保留任一序列有值的时间戳，inner 只保留所有序列都有值的时间戳
+    - fill：None 缺失为 None；"ffill" 用该序列之前最近的值填充
+    返回 {"timestamps": [...], "series": [{"dataset_id", "metric", "values": [...]}]}，最多 limit 行。
+    """
+    if resolution not in TIMESERIES_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(TIMESERIES_RESOLUTIONS)}")
+    if how not in ("outer", "inner"):
+        raise ValueError("how must be outer or inner")
+    if fill not in (None, "ffill"):
+        raise ValueError("fill must be ffill or empty")
+    streams = [
+        _tag_points(k, _aligned_points(dataset_id, metric, start, end, resolution))
+        for k, (dataset_id, metric) in enumerate(series)
+    ]
+    timestamps = []
+    columns = [[] for _ in series]
+    last = [None] * len(series)
+    row = [None] * len(series)
+    row_t = None
+
+    def emit():
+        present = [x is not None for x in row]
+        if how == "inner" and not all(present):
+            return
+        timestamps.append(row_t)
+        for k, col in enumerate(columns):
+            col.append(row[k] if present[k] or fill is None else last[k])
+
+    for t, k, v in heapq.merge(*streams):
+        if t != row_t:
+            if row_t is not None:
+                emit()
+                if len(timestamps) >= limit:
+                    break
+            row_t = t
+            row = [None] * len(series)
+        row[k] = v
+        last[k] = v
+    else:
+        if row_t is not None:
+            emit()
+    return {
+        "timestamps": timeseries_store.format_epoch_us_many(timestamps[:limit]),
+        "series": [
+            {"dataset_id": dataset_id, "metric": metric, "values": col[:limit]}
+            for (dataset_id, metric), col in zip(series, columns)
+        ],
+    }
+
+def get_timeseries(dataset_id, start=None, end=None, metric=None, limit=1000, resolution=None, max_points=None):
+    """
+    读取序列（继承的序列在读取时解析，不需要物化）；start/end 非法时抛 ValueError。
+    resolution 为 raw / minute / hour / day 之一；只给 max_points 时自动选择粒度（见 choose_timeseries_resolution），
+    且最多返回 max_points 个点。汇总粒度的每个点为一个桶：value 为均值，另含 count/min/max/mean/last。
+    """
+    if max_points:
+        limit = max_points
+        if not resolution:
+            resolution = choose_timeseries_resolution(dataset_id, start=start, end=end, metric=metric, max_points=max_points)
+    if resolution and resolution not in TIMESERIES_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(TIMESERIES_RESOLUTIONS)}")
+    if resolution and resolution != "raw":
+        return _rollup_buckets(_connect(), dataset_id, resolution, start=start, end=end, metric=metric, limit=limit)
+    segments = _collect_segments(_connect(), dataset_id, start=start, end=end, metric=metric)
+    merged = timeseries_store.merge_segments([(s[0], s[1]) for s in segments], limit=int(limit or 1000))
+    formatted = timeseries_store.format_epoch_us_many([m[0] for m in merged])
+    results = []
+    for ts, (_, v, k, i) in zip(formatted, merged):
+        _, _, label, texts = segments[k]
+        if texts is not None:
+            ts = texts[i]
+        results.append({"dataset_id": dataset_id, "timestamp": ts, "value": v, "metric": label})
+    return results
+
+def _write_segments(conn, dataset_id, segments, metric_prefix=""):
+    """把 _collect_segments 的结果写成 dataset_id 的自有数据，返回点数"""
+    by_metric = {}
+    legacy = []
+    for times, values, label, texts in segments:
+        times_out, values_out = by_metric.setdefault(metric_prefix + label, ([], []))
+        for i, (t, v) in enumerate(zip(times, values)):
+            if t == _UNPARSED_TS:
+                legacy.append((dataset_id, texts[i], float(v), metric_prefix + label))
+            else:
+                times_out.append(int(t))
+                values_out.append(float(v))
+    total = 0
+    for label, (times, values) in by_metric.items():
+        total += _write_points(conn, dataset_id, label, times, values)
+    if legacy:
+        # 无法解析的旧时间戳原样写回行存储
+        conn.executemany("INSERT INTO timeseries (dataset_id, timestamp, value, metric) VALUES (?, ?, ?, ?)", legacy)
+    return total + len(legacy)
+
+def _link_timeseries(conn, from_dataset_ids, to_dataset_id, prefix_metric=False):
+    """
+    登记继承关系（不复制数据）。每个输入展开为：输入自身（watermark / chunk_watermark 取当前最大 id，
+    之后写入输入的数据不会出现在子数据集中）+ 输入已有的继承链接（沿用原 watermark）。
+    多输入且 prefix_metric 时，指标名前缀为 "<输入 id>:"，与 copy_timeseries 一致。
+    """
     src_ids = _normalize_ids(from_dataset_ids)
     if not src_ids:
         return 0
-    conn = _connect()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    placeholders = ",".join("?" * len(src_ids))
-    c.execute(
-        f"SELECT dataset_id, timestamp, value, metric FROM timeseries WHERE dataset_id IN ({placeholders}) ORDER BY timestamp ASC",
-        src_ids,
-    )
-    rows = c.fetchall()
-    if not rows:
-        conn.close()
-        return 0
-    out_rows = []
+    watermark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM timeseries").fetchone()[0]
+    chunk_watermark = conn.execute("SELECT COALESCE(MAX(chunk_id), 0) FROM timeseries_chunks").fetchone()[0]
     use_prefix = prefix_metric and len(src_ids) > 1
-    for r in rows:
-        metric = r["metric"]
-        if use_prefix:
-            metric = f"{r['dataset_id']}:{metric}"
-        out_rows.append((to_dataset_id, r["timestamp"], float(r["value"]), metric))
-    c.executemany(
-        "INSERT INTO timeseries (dataset_id, timestamp, value, metric) VALUES (?, ?, ?, ?)",
-        out_rows,
+    links = []
+    for src in src_ids:
+        prefix = f"{src}:" if use_prefix else ""
+        links.append((src, prefix, watermark, chunk_watermark))
+        for source_id, src_prefix, src_watermark, src_chunk_watermark in _timeseries_links(conn, src):
+            links.append((source_id, prefix + src_prefix, src_watermark, src_chunk_watermark))
+    start = conn.execute(
+        "SELECT COALESCE(MAX(position), -1) + 1 FROM timeseries_links WHERE child_id = ?", (to_dataset_id,)
+    ).fetchone()[0]
+    conn.executemany(
+        "INSERT INTO timeseries_links (child_id, position, source_id, metric_prefix, watermark, chunk_watermark) VALUES (?, ?, ?, ?, ?, ?)",
+        [(to_dataset_id, start + k) + link for k, link in enumerate(links)],
     )
-    conn.commit()
-    conn.close()
-    return len(out_rows)
+    return len(links)
+
+def inherit_timeseries(from_dataset_ids, to_dataset_id, prefix_metric=False):
+    """时间序列继承：以引用代替复制，读取时解析；返回登记的链接数"""
+    with transaction() as conn:
+        return _link_timeseries(conn, from_dataset_ids, to_dataset_id, prefix_metric=prefix_metric)
+
+def _materialize_links(conn, dataset_id):
+    if not _timeseries_links(conn, dataset_id):
+        return 0
+    inserted = _write_segments(conn, dataset_id, _collect_segments(conn, dataset_id, include_own=False))
+    conn.execute("DELETE FROM timeseries_links WHERE child_id = ?", (dataset_id,))
+    # 依赖本数据集的子数据集在登记时已展开到实际来源，且 watermark 早于这里新写入的数据，不受影响
+    return inserted
+
+def materialize_timeseries(dataset_id):
+    """把继承的序列物化为数据集自有数据（显式请求时使用），返回写入的点数"""
+    with transaction() as conn:
+        return _materialize_links(conn, dataset_id)
+
+def get_timeseries_links(dataset_id):
+    """数据集的继承来源：[{"source_id", "metric_prefix", "watermark", "chunk_watermark"}]"""
+    return [
+        {"source_id": s, "metric_prefix": p, "watermark": w, "chunk_watermark": cw}
+        for s, p, w, cw in _timeseries_links(_connect(), dataset_id)
+    ]
+
+def _copy_series(conn, copies):
+    """物理复制：copies = [(src_ids, to_dataset_id, prefix_metric), ...]，每个来源只读取一次"""
+    cache = {}
+    total = 0
+    for src_ids, to_id, prefix_metric in copies:
+        use_prefix = prefix_metric and len(src_ids) > 1
+        for src in src_ids:
+            if src not in cache:
+                cache[src] = _collect_segments(conn, src)
+            total += _write_segments(conn, to_id, cache[src], metric_prefix=f"{src}:" if use_prefix else "")
+    return total
+
+def copy_timeseries(from_dataset_ids, to_dataset_id, prefix_metric=False):
+    src_ids = _normalize_ids(from_dataset_ids)
+    if not src_ids:
+        return 0
+    with transaction() as conn:
+        return _copy_series(conn, [(src_ids, to_dataset_id, prefix_metric)])
+
+class UnitOfWork:
+    """
+    把一次变换的全部写入（输出数据集、时间序列继承、血缘记录）收集起来，
+    commit() 在单个事务内用 executemany 落库：要么全部成功，要么全部回滚，不会留下孤儿数据集。
+    inherit_timeseries 只登记引用；copy_timeseries 物理复制时，每个输入序列只读取一次，多个输出共享同一份结果。
+
+        uow = UnitOfWork()
+        uow.add_dataset(new_id, name, desc, tags)
+        uow.inherit_timeseries(input_ids, new_id, prefix_metric=True)
+        uow.add_record(rec_id, input_ids, op_name, op_desc, [new_id])
+        uow.commit()
+    """
+
+    def __init__(self):
+        self.datasets = []
+        self.copies = []
+        self.links = []
+        self.records = []
+
+    def add_dataset(self, ds_id, name, desc, tags):
+        self.datasets.append((ds_id, name, desc, list(tags or [])))
+        return ds_id
+
+    def copy_timeseries(self, from_dataset_ids, to_dataset_id, prefix_metric=False):
+        self.copies.append((_normalize_ids(from_dataset_ids), to_dataset_id, prefix_metric))
+
+    def inherit_timeseries(self, from_dataset_ids, to_dataset_id, prefix_metric=False):
+        self.links.append((from_dataset_ids, to_dataset_id, prefix_metric))
+
+    def add_record(self, rec_id, input_id_list, op_name, op_desc, output_ids, actor=None, source=None, run_id=None, client_id=None):
+        self.records.append((rec_id, input_id_list, op_name, op_desc, output_ids, dict(actor=actor, source=source, run_id=run_id, client_id=client_id)))
+        return rec_id
+
+    def commit(self):
+        with transaction() as conn:
+            if self.datasets:
+                _insert_datasets(conn, self.datasets)
+                conn.executemany(_REGISTER_NAME_SQL, [(name, ds_id) for ds_id, name, _, _ in self.datasets])
+
+            if self.copies:
+                _copy_series(conn, self.copies)
+            for from_ids, to_id, prefix_metric in self.links:
+                _link_timeseries(conn, from_ids, to_id, prefix_metric=prefix_metric)
+
+            for rec_id, input_id_list, op_name, op_desc, output_ids, extra in self.records:
+                _insert_record(conn, rec_id, input_id_list, op_name, op_desc, output_ids, **extra)
 
 # --- 高级查询与搜索 ---
 
 def get_dataset_by_id(ds_id):
-    conn = _connect()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM datasets WHERE id=?", (ds_id,))
-    row = c.fetchone()
-    conn.close()
+    row = _connect().execute("SELECT * FROM datasets WHERE id=?", (ds_id,)).fetchone()
     return dict(row) if row else None
 
+def get_datasets_by_ids(ds_ids):
+    """批量按 id 获取数据集：返回 {id: dataset}"""
+    conn = _connect()
+    result = {}
+    for batch in _chunked(set(ds_ids or [])):
+        placeholders = ",".join("?" * len(batch))
+        for r in conn.execute(f"SELECT * FROM datasets WHERE id IN ({placeholders})", batch).fetchall():
+            result[r["id"]] = dict(r)
+    return result
+
 def get_all_datasets():
     # 默认获取所有，用于初始化
     return search_datasets()
 
-def search_datasets(query=None, tags=None):
+# --- 数据集全文检索（FTS5） ---
+
+def _detect_fts5():
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        return True
+    except sqlite3.Error:
+        return False
+
+# 部分 SQLite 编译版本不带 FTS5，此时退化为 LIKE 扫描
+_HAS_FTS5 = _detect_fts5()
+
+# unicode61 分词器会把连续的中日韩字符当成一个词，这里逐字切开，
+# 查询时再按短语匹配，从而支持中文子串检索
+_CJK_RE = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])")
+# bm25 列权重：名称命中比描述命中更相关
+_FTS_WEIGHTS = "10.0, 1.0"
+
+def _fts_text(text):
+    return _CJK_RE.sub(r" \1 ", text or "")
+
+def _index_dataset_fts(conn, rowid, name, description):
+    conn.execute(
+        "INSERT INTO datasets_fts (rowid, name, description) VALUES (?, ?, ?)",
+        (rowid, _fts_text(name), _fts_text(description)),
+    )
+
+def _fts_query(query):
+    """用户输入 -> FTS5 MATCH 表达式：每个词做前缀匹配，词之间为 AND；无可检索的词时返回 None"""
+    parts = []
+    for word in (query or "").split():
+        tokens = re.findall(r"[^\W_]+", _fts_text(word))
+        if tokens:
+            parts.append('"' + " ".join(tokens) + '"*')
+    return " ".join(parts) or None
+
+def _tags_filter_sql(tags, tag_mode="any"):
     """
-    Hugging Face 风格搜索：支持名称/描述模糊匹配 + 标签过滤
+    标签过滤子查询：每个标签是 dataset_tags 主键上的一次索引范围扫描，
+    any 取并集（UNION），all 取交集（INTERSECT）。
     """
-    conn = _connect()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    sql = "SELECT * FROM datasets WHERE 1=1"
+    tags = _normalize_tags(tags)
+    if not tags:
+        return "", []
+    if tag_mode not in ("any", "all"):
+        raise ValueError("tag_mode must be any or all")
+    op = " UNION " if tag_mode == "any" else " INTERSECT "
+    sub = op.join("SELECT dataset_id FROM dataset_tags WHERE tag = ?" for _ in tags)
+    return f" AND d.id IN ({sub})", tags
+
+def search_datasets_page(query=None, tags=None, limit=50, cursor=None, tag_mode="any"):
+    """
+    数据集检索（分页）：
+    - query: 名称/描述全文检索（FTS5，前缀匹配，按 bm25 相关度排序）；不可用时退化为 LIKE
+    - tags/tag_mode: 标签精确过滤，any 为包含任一标签，all 为包含全部标签
+    - limit/cursor: keyset 分页，cursor 为上一页返回的 next_cursor
+    返回：(datasets, next_cursor)
+    """
+    fts_query = _fts_query(query) if (query and _HAS_FTS5) else None
     params = []
-    
-    if query:
-        # 搜索名称或描述
-        sql += " AND (name LIKE ? OR description LIKE ?)"
-        params.extend([f"%{query}%", f"%{query}%"])
-    
-    if tags:
-        # 筛选标签 (简单实现：只要包含其中一个标签即可)
-        # 也可以改为必须包含所有标签，视需求而定
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f"%{tag}%")
-        if tag_conditions:
-            sql += " AND (" + " OR ".join(tag_conditions) + ")"
-            
-    sql += " ORDER BY created_at DESC"
-    
-    c.execute(sql, params)
-    rows = c.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    if fts_query:
+        rank = f"bm25(datasets_fts, {_FTS_WEIGHTS})"
+        sql = f"SELECT d.*, {rank} AS _rank, d.rowid AS _rowid FROM datasets_fts JOIN datasets d ON d.rowid = datasets_fts.rowid WHERE datasets_fts MATCH ?"
+        params.append(fts_query)
+        order = f" ORDER BY {rank} ASC, d.rowid ASC"
+        keyset = f" AND ({rank}, d.rowid) > (?, ?)"
+    else:
+        sql = "SELECT d.*, d.created_at AS _rank, d.rowid AS _rowid FROM datasets d WHERE 1=1"
+        if query:
+            sql += " AND (d.name LIKE ? OR d.description LIKE ?)"
+            params.extend([f"%{query}%", f"%{query}%"])
+        order = " ORDER BY d.created_at DESC, d.rowid DESC"
+        keyset = " AND (d.created_at, d.rowid) < (?, ?)"
+
+    tag_sql, tag_params = _tags_filter_sql(tags, tag_mode)
+    sql += tag_sql
+    params.extend(tag_params)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != 2:
+            raise ValueError("invalid cursor")
+        sql += keyset
+        params.extend(values)
+    sql += order
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit) + 1)
+
+    rows = _connect().execute(sql, params).fetchall()
+    page = rows[: int(limit)] if limit is not None else rows
+    next_cursor = None
+    if limit is not None and len(rows) > int(limit) and page:
+        next_cursor = encode_cursor([page[-1]["_rank"], page[-1]["_rowid"]])
+    results = []
+    for r in page:
+        ds = dict(r)
+        ds.pop("_rank", None)
+        ds.pop("_rowid", None)
+        results.append(ds)
+    return results, next_cursor
+
+def search_datasets(query=None, tags=None, limit=None, tag_mode="any"):
+    """
+    Hugging Face 风格搜索：支持名称/描述全文检索 + 标签过滤（不分页，limit 为 None 时返回全部）
+    """
+    results, _ = search_datasets_page(query=query, tags=tags, limit=limit, tag_mode=tag_mode)
+    return results
 
 # database.py 中补上这段代码
 
@@ -233,55 +1328,62 @@ def _row_to_record(row):
 
 def get_all_records():
     """获取所有记录，用于初始化过滤器等"""
-    conn = _connect()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM records ORDER BY timestamp ASC")
-    rows = c.fetchall()
-    conn.close()
+    rows = _connect().execute("SELECT * FROM records ORDER BY timestamp ASC").fetchall()
     return [_row_to_record(r) for r in rows]
 
-def _build_records_filter_sql(start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None):
-    sql = " FROM records WHERE 1=1"
+def _records_filter_clause(alias="", start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None):
+    """records 过滤条件片段（以 " AND ..." 拼接）；alias 用于在 JOIN / CTE 中引用 records 表别名。"""
+    p = f"{alias}." if alias else ""
+    sql = ""
     params = []
 
     if start_date:
-        sql += " AND timestamp >= ?"
+        sql += f" AND {p}timestamp >= ?"
         params.append(start_date.strftime("%Y-%m-%d 00:00:00"))
     if end_date:
-        sql += " AND timestamp <= ?"
+        sql += f" AND {p}timestamp <= ?"
         params.append(end_date.strftime("%Y-%m-%d 23:59:59"))
 
     if op_types:
         placeholders = ",".join("?" * len(op_types))
-        sql += f" AND operation_name IN ({placeholders})"
+        sql += f" AND {p}operation_name IN ({placeholders})"
         params.extend(op_types)
 
     if search_q:
-        sql += " AND (operation_desc LIKE ? OR id LIKE ?)"
+        sql += f" AND ({p}operation_desc LIKE ? OR {p}id LIKE ?)"
         params.extend([f"%{search_q}%", f"%{search_q}%"])
-    
+
     if actor:
-        sql += " AND actor = ?"
+        sql += f" AND {p}actor = ?"
         params.append(actor)
     if source:
-        sql += " AND source = ?"
+        sql += f" AND {p}source = ?"
         params.append(source)
     if run_id:
-        sql += " AND run_id = ?"
+        sql += f" AND {p}run_id = ?"
         params.append(run_id)
 
     return sql, params
 
+def _build_records_filter_sql(start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None):
+    clause, params = _records_filter_clause(
+        start_date=start_date, end_date=end_date, op_types=op_types, search_q=search_q, actor=actor, source=source, run_id=run_id
+    )
+    return " FROM records WHERE 1=1" + clause, params
+
+def search_record_ids(search_q):
+    """operation_desc 或 record id 模糊匹配的记录 id 集合（与 search_q 过滤语义一致）"""
+    rows = _connect().execute(
+        "SELECT id FROM records WHERE operation_desc LIKE ? OR id LIKE ?",
+        (f"%{search_q}%", f"%{search_q}%"),
+    ).fetchall()
+    return {r[0] for r in rows}
+
 def get_records_count(start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None):
-    conn = _connect()
-    c = conn.cursor()
     where_sql, params = _build_records_filter_sql(
         start_date=start_date, end_date=end_date, op_types=op_types, search_q=search_q, actor=actor, source=source, run_id=run_id
     )
-    c.execute("SELECT COUNT(*)" + where_sql, params)
-    total = c.fetchone()[0]
-    conn.close()
+    total = _connect().execute("SELECT COUNT(*)" + where_sql, params).fetchone()[0]
     return int(total)
 
 def get_filtered_records(start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None, limit=None, offset=0):
@@ -293,10 +1395,6 @@ def get_filtered_records(start_date=None, end_date=None, op_types=None, search_q
     - actor/source/run_id: 记录来源筛选
     - limit/offset: 分页
     """
-    conn = _connect()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
     where_sql, params = _build_records_filter_sql(
         start_date=start_date, end_date=end_date, op_types=op_types, search_q=search_q, actor=actor, source=source, run_id=run_id
     )
@@ -305,49 +1403,194 @@ def get_filtered_records(start_date=None, end_date=None, op_types=None, search_q
     if limit is not None:
         sql += " LIMIT ? OFFSET ?"
         params.extend([int(limit), int(offset or 0)])
-    
-    c.execute(sql, params)
-    rows = c.fetchall()
-    conn.close()
+
+    rows = _connect().execute(sql, params).fetchall()
     return [_row_to_record(r) for r in rows]
 
-def get_operation_stats():
-    """返回操作类型列表及其出现次数，用于过滤器等"""
-    conn = _connect()
-    c = conn.cursor()
-    c.execute(
-        "SELECT operation_name, COUNT(*) AS cnt FROM records GROUP BY operation_name ORDER BY cnt DESC, operation_name ASC"
+def encode_cursor(values):
+    """把游标值（如 [timestamp, id]）编码成不透明字符串"""
+    raw = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def _records_select_sql(record_ids=None, **filters):
+    """SELECT * FROM records 加过滤条件；record_ids 限定记录集合（通过 json_each 作为单个参数传入）"""
+    where_sql, params = _build_records_filter_sql(**filters)
+    sql = "SELECT *" + where_sql
+    if record_ids is not None:
+        sql += " AND id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(record_ids)))
+    return sql, params
+
+def iter_records(record_ids=None, batch_size=500, **filters):
+    """
+    流式读取 records（按 (timestamp, id) 升序），每次 fetchmany(batch_size)，内存占用与总量无关。
+    使用独立连接：生成器可能被不同线程依次推进（如 StreamingResponse），且读游标持有的
+    WAL 快照不应与当前线程连接上的事务互相影响。过滤参数同 get_filtered_records。
+    """
+    sql, params = _records_select_sql(record_ids=record_ids, **filters)
+    sql += " ORDER BY timestamp ASC, id ASC"
+    conn = _open_connection(check_same_thread=False)
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _row_to_record(row)
+    finally:
+        conn.close()
+
+def get_records_page(limit=50, cursor=None, offset=None, record_ids=None, start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None):
+    """
+    records 分页查询，按 (timestamp, id) 升序，LIMIT 下推到 SQLite：
+    - cursor: 上一页返回的 next_cursor（keyset 分页，深翻页代价与页大小相关）
+    - offset: 兼容旧的 offset 分页（仍在 SQL 中 OFFSET）
+    - record_ids: 限定在给定记录集合内（血缘范围）
+    返回：(records, next_cursor)，没有下一页时 next_cursor 为 None
+    """
+    sql, params = _records_select_sql(
+        record_ids=record_ids, start_date=start_date, end_date=end_date, op_types=op_types, search_q=search_q, actor=actor, source=source, run_id=run_id
     )
-    rows = c.fetchall()
-    conn.close()
-    return [{"operation": r[0], "count": int(r[1])} for r in rows if r and r[0]]
-
-def _build_record_indices(records):
-    inputs_index = {}
-    outputs_index = {}
-    for rec in records or []:
-        for i in rec.get("input_ids", []) or []:
-            inputs_index.setdefault(i, []).append(rec)
-        for o in rec.get("output_ids", []) or []:
-            outputs_index.setdefault(o, []).append(rec)
-    return inputs_index, outputs_index
-
-def collect_lineage_record_ids(dataset_id, records, direction="both", depth=2):
-    """
-    在给定 records 子集中，收集与 dataset_id 相关的“血缘记录（record ids）”：
-    - downstream: dataset 作为 input 的记录 + 其 outputs 继续扩展
-    - upstream: dataset 作为 output 的记录 + 其 inputs 继续扩展
-    depth 按“数据集节点扩展层数”计（与 /lineage 的定义一致）。
-    返回：(record_id_set, dataset_id_set)
+    if cursor:
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != 2:
+            raise ValueError("invalid cursor")
+        sql += " AND (timestamp, id) > (?, ?)"
+        params.extend(values)
+    sql += " ORDER BY timestamp ASC, id ASC LIMIT ?"
+    params.append(int(limit) + 1)
+    if offset and not cursor:
+        sql += " OFFSET ?"
+        params.append(int(offset))
+
+    rows = _connect().execute(sql, params).fetchall()
+    records = [_row_to_record(r) for r in rows[: int(limit)]]
+    next_cursor = None
+    if len(rows) > int(limit) and records:
+        last = records[-1]
+        next_cursor = encode_cursor([last.get("timestamp"), last.get("id")])
+    return records, next_cursor
+
+_OPERATION_STATS_TAIL = (
+    " AND r.operation_name IS NOT NULL AND r.operation_name != ''"
+    " GROUP BY r.operation_name ORDER BY cnt DESC, r.operation_name ASC"
+)
+
+def get_operation_stats(start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None, dataset_id=None, direction="both", depth=2, record_ids=None):
+    """
+    返回操作类型列表及其出现次数（GROUP BY 在 SQLite 内完成，不读取记录明细），用于过滤器等。
+    - 过滤参数同 get_filtered_records
+    - dataset_id/direction/depth: 限定在该数据集的血缘范围内（WITH RECURSIVE 展开后直接聚合）
+    - record_ids: 调用方已确定的记录集合（如 API 常驻血缘图给出的范围）
+    """
+    filters = dict(start_date=start_date, end_date=end_date, op_types=op_types, search_q=search_q, actor=actor, source=source, run_id=run_id)
+    if dataset_id is not None and record_ids is None:
+        direction, depth = _validate_lineage_args(direction, depth)
+        if direction == "both" and not _HAS_MULTI_RECURSIVE_CTE:
+            record_ids, _ = _lineage_scope_ids(dataset_id, direction, depth, **filters)
+        else:
+            # 过滤条件已在遍历时生效，scope 中的记录无需再次过滤
+            cte, params = _lineage_scope_cte(dataset_id, direction, depth, filters)
+            rows = _connect().execute(
+                cte + "SELECT r.operation_name, COUNT(*) AS cnt FROM (SELECT DISTINCT record_id FROM scope) s JOIN records r ON r.id = s.record_id WHERE 1=1"
+                + _OPERATION_STATS_TAIL,
+                params,
+            ).fetchall()
+            return [{"operation": r[0], "count": int(r[1])} for r in rows]
+
+    clause, params = _records_filter_clause("r", **filters)
+    sql = "SELECT r.operation_name, COUNT(*) AS cnt FROM records r WHERE 1=1" + clause
+    if record_ids is not None:
+        sql += " AND r.id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(record_ids)))
+    rows = _connect().execute(sql + _OPERATION_STATS_TAIL, params).fetchall()
+    return [{"operation": r[0], "count": int(r[1])} for r in rows]
+
+# 单条 SQL 的变量上限（旧版 SQLite 为 999），IN 查询按批次拆分
+_SQL_BATCH = 500
+
+def _chunked(items, size=_SQL_BATCH):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+def _expand_edges(dataset_ids, from_table, to_table):
+    """
+    通过边表做一层扩展：返回 [(record_id, neighbor_dataset_id)]。
+    from_table=record_inputs 表示向下游（数据集作为输入），record_outputs 表示向上游。
     """
+    conn = _connect()
+    pairs = []
+    for batch in _chunked(dataset_ids):
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"SELECT f.record_id, t.dataset_id FROM {from_table} f "
+            f"LEFT JOIN {to_table} t ON t.record_id = f.record_id "
+            f"WHERE f.dataset_id IN ({placeholders})",
+            batch,
+        ).fetchall()
+        pairs.extend((r[0], r[1]) for r in rows)
+    return pairs
+
+def _get_records_by_edge(table, dataset_id):
+    rows = _connect().execute(
+        f"SELECT r.* FROM {table} e JOIN records r ON r.id = e.record_id "
+        f"WHERE e.dataset_id = ? ORDER BY r.timestamp ASC",
+        (dataset_id,),
+    ).fetchall()
+    return [_row_to_record(r) for r in rows]
+
+def get_records_by_input(dataset_id):
+    """消费了 dataset_id 的记录（下游一跳）"""
+    return _get_records_by_edge("record_inputs", dataset_id)
+
+def get_records_by_output(dataset_id):
+    """产出了 dataset_id 的记录（上游一跳）"""
+    return _get_records_by_edge("record_outputs", dataset_id)
+
+def _validate_lineage_args(direction, depth):
     direction = (direction or "").strip().lower()
     if direction not in ("upstream", "downstream", "both"):
         raise ValueError("direction must be upstream, downstream, or both")
     depth = int(depth or 0)
     if depth < 0:
         raise ValueError("depth must be >= 0")
+    return direction, depth
+
+# (起点边表, 邻居边表)：向下游时数据集是 input，邻居是同一记录的 outputs；向上游相反
+_LINEAGE_STEPS = {
+    "downstream": ("record_inputs", "record_outputs"),
+    "upstream": ("record_outputs", "record_inputs"),
+}
+
+def _lineage_steps(direction):
+    if direction == "both":
+        return [_LINEAGE_STEPS["downstream"], _LINEAGE_STEPS["upstream"]]
+    return [_LINEAGE_STEPS[direction]]
 
-    inputs_index, outputs_index = _build_record_indices(records)
+def collect_lineage_record_ids(dataset_id, records=None, direction="both", depth=2):
+    """
+    收集与 dataset_id 相关的“血缘记录（record ids）”：
+    - downstream: dataset 作为 input 的记录 + 其 outputs 继续扩展
+    - upstream: dataset 作为 output 的记录 + 其 inputs 继续扩展
+    depth 按“数据集节点扩展层数”计（与 /lineage 的定义一致）。
+    不传 records 时直接在 SQLite 内递归展开（见 get_lineage_scope）；
+    传入 records 时逐层通过 record_inputs / record_outputs 索引查找邻居，且只沿这些记录扩展。
+    返回：(record_id_set, dataset_id_set)
+    """
+    direction, depth = _validate_lineage_args(direction, depth)
+    if records is None:
+        return _lineage_scope_ids(dataset_id, direction, depth)
+
+    allowed = {r.get("id") for r in records}
 
     record_ids = set()
     dataset_ids = set([dataset_id])
@@ -359,32 +1602,131 @@ def collect_lineage_record_ids(dataset_id, records, direction="both", depth=2):
         if not frontier:
             break
         next_frontier = set()
-        for ds_id in list(frontier):
-            if direction in ("downstream", "both"):
-                for rec in inputs_index.get(ds_id, []):
-                    rec_id = rec.get("id")
-                    if rec_id:
-                        record_ids.add(rec_id)
-                    for out_id in rec.get("output_ids", []) or []:
-                        dataset_ids.add(out_id)
-                        if out_id not in visited:
-                            visited.add(out_id)
-                            next_frontier.add(out_id)
-
-            if direction in ("upstream", "both"):
-                for rec in outputs_index.get(ds_id, []):
-                    rec_id = rec.get("id")
-                    if rec_id:
-                        record_ids.add(rec_id)
-                    for in_id in rec.get("input_ids", []) or []:
-                        dataset_ids.add(in_id)
-                        if in_id not in visited:
-                            visited.add(in_id)
-                            next_frontier.add(in_id)
+        for from_table, to_table in _lineage_steps(direction):
+            for rec_id, neighbor in _expand_edges(frontier, from_table, to_table):
+                if rec_id not in allowed:
+                    continue
+                record_ids.add(rec_id)
+                if neighbor is None:
+                    continue
+                dataset_ids.add(neighbor)
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    next_frontier.add(neighbor)
 
         frontier = next_frontier
 
     return record_ids, dataset_ids
 
-# 初始化
-init_db()
+# --- 祖先 / 后代（传递闭包表） ---
+
+def _closure_lookup(dataset_id, self_col, other_col, max_depth=None):
+    sql = (
+        f"SELECT c.{other_col} AS id, c.min_distance AS distance, d.name, d.description, d.tags, d.created_at "
+        f"FROM lineage_closure c LEFT JOIN datasets d ON d.id = c.{other_col} "
+        f"WHERE c.{self_col} = ?"
+    )
+    params = [dataset_id]
+    if max_depth is not None:
+        sql += " AND c.min_distance <= ?"
+        params.append(int(max_depth))
+    sql += " ORDER BY c.min_distance ASC, d.name ASC"
+    return [dict(r) for r in _connect().execute(sql, params).fetchall()]
+
+def get_descendants(dataset_id, max_depth=None):
+    """所有下游数据集（影响分析），可选 max_depth 限制跳数；每项带最短距离 distance"""
+    return _closure_lookup(dataset_id, "ancestor_id", "descendant_id", max_depth)
+
+def get_ancestors(dataset_id, max_depth=None):
+    """所有上游数据集（溯源），可选 max_depth 限制跳数；每项带最短距离 distance"""
+    return _closure_lookup(dataset_id, "descendant_id", "ancestor_id", max_depth)
+
+# --- 血缘遍历（SQLite 递归 CTE） ---
+
+# direction=both 需要在同一个 CTE 里写多个递归 SELECT，SQLite 3.34 起支持
+_HAS_MULTI_RECURSIVE_CTE = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+def _lineage_scope_cte(dataset_id, direction, depth, filters):
+    """
+    构造递归 CTE：
+    - walk(dataset_id, lvl)：从 dataset_id 出发逐层展开，lvl <= depth
+    - scope(record_id)：展开过程中经过的记录
+    过滤条件在每一步 JOIN records 时生效，不满足条件的记录既不返回也不继续扩展。
+    """
+    clause, clause_params = _records_filter_clause("r", **filters)
+    steps = _lineage_steps(direction)
+    params = [dataset_id]
+
+    walk_parts = ["SELECT ?, 0"]
+    for from_table, to_table in steps:
+        walk_parts.append(
+            f"SELECT t.dataset_id, w.lvl + 1 FROM walk w "
+            f"JOIN {from_table} f ON f.dataset_id = w.dataset_id "
+            f"JOIN records r ON r.id = f.record_id "
+            f"JOIN {to_table} t ON t.record_id = f.record_id "
+            f"WHERE w.lvl < ?{clause}"
+        )
+        params += [depth] + clause_params
+
+    scope_parts = []
+    for from_table, _ in steps:
+        scope_parts.append(
+            f"SELECT f.record_id FROM walk w "
+            f"JOIN {from_table} f ON f.dataset_id = w.dataset_id "
+            f"JOIN records r ON r.id = f.record_id "
+            f"WHERE w.lvl < ?{clause}"
+        )
+        params += [depth] + clause_params
+
+    sql = (
+        "WITH RECURSIVE walk(dataset_id, lvl) AS (" + " UNION ".join(walk_parts) + "), "
+        "scope(record_id) AS (" + " UNION ".join(scope_parts) + ") "
+    )
+    return sql, params
+
+def _lineage_scope_ids(dataset_id, direction, depth, **filters):
+    if direction == "both" and not _HAS_MULTI_RECURSIVE_CTE:
+        # 旧版 SQLite：退化为逐层索引扩展
+        records = get_filtered_records(**filters)
+        return collect_lineage_record_ids(dataset_id, records, direction=direction, depth=depth)
+
+    cte, params = _lineage_scope_cte(dataset_id, direction, depth, filters)
+    rows = _connect().execute(
+        cte + "SELECT 'record', record_id FROM scope UNION ALL SELECT DISTINCT 'dataset', dataset_id FROM walk",
+        params,
+    ).fetchall()
+    record_ids = {r[1] for r in rows if r[0] == "record"}
+    dataset_ids = {r[1] for r in rows if r[0] == "dataset"}
+    return record_ids, dataset_ids
+
+def get_records_by_ids(record_ids):
+    """批量按 id 获取记录，按 timestamp 升序返回"""
+    conn = _connect()
+    rows = []
+    for batch in _chunked(record_ids):
+        placeholders = ",".join("?" * len(batch))
+        rows.extend(conn.execute(f"SELECT rowid, * FROM records WHERE id IN ({placeholders})", batch).fetchall())
+    # 与 ORDER BY timestamp 一致：同一秒内按写入顺序
+    rows.sort(key=lambda r: (r["timestamp"] or "", r["rowid"]))
+    records = []
+    for r in rows:
+        record = _row_to_record(r)
+        record.pop("rowid", None)
+        records.append(record)
+    return records
+
+def get_lineage_scope(dataset_id, direction="both", depth=2, start_date=None, end_date=None, op_types=None, search_q=None, actor=None, source=None, run_id=None):
+    """
+    有界的上游/下游血缘展开，整个遍历在 SQLite 内完成（WITH RECURSIVE），
+    时间 / op_types / search_q / actor / source / run_id 过滤在遍历过程中生效。
+    代价只与触达的子图大小有关，与 records 总量无关。
+    返回：(records, dataset_id_set)，records 按 timestamp 升序。
+    """
+    direction, depth = _validate_lineage_args(direction, depth)
+    record_ids, dataset_ids = _lineage_scope_ids(
+        dataset_id, direction, depth,
+        start_date=start_date, end_date=end_date, op_types=op_types, search_q=search_q,
+        actor=actor, source=source, run_id=run_id,
+    )
+    return get_records_by_ids(record_ids), dataset_ids
+
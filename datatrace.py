@@ -1,13 +1,287 @@
 import requests
+import atexit
+import gzip
+import itertools
+import json
+import queue
+import sqlite3
+import struct
 import sys
 import os
+import threading
+import time
+import typing
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import closing
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # 默认配置
 CONFIG = {
+    # "http"：通过 API_URL 访问 api_server；"embedded"：进程内直接调用 services.py 的业务函数读写 DB_PATH
+    "MODE": "http",
+    "DB_PATH": None,
     "API_URL": "http://127.0.0.1:8000",
-    "USER": "anonymous"
+    "USER": "anonymous",
+    # (连接超时, 读取超时) 秒
+    "TIMEOUT": (3.05, 30),
+    # 连接错误 / 5xx 的重试次数与退避系数（第 n 次重试前等待 backoff * 2^(n-1) 秒）
+    "RETRIES": 3,
+    "BACKOFF": 0.3,
+    # JSON 请求体超过该字节数时 gzip 压缩上传
+    "GZIP_MIN_BYTES": 16 * 1024,
+    # 异步记录：log() 入队后立即返回占位数据集，后台线程按条数 / 时间批量提交到 /transform/batch
+    "ASYNC_LOG": False,
+    "LOG_BATCH_SIZE": 200,
+    "LOG_FLUSH_INTERVAL": 1.0,
+    "LOG_MAX_PENDING": 10000,
+    # 进程退出时等待排队记录提交的最长秒数（API 不可达时不会卡住退出）
+    "LOG_EXIT_TIMEOUT": 30.0,
+    # 离线暂存（默认关闭，init(spool=True) 或 init(spool="路径") 开启）：log() 按上面的超时 / 重试策略仍失败
+    # （不可达 / 超时 / 5xx）时写入本地 SQLite 暂存文件，恢复后按顺序幂等重放
+    "SPOOL_PATH": None,
+    # 失败后该时长内的 log() 直接写暂存文件，后台每隔该时长尝试重放
+    "SPOOL_RETRY_INTERVAL": 5.0,
+    # 数据集缓存（name -> id、id -> 元信息）：条目有效期（秒）与每张表的最大条目数，任一为 0 时关闭
+    "DATASET_CACHE_TTL": 300.0,
+    "DATASET_CACHE_SIZE": 4096,
 }
 
+DEFAULT_SPOOL_PATH = os.path.join(os.path.expanduser("~"), ".datatrace", "spool.db")
+
+class Client:
+    """
+    SDK 的 HTTP 客户端：复用一个 requests.Session（连接池 + keep-alive），统一超时、重试与 gzip。
+    - 重试：连接错误对所有请求重试；5xx 只对 GET 等幂等请求重试（POST 重试可能重复写入），按指数退避
+    - gzip：响应由服务端压缩、requests 自动解压；JSON 请求体较大时压缩上传（Content-Encoding: gzip）
+    模块级函数（get_dataset / log / get_lineage / add_timeseries ...）都通过 get_client() 返回的默认实例发送请求。
+    """
+
+    def __init__(self, api_url=None, timeout=None, retries=None, backoff=None, pool_maxsize=10, gzip_min_bytes=None):
+        self.api_url = api_url
+        self.timeout = timeout if timeout is not None else CONFIG["TIMEOUT"]
+        self.gzip_min_bytes = gzip_min_bytes if gzip_min_bytes is not None else CONFIG["GZIP_MIN_BYTES"]
+        retries = CONFIG["RETRIES"] if retries is None else retries
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=CONFIG["BACKOFF"] if backoff is None else backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}),
+            raise_on_status=False,
+        )
+        self.session = self._session(HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=retry))
+        # 不重试的会话：后台重放自带重试间隔，失败后不在退避上等待
+        self.no_retry_session = self._session(HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0))
+
+    @staticmethod
+    def _session(adapter):
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = "gzip"
+        return session
+
+    def url(self, path):
+        return (self.api_url or CONFIG["API_URL"]).rstrip("/") + path
+
+    def request(self, method, path, json=None, retry=True, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if json is not None:
+            body = _json_dumps(json)
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers["Content-Type"] = "application/json"
+            if len(body) >= self.gzip_min_bytes:
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+            kwargs["data"] = body
+            kwargs["headers"] = headers
+        session = self.session if retry else self.no_retry_session
+        return session.request(method, self.url(path), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+        self.no_retry_session.close()
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+_client = None
+
+def get_client():
+    """默认客户端（首次使用时按 CONFIG 创建：MODE 为 "embedded" 时为 EmbeddedClient）"""
+    global _client
+    if _client is None:
+        _client = EmbeddedClient(CONFIG["DB_PATH"]) if CONFIG["MODE"] == "embedded" else Client()
+    return _client
+
+class _EmbeddedResponse:
+    """EmbeddedClient 的返回值：与 requests.Response 同名的 status_code / ok / json() / text / iter_lines() / raise_for_status()"""
+
+    def __init__(self, status_code, payload=None, body=None, chunks=None):
+        self.status_code = status_code
+        self._payload = payload
+        self._body = body
+        self._chunks = chunks
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        if self._payload is None and self._body is not None:
+            return json.loads(self._body)
+        return self._payload
+
+    @property
+    def content(self):
+        if self._body is None:
+            self._body = b"".join(self._chunks) if self._chunks is not None else _json_dumps(self._payload)
+        return self._body
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def iter_lines(self):
+        if self._chunks is None:
+            yield from self.content.splitlines()
+            return
+        tail = b""
+        for chunk in self._chunks:
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            yield from lines
+        if tail:
+            yield tail
+
+    def raise_for_status(self):
+        if not self.ok:
+            detail = self._payload.get("detail") if isinstance(self._payload, dict) else self._payload
+            raise requests.HTTPError(f"{self.status_code} Error: {detail}", response=self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _EmbeddedRequest:
+    """EmbeddedClient 交给路由处理函数的请求：查询参数、JSON 请求体、原始请求体（bytes 或其可迭代对象）与请求头"""
+
+    def __init__(self, params, json, data, headers):
+        self.params = params
+        self.json = json
+        self.data = data
+        self.headers = headers
+
+class EmbeddedClient:
+    """
+    进程内客户端（dt.init(mode="embedded", db_path=...)）：不经过 HTTP，直接调用 services.py 中与 api_server 路由共用的业务函数，
+    get-or-create / transform 等逻辑与服务端完全相同，直接读写本地 SQLite；单机批处理作业无需先启动 uvicorn。
+    SDK 用到的每个端点在 _routes 中显式映射到业务函数（SDK 发送的查询参数名即业务函数的关键字参数），
+    ServiceError 转为对应状态码，请求体校验失败为 422，返回值与 HTTP 响应的 JSON 同形，因此所有模块级 SDK 函数无需修改即可使用。
+    """
+
+    def __init__(self, db_path=None):
+        # 延迟导入：HTTP 模式不需要 pydantic / numpy 等服务端依赖
+        import re
+        import database
+        import services
+        from fastapi.encoders import jsonable_encoder
+        from pydantic import ValidationError
+
+        self._services, self._encode, self._validation_error = services, jsonable_encoder, ValidationError
+        if db_path:
+            database.DB_FILE = db_path
+        database.init_db()
+        services.lineage_graph.load()
+        self.db_path = database.DB_FILE
+        self._routes = [(method, re.compile(pattern), handler) for method, pattern, handler in self._route_table(services)]
+
+    @staticmethod
+    def _route_table(s):
+        # /timeseries/aligned 必须在 /timeseries/{dataset_id} 之前
+        return [
+            ("GET", r"/", lambda r: {"status": "running", "system": "DataTrace Pro"}),
+            ("POST", r"/datasets/", lambda r: s.create_dataset(s.DatasetCreate(**r.json))),
+            ("POST", r"/datasets/batch", lambda r: s.create_datasets_batch(s.DatasetBatch(**r.json))),
+            ("POST", r"/datasets/resolve", lambda r: s.resolve_datasets(s.DatasetResolve(**r.json))),
+            ("GET", r"/datasets/([^/]+)/descendants", lambda r, ds_id: s.list_descendants(ds_id, **r.params)),
+            ("GET", r"/datasets/([^/]+)/ancestors", lambda r, ds_id: s.list_ancestors(ds_id, **r.params)),
+            ("POST", r"/transform/", lambda r: s.create_transformation(s.RecordCreate(**r.json))),
+            ("POST", r"/transform/batch", lambda r: s.create_transformations_batch(s.TransformBatch(**r.json))),
+            ("GET", r"/records", lambda r: s.list_records(**r.params)),
+            ("GET", r"/records/export", lambda r: _EmbeddedResponse(200, chunks=(
+                line.encode("utf-8") for line in s.ndjson(s.export_records(**r.params))
+            ))),
+            ("GET", r"/operations", lambda r: s.list_operations(**r.params)),
+            ("GET", r"/lineage/([^/]+)", lambda r, ds_id: s.get_lineage(ds_id, **r.params)),
+            ("GET", r"/lineage/([^/]+)/export", lambda r, ds_id: _EmbeddedResponse(200, chunks=(
+                line.encode("utf-8") for line in s.ndjson(s.export_lineage(ds_id, **r.params))
+            ))),
+            ("GET", r"/report/([^/]+)", lambda r, ds_id: _EmbeddedResponse(200, body=s.lineage_report(ds_id, **r.params).encode("utf-8"))),
+            ("GET", r"/timeseries/aligned", lambda r: s.get_aligned_timeseries(**r.params)),
+            ("GET", r"/timeseries/([^/]+)", lambda r, ds_id: s.get_timeseries(ds_id, **r.params)),
+            ("POST", r"/timeseries/([^/]+)", lambda r, ds_id: s.add_timeseries(ds_id, s.TimeseriesBatch(**r.json))),
+            ("POST", r"/timeseries/([^/]+)/ingest", lambda r, ds_id: s.ingest_timeseries(
+                ds_id, r.data or b"",
+                fmt=r.params.get("format"),
+                content_type=r.headers.get("content-type"),
+                metric=r.params.get("metric", "value"),
+                chunk_size=r.params.get("chunk_size", s.INGEST_CHUNK),
+            )),
+            ("POST", r"/timeseries/([^/]+)/materialize", lambda r, ds_id: s.materialize_timeseries(ds_id)),
+            ("POST", r"/timeseries/([^/]+)/generate", lambda r, ds_id: s.generate_timeseries(ds_id, **r.params)),
+            ("GET", r"/timeseries/([^/]+)/resample", lambda r, ds_id: s.resample_timeseries(ds_id, **r.params)),
+            ("GET", r"/timeseries/([^/]+)/rolling", lambda r, ds_id: s.rolling_timeseries(ds_id, **r.params)),
+        ]
+
+    def request(self, method, path, json=None, params=None, data=None, headers=None, **kwargs):
+        # timeout / retry / stream 等 HTTP 参数在进程内没有意义，忽略
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(path)
+            if match and route_method == method.upper():
+                break
+        else:
+            return _EmbeddedResponse(404, {"detail": "Not Found"})
+        req = _EmbeddedRequest(
+            dict(params or {}), json or {}, data, {k.lower(): v for k, v in (headers or {}).items()}
+        )
+        try:
+            result = handler(req, *match.groups())
+        except self._services.ServiceError as e:
+            return _EmbeddedResponse(e.status_code, {"detail": e.detail})
+        except self._validation_error as e:
+            return _EmbeddedResponse(422, {"detail": self._encode(e.errors())})
+        if isinstance(result, _EmbeddedResponse):
+            return result
+        return _EmbeddedResponse(200, self._encode(result))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        pass
+
 class Dataset:
     """数据集对象，包装 ID 和 Name，方便代码传递"""
     def __init__(self, id, name, tags=None):
@@ -18,26 +292,191 @@ class Dataset:
     def __repr__(self):
         return f"<Dataset: {self.name} ({self.id})>"
 
-def init(api_url=None, user=None):
-    """初始化 SDK 配置"""
+class PendingDataset(Dataset):
+    """
+    异步模式下 log() 返回的占位数据集：name 立即可用，id 在后台批量提交后确定。
+    可直接作为后续 log() 的输入（同一批内以 "$ref" 引用提交）；访问 .id 会触发一次 flush 并阻塞到提交完成，
+    提交失败时抛出对应异常。future 为 concurrent.futures.Future，结果是最终的 Dataset。
+    """
+    def __init__(self, name, ref):
+        self.name = name
+        self.tags = None
+        self.ref = ref
+        self.future = Future()
+
+    @property
+    def id(self):
+        if not self.future.done() and _log_queue is not None:
+            _log_queue.kick()
+        return self.future.result().id
+
+    def done(self):
+        return self.future.done()
+
+    def __repr__(self):
+        if self.future.done() and not self.future.exception():
+            return f"<Dataset: {self.name} ({self.future.result().id})>"
+        return f"<Dataset: {self.name} (pending)>"
+
+LOCAL_ID_PREFIX = "local-"
+
+class SpooledDataset(Dataset):
+    """
+    API 不可用时 log() 返回的数据集：记录写入离线暂存文件，先使用本地 id（local-xxxx）；
+    重放成功后 .id 自动变为服务端分配的 id。可直接作为后续 log() 的输入（重放时替换为服务端 id）。
+    """
+    def __init__(self, local_id, name):
+        self.local_id = local_id
+        self.name = name
+        self.tags = None
+        self.server_id = None
+
+    @property
+    def id(self):
+        return self.server_id or self.local_id
+
+    def __repr__(self):
+        return f"<Dataset: {self.name} ({self.server_id or self.local_id + ', spooled'})>"
+
+def init(api_url=None, user=None, timeout=None, retries=None, backoff=None, async_log=None, batch_size=None, flush_interval=None, mode=None, db_path=None, spool=None):
+    """
+    初始化 SDK 配置（超时 / 重试参数变化时重建默认客户端）。
+    mode="embedded" 时不连接 API，在进程内直接读写 db_path（默认 database.DB_FILE），适合单机批处理作业。
+    async_log=True 时 log() / @trace 不再阻塞等待 API：记录入队后由后台线程每 batch_size 条或每 flush_interval 秒批量提交。
+    spool 控制离线暂存（默认关闭）：True 使用 ~/.datatrace/spool.db，字符串为暂存文件路径，False 关闭。
+    关闭时 log() 失败返回 None（异步模式下占位数据集的 future 带异常）；开启时 log() 仍先按 timeout / retries / backoff
+    发送请求（连接错误重试），仍不可达、超时或返回 5xx 才写入暂存文件并返回 SpooledDataset，之后
+    SPOOL_RETRY_INTERVAL 秒内的 log() 直接写暂存文件，后台线程恢复后按顺序幂等重放。
+    """
+    global _client
+    if async_log is not None or batch_size is not None or flush_interval is not None:
+        # 先把旧配置下排队的记录提交完
+        _stop_log_queue()
+    if async_log is not None:
+        CONFIG["ASYNC_LOG"] = bool(async_log)
+    if batch_size is not None:
+        CONFIG["LOG_BATCH_SIZE"] = max(1, min(int(batch_size), 5000))
+    if flush_interval is not None:
+        CONFIG["LOG_FLUSH_INTERVAL"] = float(flush_interval)
+    if mode is not None:
+        if mode not in ("http", "embedded"):
+            raise ValueError("mode must be 'http' or 'embedded'")
+        CONFIG["MODE"] = mode
+    if db_path is not None:
+        CONFIG["DB_PATH"] = db_path
+    if spool is not None:
+        CONFIG["SPOOL_PATH"] = DEFAULT_SPOOL_PATH if spool is True else (spool or None)
     if api_url:
         CONFIG["API_URL"] = api_url
     if user:
         CONFIG["USER"] = user
-    
+    if timeout is not None:
+        CONFIG["TIMEOUT"] = timeout
+    if retries is not None:
+        CONFIG["RETRIES"] = retries
+    if backoff is not None:
+        CONFIG["BACKOFF"] = backoff
+    if _client is not None:
+        _client.close()
+    _client = None
+    # 服务端 / 数据库可能已切换，缓存的 id 不再可信
+    clear_dataset_cache()
+
+    if CONFIG["MODE"] == "embedded":
+        print(f"✅ DataTrace embedded mode (database: {get_client().db_path})")
+        return
+
     # 测试连接
     try:
-        requests.get(CONFIG["API_URL"])
+        get_client().get("/")
         print(f"✅ DataTrace connected to {CONFIG['API_URL']}")
     except:
         print(f"❌ Connection Failed. Is api_server.py running?")
 
+class _DatasetCache:
+    """
+    进程内数据集缓存：name -> id 与 id -> 元信息两张 LRU 表（OrderedDict），条目 ttl 秒后过期。
+    只缓存查到的结果（不存在的名称不缓存，之后可能被创建）；SDK 自己创建 / 改指向名称时更新对应条目。
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._names = OrderedDict()
+        self._meta = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, table, key):
+        with self._lock:
+            entry = table.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del table[key]
+                return None
+            table.move_to_end(key)
+            return entry[1]
+
+    def _put(self, table, key, value):
+        with self._lock:
+            table[key] = (time.monotonic() + self.ttl, value)
+            table.move_to_end(key)
+            while len(table) > self.maxsize:
+                table.popitem(last=False)
+
+    def get_id(self, name):
+        return self._get(self._names, name)
+
+    def put_name(self, name, ds_id):
+        self._put(self._names, name, ds_id)
+
+    def forget_name(self, name):
+        with self._lock:
+            self._names.pop(name, None)
+
+    def get_meta(self, ds_id):
+        return self._get(self._meta, ds_id)
+
+    def put_meta(self, meta):
+        self._put(self._meta, meta["id"], meta)
+
+_dataset_cache = None
+
+def _get_dataset_cache():
+    global _dataset_cache
+    if CONFIG["DATASET_CACHE_TTL"] <= 0 or CONFIG["DATASET_CACHE_SIZE"] <= 0:
+        return None
+    if _dataset_cache is None:
+        _dataset_cache = _DatasetCache(CONFIG["DATASET_CACHE_SIZE"], CONFIG["DATASET_CACHE_TTL"])
+    return _dataset_cache
+
+def clear_dataset_cache():
+    """清空数据集缓存（其它进程改动了名称指向、或需要强制重新查询时调用）"""
+    global _dataset_cache
+    _dataset_cache = None
+
 def get_dataset(name, description="", tags=None, auto_create=True):
     """
     获取数据集对象。
-    如果 auto_create=True，且数据集不存在，则自动注册它（类似 SwanLab 自动创建实验）。
+    如果 auto_create=True，且数据集不存在，则自动注册它（类似 SwanLab 自动创建实验）；
+    auto_create=False 时只查找，不存在返回 None。
+    名称解析结果缓存在进程内（见 CONFIG["DATASET_CACHE_TTL"]），循环中重复获取同一数据集不会重复请求。
     """
     if tags is None: tags = []
+
+    cache = _get_dataset_cache()
+    ds_id = cache.get_id(name) if cache is not None else None
+    if ds_id is not None:
+        return Dataset(id=ds_id, name=name)
+    if not auto_create:
+        try:
+            return resolve_datasets([name])[name]
+        except Exception as e:
+            # 与 auto_create 分支一致：失败返回 None；404（如服务端没有 /datasets/resolve）按不存在处理，不打印
+            response = getattr(e, "response", None)
+            if response is None or response.status_code != 404:
+                print(f"❌ Failed to get dataset {name}: {e}")
+            return None
     
     # 1. 尝试注册/获取 (利用后端的 Get-or-Create 逻辑)
     payload = {
@@ -47,26 +486,83 @@ def get_dataset(name, description="", tags=None, auto_create=True):
     }
     
     try:
-        res = requests.post(f"{CONFIG['API_URL']}/datasets/", json=payload)
+        res = get_client().post("/datasets/", json=payload)
         res.raise_for_status()
         data = res.json()
+        if cache is not None:
+            cache.put_name(data['name'], data['id'])
         return Dataset(id=data['id'], name=data['name'])
     except Exception as e:
         print(f"❌ Failed to get dataset {name}: {e}")
         return None
 
+def resolve_datasets(names, create=False, description="", tags=None):
+    """
+    批量把名称解析为 Dataset：返回 {name: Dataset 或 None}。缓存未命中的名称合并为一次请求：
+    create=False 时调用 POST /datasets/resolve（只读），create=True 时调用 POST /datasets/batch（按名称 get-or-create）。
+    """
+    names = list(dict.fromkeys(names))
+    cache = _get_dataset_cache()
+    result, missing = {}, []
+    for name in names:
+        ds_id = cache.get_id(name) if cache is not None else None
+        if ds_id is not None:
+            result[name] = Dataset(id=ds_id, name=name)
+        else:
+            missing.append(name)
+    if missing and create:
+        items = [{
+            "name": name,
+            "description": description or f"Auto-registered by SDK user {CONFIG['USER']}",
+            "tags": list(tags or []),
+            "ref": name,
+        } for name in missing]
+        res = get_client().post("/datasets/batch", json={"items": items})
+        res.raise_for_status()
+        for item in res.json()["results"]:
+            if item["status"] != "ok":
+                raise RuntimeError(f"Failed to get dataset {item['ref']}: {item.get('detail')}")
+            result[item["ref"]] = Dataset(id=item["id"], name=item["name"])
+            if cache is not None:
+                cache.put_name(item["name"], item["id"])
+    elif missing:
+        res = get_client().post("/datasets/resolve", json={"names": missing})
+        res.raise_for_status()
+        for name, meta in res.json()["names"].items():
+            result[name] = Dataset(id=meta["id"], name=name) if meta else None
+            if meta and cache is not None:
+                cache.put_name(name, meta["id"])
+                cache.put_meta(meta)
+    return {name: result.get(name) for name in names}
+
+def get_dataset_info(dataset):
+    """数据集元信息（id / name / description / tags / created_at），优先取缓存；不存在返回 None"""
+    ds_id = dataset.id if isinstance(dataset, Dataset) else str(dataset)
+    cache = _get_dataset_cache()
+    meta = cache.get_meta(ds_id) if cache is not None else None
+    if meta is None:
+        res = get_client().post("/datasets/resolve", json={"ids": [ds_id]})
+        res.raise_for_status()
+        meta = res.json()["ids"].get(ds_id)
+        if meta and cache is not None:
+            cache.put_meta(meta)
+    return meta
+
 def log(inputs, op_name, output_name, description=None, output_tags=None, actor=None, run_id=None, source="sdk"):
     """
     核心操作：记录一次数据变换 (Transformation)
     类似 swanlab.log，但在 DataTrace 中意味着“生成了新数据”
+    异步模式（init(async_log=True)）下立即返回 PendingDataset，由后台线程批量提交。
     """
     if not isinstance(inputs, list):
         inputs = [inputs]
     
-    # 提取 Input IDs
+    # 提取 Input IDs（异步模式下未提交的占位数据集原样保留，提交时再解析）
     input_ids = []
     for i in inputs:
-        if isinstance(i, Dataset):
+        if isinstance(i, PendingDataset):
+            input_ids.append(i if CONFIG["ASYNC_LOG"] else i.id)
+        elif isinstance(i, Dataset):
             input_ids.append(i.id)
         elif isinstance(i, str):
             # 如果用户只传了 ID 字符串
@@ -89,14 +585,35 @@ def log(inputs, op_name, output_name, description=None, output_tags=None, actor=
         "output_suffix": "" # 兼容旧字段：后端目前不依赖它命名
     }
 
-    # 注意：目前的 API 是自动生成 output name 的，
-    # 为了支持 SDK 指定 output_name，我们需要稍微变通一下，
-    # 或者修改 API。这里演示直接调用 API，让 API 自动处理命名逻辑，
-    # 如果你想强行指定名字，可能需要修改 api_server 的逻辑。
-    # 既然是模拟 SwanLab，我们先假设后端会自动处理。
-    
+    # 幂等键：请求超时但服务端已写入、或暂存重放时，服务端按 client_id 去重
+    payload["client_id"] = uuid.uuid4().hex
+    # 输出名称将指向新数据集：先作废缓存，拿到真实 id 后再写入
+    cache = _get_dataset_cache()
+    if cache is not None:
+        cache.forget_name(output_name)
+
+    if CONFIG["ASYNC_LOG"]:
+        return _get_log_queue().put(payload, output_name)
+
+    spool = _get_spool()
+    if spool is not None and (spool.busy() or any(_is_local_id(i) for i in input_ids)):
+        # 离线期间（或输入尚未重放）直接写暂存文件，保证重放顺序
+        return spool.log(payload)[0]
+
     try:
-        res = requests.post(f"{CONFIG['API_URL']}/transform/", json=payload)
+        if spool is not None:
+            # 与未开启暂存时相同的超时 / 重试策略，仍失败时才转入暂存
+            try:
+                res = get_client().post("/transform/", json=payload)
+                if res.status_code >= 500:
+                    res.raise_for_status()
+            except requests.RequestException as e:
+                if e.response is not None and e.response.status_code < 500:
+                    raise
+                spool.go_offline(e)
+                return spool.log(payload)[0]
+        else:
+            res = get_client().post("/transform/", json=payload)
         res.raise_for_status()
         data = res.json()
         out_ds = (data.get('output_dataset') or (data.get('output_datasets') or [None])[0])
@@ -105,12 +622,360 @@ def log(inputs, op_name, output_name, description=None, output_tags=None, actor=
         
         print(f"🚀 Operation '{op_name}' logged.")
         print(f"   └── New Dataset: {out_ds['name']} (ID: {out_ds['id']})")
+        if cache is not None:
+            cache.put_name(out_ds['name'], out_ds['id'])
         
         return Dataset(id=out_ds['id'], name=out_ds['name'])
     except Exception as e:
         print(f"❌ Failed to log operation: {e}")
         return None
 
+_FLUSH = object()
+_STOP = object()
+# flush() 等待时检查工作线程是否存活的间隔（秒）
+_FLUSH_POLL = 0.5
+
+class _LogQueue:
+    """
+    后台记录队列：log() 把 payload 放入有界队列（满时阻塞，形成背压），工作线程攒批后一次 POST /transform/batch。
+    触发条件：攒够 batch_size 条，或第一条入队后过了 flush_interval 秒，或 flush() / 访问占位 id。
+    批内以 "$ref" 引用同批前面条目的输出；前面批次的占位数据集在提交时已解析为真实 id。
+    """
+
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._refs = itertools.count()
+        self._thread = threading.Thread(target=self._run, name="datatrace-log", daemon=True)
+        self._thread.start()
+
+    def put(self, payload, output_name):
+        handle = PendingDataset(output_name, f"p{next(self._refs)}")
+        self._queue.put((payload, handle))
+        return handle
+
+    def kick(self):
+        """不等 flush_interval，立即提交已排队的记录"""
+        try:
+            self._queue.put_nowait(_FLUSH)
+        except queue.Full:
+            # 队列已满时工作线程本就在攒满一批后立即提交
+            pass
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """提交全部排队记录并等待完成；超时或工作线程已退出时返回 False"""
+        if not self._thread.is_alive():
+            return not self._queue.unfinished_tasks
+        self.kick()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if not self._thread.is_alive():
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # 分段等待，以便发现工作线程退出
+                self._queue.all_tasks_done.wait(_FLUSH_POLL if remaining is None else min(remaining, _FLUSH_POLL))
+        return True
+
+    def close(self, timeout=None):
+        """提交剩余记录后结束工作线程"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, taken = [], 1
+            deadline = time.monotonic() + self.flush_interval
+            while item is not _FLUSH and item is not _STOP:
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                taken += 1
+            try:
+                if batch:
+                    self._send(batch)
+            except Exception as e:
+                # 兜底：_send 中未预料的异常（响应格式不符、暂存文件写入失败等）只让本批失败，工作线程继续运行
+                for _, handle in batch:
+                    if not handle.future.done():
+                        handle.future.set_exception(e)
+                print(f"❌ Failed to log {len(batch)} operations: {e}")
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+            if item is _STOP:
+                return
+
+    def _send(self, batch):
+        items, handles, refs = [], [], set()
+        for payload, handle in batch:
+            try:
+                input_ids = [self._resolve_input(i, refs) for i in payload["input_ids"]]
+            except Exception as e:
+                handle.future.set_exception(e)
+                print(f"❌ Failed to log operation '{payload['operation']}': {e}")
+                continue
+            items.append(dict(payload, input_ids=input_ids, ref=handle.ref))
+            handles.append(handle)
+            refs.add(handle.ref)
+        if not items:
+            return
+        spool = _get_spool()
+        if spool is not None and (spool.busy() or any(_is_local_id(i) for item in items for i in item["input_ids"])):
+            self._spool(spool, items, handles)
+            return
+        try:
+            res = get_client().post("/transform/batch", json={"items": items})
+            res.raise_for_status()
+            results = res.json()["results"]
+        except Exception as e:
+            if spool is not None and isinstance(e, requests.RequestException) and (e.response is None or e.response.status_code >= 500):
+                spool.go_offline(e)
+                self._spool(spool, items, handles)
+                return
+            for handle in handles:
+                handle.future.set_exception(e)
+            print(f"❌ Failed to log {len(items)} operations: {e}")
+            return
+        cache = _get_dataset_cache()
+        for handle, result in zip(handles, results):
+            if result["status"] == "ok":
+                out_ds = result["output_datasets"][0]
+                if cache is not None:
+                    cache.put_name(out_ds["name"], out_ds["id"])
+                handle.future.set_result(Dataset(id=out_ds["id"], name=out_ds["name"]))
+            else:
+                handle.future.set_exception(RuntimeError(result.get("detail")))
+                print(f"❌ Failed to log operation '{result.get('operation') or handle.name}': {result.get('detail')}")
+
+    @staticmethod
+    def _spool(spool, items, handles):
+        """整批写入暂存文件：批内 "$ref" 引用替换为前面条目的本地 id"""
+        local = {}
+        for item, handle in zip(items, handles):
+            payload = dict(item, input_ids=[local.get(i[1:], i) if i.startswith("$") else i for i in item["input_ids"]])
+            payload.pop("ref", None)
+            ds = spool.log(payload)[0]
+            local[handle.ref] = ds.local_id
+            handle.future.set_result(ds)
+
+    @staticmethod
+    def _resolve_input(value, refs):
+        if not isinstance(value, PendingDataset):
+            return value
+        if value.done():
+            return value.future.result().id
+        if value.ref in refs:
+            return f"${value.ref}"
+        raise RuntimeError(f"input {value.name} has not been logged yet")
+
+_log_queue = None
+_log_queue_lock = threading.Lock()
+
+def _get_log_queue():
+    global _log_queue
+    with _log_queue_lock:
+        if _log_queue is None:
+            _log_queue = _LogQueue(CONFIG["LOG_BATCH_SIZE"], CONFIG["LOG_FLUSH_INTERVAL"], CONFIG["LOG_MAX_PENDING"])
+        return _log_queue
+
+def flush(timeout=None):
+    """异步模式下提交所有排队的记录并等待完成（进程退出时会自动调用）；超时返回 False"""
+    return _log_queue.flush(timeout) if _log_queue is not None else True
+
+def _flush_at_exit():
+    log_queue = _log_queue
+    if log_queue is not None and not log_queue.flush(CONFIG["LOG_EXIT_TIMEOUT"]):
+        print(f"⚠️ DataTrace: {log_queue.pending()} queued operations were not logged before exit")
+
+def _stop_log_queue():
+    global _log_queue
+    with _log_queue_lock:
+        old, _log_queue = _log_queue, None
+    if old is not None:
+        old.close()
+
+atexit.register(_flush_at_exit)
+
+def _is_local_id(value):
+    return isinstance(value, str) and value.startswith(LOCAL_ID_PREFIX)
+
+class _Spool:
+    """
+    离线暂存（SQLite 文件，追加写入）：
+    - events：待重放的变换 payload（带 client_id 幂等键）及其输出的本地 id，按 seq 顺序重放
+    - id_map：本地 id -> 服务端 id，重放后续记录时替换其中引用的本地 id
+    重放以 POST /transform/batch 提交，服务端按 client_id 去重，因此重放中断、多进程同时重放都不会重复写入。
+    重放成功的事件删除；被服务端拒绝（4xx）的事件标记为 failed 保留在文件中，不阻塞后续事件。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        # 重放串行化；与 _lock 分开，重放进行网络请求时 log() 仍可立即追加
+        self._replay_lock = threading.Lock()
+        self._offline_until = 0.0
+        self._pending = 0
+        self._replayer = None
+        self._handles = weakref.WeakValueDictionary()
+        if os.path.exists(path):
+            with closing(self._connect()) as conn:
+                self._pending = conn.execute("SELECT COUNT(*) FROM events WHERE status = 'pending'").fetchone()[0]
+            if self._pending:
+                self._start_replayer()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("""CREATE TABLE IF NOT EXISTS events
+                        (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                         client_id TEXT UNIQUE NOT NULL,
+                         payload TEXT NOT NULL,
+                         output_ids TEXT NOT NULL,
+                         status TEXT NOT NULL DEFAULT 'pending',
+                         detail TEXT,
+                         created_at TEXT NOT NULL)""")
+        conn.execute("CREATE TABLE IF NOT EXISTS id_map (local_id TEXT PRIMARY KEY, server_id TEXT NOT NULL)")
+        return conn
+
+    def busy(self):
+        """有待重放的事件，或最近一次请求失败后仍在退避期内"""
+        return self._pending > 0 or time.monotonic() < self._offline_until
+
+    def go_offline(self, error):
+        if not self.busy():
+            print(f"⚠️ DataTrace API unavailable ({error}); spooling operations to {self.path}")
+        self._offline_until = time.monotonic() + CONFIG["SPOOL_RETRY_INTERVAL"]
+
+    def log(self, payload):
+        """追加一条变换，返回其输出的 SpooledDataset 列表（本地 id）"""
+        outputs = [SpooledDataset(f"{LOCAL_ID_PREFIX}{uuid.uuid4().hex[:12]}", o["name"]) for o in payload["outputs"]]
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO events (client_id, payload, output_ids, created_at) VALUES (?, ?, ?, ?)",
+                (payload["client_id"], json.dumps(payload), json.dumps([o.local_id for o in outputs]), datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+            self._pending += 1
+        for ds in outputs:
+            self._handles[ds.local_id] = ds
+        print(f"📦 Operation '{payload['operation']}' spooled (local ID: {outputs[0].local_id})")
+        self._start_replayer()
+        return outputs
+
+    def _start_replayer(self):
+        with self._lock:
+            if self._replayer is None or not self._replayer.is_alive():
+                self._replayer = threading.Thread(target=self._replay_loop, name="datatrace-replay", daemon=True)
+                self._replayer.start()
+
+    def _replay_loop(self):
+        while True:
+            time.sleep(max(self._offline_until - time.monotonic(), 0.0) or CONFIG["SPOOL_RETRY_INTERVAL"])
+            try:
+                self.replay()
+            except requests.RequestException:
+                self._offline_until = time.monotonic() + CONFIG["SPOOL_RETRY_INTERVAL"]
+                continue
+            with self._lock:
+                if not self._pending:
+                    self._replayer = None
+                    return
+
+    def replay(self, batch_size=200):
+        """按顺序重放全部待重放事件，返回本次的统计；API 仍不可用时抛出 requests.RequestException"""
+        replayed = failed = 0
+        with self._replay_lock:
+            while True:
+                with closing(self._connect()) as conn:
+                    rows = conn.execute(
+                        "SELECT seq, payload, output_ids FROM events WHERE status = 'pending' ORDER BY seq LIMIT ?", (batch_size,)
+                    ).fetchall()
+                    id_map = dict(conn.execute("SELECT local_id, server_id FROM id_map"))
+                if not rows:
+                    break
+                items, local_refs = [], {}
+                for seq, payload, output_ids in rows:
+                    payload = json.loads(payload)
+                    # 本地 id：已重放的替换为服务端 id，同批前面事件的输出用 "$ref.N" 引用；都不是时由服务端报错
+                    payload["input_ids"] = [id_map.get(i) or local_refs.get(i, i) for i in payload["input_ids"]]
+                    payload["ref"] = f"s{seq}"
+                    for k, local_id in enumerate(json.loads(output_ids)):
+                        local_refs[local_id] = f"$s{seq}.{k}"
+                    items.append(payload)
+                res = get_client().post("/transform/batch", json={"items": items}, retry=False)
+                res.raise_for_status()
+                results = res.json()["results"]
+                mapped = []
+                with closing(self._connect()) as conn, conn:
+                    for (seq, _, output_ids), item, result in zip(rows, items, results):
+                        if result["status"] == "ok":
+                            pairs = list(zip(json.loads(output_ids), [o["id"] for o in result["output_datasets"]]))
+                            conn.executemany("INSERT OR REPLACE INTO id_map (local_id, server_id) VALUES (?, ?)", pairs)
+                            conn.execute("DELETE FROM events WHERE seq = ?", (seq,))
+                            mapped.extend(pairs)
+                            replayed += 1
+                        else:
+                            conn.execute("UPDATE events SET status = 'failed', detail = ? WHERE seq = ?", (str(result.get("detail")), seq))
+                            print(f"❌ Spooled operation '{item['operation']}' rejected: {result.get('detail')}")
+                            failed += 1
+                with self._lock:
+                    self._pending = max(0, self._pending - len(rows))
+                for local_id, server_id in mapped:
+                    ds = self._handles.get(local_id)
+                    if ds is not None:
+                        ds.server_id = server_id
+            self._offline_until = 0.0
+        if replayed or failed:
+            print(f"🔁 Replayed {replayed} spooled operations ({failed} rejected)")
+        return {"replayed": replayed, "failed": failed, "pending": self._pending}
+
+    def resolve(self, value):
+        if not _is_local_id(value) or not os.path.exists(self.path):
+            return value
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT server_id FROM id_map WHERE local_id = ?", (value,)).fetchone()
+        return row[0] if row else value
+
+_spool = None
+_spool_lock = threading.Lock()
+
+def _get_spool():
+    """离线暂存（CONFIG["SPOOL_PATH"] 为 None 时关闭）；首次使用时若暂存文件中有待重放事件则启动后台重放"""
+    global _spool
+    path = CONFIG["SPOOL_PATH"]
+    if not path or CONFIG["MODE"] == "embedded":
+        return None
+    with _spool_lock:
+        if _spool is None or _spool.path != path:
+            _spool = _Spool(path)
+        return _spool
+
+def replay(batch_size=200):
+    """立即重放离线暂存中的记录，返回 {"replayed", "failed", "pending"}；API 仍不可用时抛出 requests.RequestException"""
+    spool = _get_spool()
+    if spool is None:
+        return {"replayed": 0, "failed": 0, "pending": 0}
+    return spool.replay(batch_size)
+
+def resolve_id(dataset):
+    """本地 id（local-xxxx，离线时 log() 返回）-> 服务端 id；尚未重放或非本地 id 时原样返回"""
+    value = dataset.id if isinstance(dataset, Dataset) else str(dataset)
+    spool = _get_spool()
+    return spool.resolve(value) if spool is not None else value
+
 # --- 高级功能：装饰器 ---
 # 这样用户完全不用改函数内部逻辑，只要加一行 @dt.trace
 def trace(op_name, output_name_suffix="_processed"):
@@ -136,8 +1001,13 @@ def trace(op_name, output_name_suffix="_processed"):
         return wrapper
     return decorator
 
-def get_records(start=None, end=None, op_types=None, q=None, actor=None, source=None, run_id=None, dataset_id=None, direction="both", depth=2, limit=50, offset=0):
+def get_records(start=None, end=None, op_types=None, q=None, actor=None, source=None, run_id=None, dataset_id=None, direction="both", depth=2, limit=50, offset=0, cursor=None, include_count=None):
+    """cursor 传入上一页返回的 next_cursor 即可翻页（不需要全量 COUNT）"""
     params = {"limit": int(limit or 50), "offset": int(offset or 0)}
+    if cursor:
+        params["cursor"] = cursor
+    if include_count is not None:
+        params["include_count"] = bool(include_count)
     if start:
         params["start"] = start
     if end:
@@ -156,10 +1026,33 @@ def get_records(start=None, end=None, op_types=None, q=None, actor=None, source=
         params["dataset_id"] = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
         params["direction"] = direction
         params["depth"] = int(depth or 2)
-    res = requests.get(f"{CONFIG['API_URL']}/records", params=params)
+    res = get_client().get("/records", params=params)
     res.raise_for_status()
     return res.json()
 
+def export_records(start=None, end=None, op_types=None, q=None, actor=None, source=None, run_id=None):
+    """流式拉取全部 records（NDJSON），逐条 yield dict，适合离线审计全量导出"""
+    params = {}
+    if start:
+        params["start"] = start
+    if end:
+        params["end"] = end
+    if op_types:
+        params["op_types"] = ",".join(op_types) if isinstance(op_types, (list, tuple, set)) else str(op_types)
+    if q:
+        params["q"] = q
+    if actor:
+        params["actor"] = actor
+    if source:
+        params["source"] = source
+    if run_id:
+        params["run_id"] = run_id
+    with get_client().get("/records/export", params=params, stream=True) as res:
+        res.raise_for_status()
+        for line in res.iter_lines():
+            if line:
+                yield json.loads(line)
+
 def get_operations(start=None, end=None, q=None, actor=None, source=None, run_id=None, dataset_id=None, direction="both", depth=2):
     params = {}
     if start:
@@ -178,7 +1071,7 @@ def get_operations(start=None, end=None, q=None, actor=None, source=None, run_id
         params["dataset_id"] = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
         params["direction"] = direction
         params["depth"] = int(depth or 2)
-    res = requests.get(f"{CONFIG['API_URL']}/operations", params=params)
+    res = get_client().get("/operations", params=params)
     res.raise_for_status()
     return res.json()
 
@@ -193,7 +1086,23 @@ def get_lineage(dataset_id, direction="both", depth=2, start=None, end=None, op_
         params["op_types"] = ",".join(op_types) if isinstance(op_types, (list, tuple, set)) else str(op_types)
     if q:
         params["q"] = q
-    res = requests.get(f"{CONFIG['API_URL']}/lineage/{ds_id}", params=params)
+    res = get_client().get(f"/lineage/{ds_id}", params=params)
+    res.raise_for_status()
+    return res.json()
+
+def get_descendants(dataset_id, depth=None):
+    """影响分析：返回所有下游数据集（depth=None 不限层数）"""
+    ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
+    params = {"depth": int(depth)} if depth is not None else {}
+    res = get_client().get(f"/datasets/{ds_id}/descendants", params=params)
+    res.raise_for_status()
+    return res.json()
+
+def get_ancestors(dataset_id, depth=None):
+    """溯源：返回所有上游数据集（depth=None 不限层数）"""
+    ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
+    params = {"depth": int(depth)} if depth is not None else {}
+    res = get_client().get(f"/datasets/{ds_id}/ancestors", params=params)
     res.raise_for_status()
     return res.json()
 
@@ -214,27 +1123,141 @@ def get_report(dataset_id, direction="both", depth=2, start=None, end=None, op_t
         params["source"] = source
     if run_id:
         params["run_id"] = run_id
-    res = requests.get(f"{CONFIG['API_URL']}/report/{ds_id}", params=params)
+    res = get_client().get(f"/report/{ds_id}", params=params)
     res.raise_for_status()
     return res.text
 
-def get_timeseries(dataset_id, start=None, end=None, metric=None, limit=1000):
+def get_timeseries(dataset_id, start=None, end=None, metric=None, limit=1000, resolution=None, max_points=None):
+    """resolution: raw/minute/hour/day；只给 max_points 时由服务端选择粒度（响应中的 resolution 字段）"""
     ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
     params = {"limit": int(limit or 1000)}
+    if resolution:
+        params["resolution"] = resolution
+    if max_points:
+        params["max_points"] = int(max_points)
     if start:
         params["start"] = start
     if end:
         params["end"] = end
     if metric:
         params["metric"] = metric
-    res = requests.get(f"{CONFIG['API_URL']}/timeseries/{ds_id}", params=params)
+    res = get_client().get(f"/timeseries/{ds_id}", params=params)
+    res.raise_for_status()
+    return res.json()
+
+def get_aligned_timeseries(series=None, dataset_id=None, direction="upstream", depth=1, metric="value", start=None, end=None, resolution="raw", how="outer", fill=None, limit=1000):
+    """
+    多序列时间对齐，服务端一次归并返回一个帧：
+    - series：[(数据集或 id, 指标), ...] 或 [数据集或 id, ...]（指标取 metric）
+    - 或 dataset_id + direction/depth：该数据集与其血缘范围内数据集的同一指标（默认对比上游父数据集）
+    返回 {"timestamps": [...], "series": [{"dataset_id", "metric", "name", "values": [...]}]}
+    """
+    params = {"metric": metric, "resolution": resolution, "how": how, "limit": int(limit or 1000)}
+    if series:
+        items = []
+        for item in series:
+            ds, name = item if isinstance(item, (list, tuple)) else (item, metric)
+            items.append(f"{ds.id if isinstance(ds, Dataset) else ds}:{name}")
+        params["series"] = ",".join(items)
+    if dataset_id:
+        params["dataset_id"] = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
+        params["direction"] = direction
+        params["depth"] = int(depth)
+    if start:
+        params["start"] = start
+    if end:
+        params["end"] = end
+    if fill:
+        params["fill"] = fill
+    res = get_client().get("/timeseries/aligned", params=params)
+    res.raise_for_status()
+    return res.json()
+
+def resample_timeseries(dataset_id, every, aggs=("mean",), metric="value", start=None, end=None, limit=1000):
+    """服务端分桶聚合（every 如 15min / 1h / 1d），只传回聚合后的桶"""
+    ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
+    params = {
+        "every": every,
+        "aggs": ",".join(aggs) if isinstance(aggs, (list, tuple, set)) else str(aggs),
+        "metric": metric,
+        "limit": int(limit or 1000),
+    }
+    if start:
+        params["start"] = start
+    if end:
+        params["end"] = end
+    res = get_client().get(f"/timeseries/{ds_id}/resample", params=params)
+    res.raise_for_status()
+    return res.json()
+
+def rolling_timeseries(dataset_id, window, stats=("mean",), quantiles=None, min_periods=None, metric="value", start=None, end=None, limit=1000):
+    """服务端滑动窗口统计（window 为点数如 20，或时间跨度如 1h）"""
+    ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
+    params = {
+        "window": str(window),
+        "stats": ",".join(stats) if isinstance(stats, (list, tuple, set)) else str(stats),
+        "metric": metric,
+        "limit": int(limit or 1000),
+    }
+    if quantiles:
+        params["quantiles"] = ",".join(str(q) for q in quantiles) if isinstance(quantiles, (list, tuple, set)) else str(quantiles)
+    if min_periods is not None:
+        params["min_periods"] = int(min_periods)
+    if start:
+        params["start"] = start
+    if end:
+        params["end"] = end
+    res = get_client().get(f"/timeseries/{ds_id}/rolling", params=params)
     res.raise_for_status()
     return res.json()
 
 def add_timeseries(dataset_id, points, metric="value"):
     ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
     payload = {"points": [{"timestamp": p["timestamp"], "value": p["value"], "metric": metric} for p in points]}
-    res = requests.post(f"{CONFIG['API_URL']}/timeseries/{ds_id}", json=payload)
+    res = get_client().post(f"/timeseries/{ds_id}", json=payload)
+    res.raise_for_status()
+    return res.json()
+
+def _ndjson_body(points, metric, batch_lines=5000):
+    lines = []
+    for p in points:
+        if isinstance(p, dict):
+            item = {"timestamp": p["timestamp"], "value": p["value"], "metric": p.get("metric") or metric}
+        else:
+            item = {"timestamp": p[0], "value": p[1], "metric": p[2] if len(p) > 2 else metric}
+        if not isinstance(item["timestamp"], (str, int, float)):
+            item["timestamp"] = str(item["timestamp"])
+        lines.append(json.dumps(item))
+        if len(lines) >= batch_lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+def _frame_body(frames):
+    for metric, times_us, values in frames:
+        name = metric.encode("utf-8")
+        times_us, values = list(times_us), list(values)
+        yield struct.pack(f"<H{len(name)}sI", len(name), name, len(times_us))
+        for i in range(0, len(times_us), 4096):
+            part = [x for pair in zip(times_us[i : i + 4096], values[i : i + 4096]) for x in (int(pair[0]), float(pair[1]))]
+            yield struct.pack("<" + "qd" * (len(part) // 2), *part)
+
+def ingest_timeseries(dataset_id, points=None, metric="value", frames=None, chunk_size=None):
+    """
+    流式写入大量时间序列点（请求体边生成边发送，不需要一次性放进内存）：
+    - points：可迭代的 {"timestamp", "value", "metric"} 或 (timestamp, value[, metric])，按 NDJSON 发送
+    - frames：可迭代的 (metric, 纪元微秒列表, 数值列表)，按 binary 帧发送（更快）
+    """
+    ds_id = dataset_id.id if isinstance(dataset_id, Dataset) else str(dataset_id)
+    params = {"metric": metric}
+    if chunk_size:
+        params["chunk_size"] = int(chunk_size)
+    if frames is not None:
+        body, content_type = _frame_body(frames), "application/octet-stream"
+    else:
+        body, content_type = _ndjson_body(points or [], metric), "application/x-ndjson"
+    res = get_client().post(f"/timeseries/{ds_id}/ingest", params=params, data=body, headers={"Content-Type": content_type})
     res.raise_for_status()
     return res.json()
 
@@ -250,6 +1273,6 @@ def generate_timeseries(dataset_id, periods=60, freq="daily", amplitude=10.0, no
     }
     if start:
         params["start"] = start
-    res = requests.post(f"{CONFIG['API_URL']}/timeseries/{ds_id}/generate", params=params)
+    res = get_client().post(f"/timeseries/{ds_id}/generate", params=params)
     res.raise_for_status()
     return res.json()
@@ -0,0 +1,1111 @@
+"""
+业务逻辑层：数据集 get-or-create、变换写入、血缘查询与时间序列读写。
+api_server 的路由只负责 HTTP 参数解析与响应封装，SDK 的嵌入模式（datatrace.EmbeddedClient）直接调用这里的函数，
+两者共用同一套校验与写入逻辑。错误统一抛出 ServiceError（带 HTTP 状态码），由调用方转换为各自的错误响应。
+"""
+import json
+import math
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+import database as db
+from lineage_graph import CompactLineageGraph, DictLineageGraph
+import timeseries_analytics as tsa
+import timeseries_ingest as tsi
+import timeseries_store
+
+class ServiceError(Exception):
+    """业务错误：status_code 与 detail 同 HTTP 响应（api_server 注册了对应的异常处理器）"""
+
+    def __init__(self, status_code: int, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _not_found(dataset_id):
+    return ServiceError(404, f"Dataset {dataset_id} not found")
+
+# 记录数达到该值时常驻血缘图改用 CompactLineageGraph（省内存、查询较慢），否则用 DictLineageGraph；
+# 在每次（重新）加载时判断，设为 0 则总是使用紧凑表示
+COMPACT_GRAPH_MIN_RECORDS = 500_000
+
+# --- 常驻血缘图缓存 ---
+class LineageGraph:
+    """
+    进程内常驻的血缘图：启动时加载一次，/transform/ 写穿透增量更新，
+    血缘范围类接口（/lineage、/report、/records、/operations 带 dataset_id）直接在内存中遍历。
+    图结构默认为 lineage_graph.DictLineageGraph，记录数超过 COMPACT_GRAPH_MIN_RECORDS 时改用 CompactLineageGraph，
+    只为触达的记录回表取详情。
+    database 中的 lineage_version 在每次写入 record 时递增；其它写入方（如 Streamlit 直连 database.py）
+    推进版本号后，下次请求会检测到版本不一致并重新加载，而不是返回过期结果。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.graph = DictLineageGraph()
+
+    def load(self):
+        with self._lock:
+            # 先读版本号再读记录：并发写入只会让缓存“多”而不会漏，下次请求再对齐版本
+            version = db.get_lineage_version()
+            compact = db.get_records_count() >= COMPACT_GRAPH_MIN_RECORDS
+            graph = CompactLineageGraph() if compact else DictLineageGraph()
+            graph.extend(db.iter_records())
+            self.graph = graph
+            self.version = version
+
+    def ensure_fresh(self):
+        current = db.get_lineage_version()
+        with self._lock:
+            if current != self.version:
+                self.load()
+
+    def apply_record(self, rec, version):
+        """写穿透：仅当新版本紧接缓存版本时增量追加，否则标记过期，下次请求重新加载。"""
+        self.apply_records([rec], version)
+
+    def apply_records(self, records, version):
+        """批量写穿透：records 按写入顺序排列，version 为写入最后一条后的版本号。"""
+        with self._lock:
+            if self.version is not None and version == self.version + len(records):
+                for rec in records:
+                    self.graph.add_record(rec)
+                self.version = version
+            else:
+                self.version = None
+
+    def scope_ids(self, dataset_id, direction="both", depth=2, search_q=None, **filters):
+        """只做遍历，返回 (record_id_set, dataset_id_set)。"""
+        direction = (direction or "").strip().lower()
+        if direction not in ("upstream", "downstream", "both"):
+            raise ValueError("direction must be upstream, downstream, or both")
+        depth = int(depth or 0)
+        if depth < 0:
+            raise ValueError("depth must be >= 0")
+        self.ensure_fresh()
+
+        allowed_records = db.search_record_ids(search_q) if search_q else None
+        with self._lock:
+            return self.graph.bfs(dataset_id, direction, depth, allowed_records=allowed_records, **filters)
+
+    def scope(self, dataset_id, direction="both", depth=2, **filters):
+        """与 database.get_lineage_scope 语义一致，返回 (records, dataset_id_set)。"""
+        record_ids, dataset_ids = self.scope_ids(dataset_id, direction, depth, **filters)
+        return db.get_records_by_ids(record_ids), dataset_ids
+
+lineage_graph = LineageGraph()
+
+# --- Pydantic 模型 (用于请求体验证) ---
+class DatasetCreate(BaseModel):
+    name: str
+    description: str
+    tags: List[str]
+
+class OutputSpec(BaseModel):
+    name: str
+    description: str = ""
+
+class RecordCreate(BaseModel):
+    input_ids: List[str]
+    operation: str
+    description: str
+    actor: Optional[str] = None
+    source: Optional[str] = None
+    run_id: Optional[str] = None
+    # 兼容旧字段：目前后端不使用该字段来命名
+    output_suffix: str = "_processed"
+    # 与 Web UI 对齐：支持单次操作生成多个输出数据集
+    output_count: int = 1
+    outputs: Optional[List[OutputSpec]] = None
+    # 客户端生成的幂等键：同一 client_id 重复提交时返回第一次写入的结果（SDK 离线重放依赖此字段）
+    client_id: Optional[str] = None
+
+    class Config:
+        extra = "ignore"
+
+class DatasetBatchItem(DatasetCreate):
+    # 客户端自定义的临时引用名，原样回显在结果中，便于把结果对应回请求
+    ref: Optional[str] = None
+
+class DatasetBatch(BaseModel):
+    items: List[DatasetBatchItem]
+    chunk_size: int = 500
+
+class DatasetResolve(BaseModel):
+    names: List[str] = []
+    ids: List[str] = []
+
+class TransformBatchItem(RecordCreate):
+    # 临时引用：后续条目的 input_ids 可用 "$ref"（第一个输出）或 "$ref.N"（第 N 个输出，从 0 开始）
+    ref: Optional[str] = None
+
+class TransformBatch(BaseModel):
+    items: List[TransformBatchItem]
+    chunk_size: int = 500
+
+class TimeseriesPoint(BaseModel):
+    timestamp: str
+    value: float
+    metric: Optional[str] = None
+
+class TimeseriesBatch(BaseModel):
+    points: List[TimeseriesPoint]
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    v = value.strip()
+    if not v:
+        return None
+    # 支持 YYYY-MM-DD 或 ISO datetime
+    try:
+        if len(v) == 10 and v[4] == "-" and v[7] == "-":
+            return datetime.strptime(v, "%Y-%m-%d")
+        return datetime.fromisoformat(v)
+    except Exception:
+        raise ServiceError(400, f"Invalid datetime format: {value}")
+
+def _split_list(text):
+    return [s.strip() for s in (text or "").split(",") if s.strip()]
+
+def ndjson(rows):
+    """把 dict 行序列化为 NDJSON 文本行（流式导出用）"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=str) + "\n"
+
+# --- 数据集 ---
+
+def create_dataset(item: DatasetCreate):
+    # 按名称原子 get-or-create：已存在则返回旧的 ID，不报错 (Idempotency)
+    ds_id, created = db.get_or_create_dataset(str(uuid.uuid4())[:8], item.name, item.description, item.tags)
+    if not created:
+        return {
+            "id": ds_id,
+            "name": item.name,
+            "message": "Dataset already exists, returning existing ID.",
+            "new": False
+        }
+    return {
+        "id": ds_id,
+        "name": item.name,
+        "message": "Dataset registered successfully",
+        "new": True
+    }
+
+# 单次批量解析的名称 + id 上限
+_RESOLVE_MAX_ITEMS = 5000
+
+def resolve_datasets(req: DatasetResolve):
+    """
+    批量解析数据集（只读，不创建）：names 按名称登记表查找（同名时为最新的一个），ids 按 id 查找。
+    返回 {"names": {name: dataset 或 null}, "ids": {id: dataset 或 null}}，供 SDK 一次请求填充本地缓存。
+    """
+    if len(req.names) + len(req.ids) > _RESOLVE_MAX_ITEMS:
+        raise ServiceError(400, f"at most {_RESOLVE_MAX_ITEMS} names and ids per request")
+    name_ids = db.get_dataset_ids_by_names(req.names)
+    found = db.get_datasets_by_ids(set(name_ids.values()) | set(req.ids))
+    return {
+        "names": {name: found.get(name_ids.get(name)) for name in req.names},
+        "ids": {ds_id: found.get(ds_id) for ds_id in req.ids},
+    }
+
+def _check_chunk_size(chunk_size: int):
+    if chunk_size < 1 or chunk_size > 5000:
+        raise ServiceError(400, "chunk_size must be between 1 and 5000")
+
+def _item_error(idx: int, ref: Optional[str], e: Exception):
+    """单条失败的结果；非 ServiceError（如 sqlite3 错误）按 500 记录，不中断整个批次"""
+    if isinstance(e, ServiceError):
+        return {"index": idx, "ref": ref, "status": "error", "status_code": e.status_code, "detail": e.detail}
+    return {"index": idx, "ref": ref, "status": "error", "status_code": 500, "detail": f"{type(e).__name__}: {e}"}
+
+def _batch_summary(results: list):
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return {"count": len(results), "succeeded": ok, "failed": len(results) - ok, "results": results}
+
+def create_datasets_batch(batch: DatasetBatch):
+    """
+    批量注册数据集（按名称 get-or-create，语义同 create_dataset）。
+    每 chunk_size 条提交一次事务；单条失败只回滚该条（SAVEPOINT），结果按条目返回。
+    """
+    _check_chunk_size(batch.chunk_size)
+    results = []
+    for start in range(0, len(batch.items), batch.chunk_size):
+        with db.transaction():
+            for idx in range(start, min(start + batch.chunk_size, len(batch.items))):
+                item = batch.items[idx]
+                name = (item.name or "").strip()
+                if not name:
+                    results.append(_item_error(idx, item.ref, ServiceError(400, "Dataset name cannot be empty")))
+                    continue
+                try:
+                    ds_id, created = db.get_or_create_dataset(str(uuid.uuid4())[:8], name, item.description, item.tags)
+                except Exception as e:
+                    results.append(_item_error(idx, item.ref, e))
+                    continue
+                results.append({"index": idx, "ref": item.ref, "status": "ok", "id": ds_id, "name": name, "new": created})
+    return _batch_summary(results)
+
+# --- 变换 ---
+
+def _transformation_payload(rec_id: str, created_outputs: list):
+    payload = {
+        "record_id": rec_id,
+        "output_datasets": created_outputs,
+    }
+    # 兼容旧客户端：单输出时保留 output_dataset 字段
+    if len(created_outputs) == 1:
+        payload["output_dataset"] = created_outputs[0]
+    return payload
+
+def _replayed_transformation(client_id: Optional[str]):
+    """client_id 已写入过时返回当时的响应（带 replayed=True），否则返回 None"""
+    record = db.get_record_by_client_id(client_id) if client_id else None
+    if record is None:
+        return None
+    found = db.get_datasets_by_ids(record["output_ids"])
+    outputs = [{"id": o, "name": found[o]["name"] if o in found else None} for o in record["output_ids"]]
+    return dict(_transformation_payload(record["id"], outputs), replayed=True)
+
+def _prepare_transformation(item: RecordCreate, uow, input_ids: List[str]):
+    """
+    校验输入并把一次变换的全部写入登记到 uow（不提交），返回响应 payload。
+    item.client_id 已写入过时不登记任何写入，直接返回第一次的结果（replayed=True）。
+    """
+    replayed = _replayed_transformation(item.client_id)
+    if replayed is not None:
+        return replayed
+    # 1. 验证输入数据集是否存在（一次批量查询）
+    found = db.get_datasets_by_ids(input_ids)
+    inputs = []
+    for i_id in input_ids:
+        ds = found.get(i_id)
+        if not ds:
+            raise ServiceError(404, f"Input dataset {i_id} not found")
+        inputs.append(ds)
+
+    # 2. 生成输出配置（支持多输出）
+    input_names = [d['name'] for d in inputs]
+    base_name = "merged_dataset" if len(input_names) > 1 else input_names[0]
+    op_slug = (item.operation or "").strip().lower().replace(" ", "_") or "transformed"
+
+    if item.outputs:
+        output_specs = item.outputs
+    else:
+        count = max(1, int(item.output_count or 1))
+        if count == 1:
+            default_names = [f"{base_name}_{op_slug}"]
+        else:
+            default_names = [f"{base_name}_{op_slug}_{idx + 1}" for idx in range(count)]
+        output_specs = [OutputSpec(name=n, description="") for n in default_names]
+
+    # 3. 继承标签
+    all_tags = set()
+    for d in inputs:
+        if d['tags']: all_tags.update(d['tags'].split(","))
+    all_tags.add(op_slug)
+    all_tags.add("generated")
+
+    # 4. 登记写入（输出数据集 + 时间序列继承 + 血缘记录）
+    rec_id = str(uuid.uuid4())[:8]
+
+    created_outputs = []
+    output_ids = []
+    for spec in output_specs:
+        name = (spec.name or "").strip()
+        if not name:
+            raise ServiceError(400, "Output dataset name cannot be empty")
+
+        new_id = str(uuid.uuid4())[:8]
+        new_desc = spec.description.strip() if spec.description else ""
+        if not new_desc:
+            new_desc = f"Generated via {item.operation} from {', '.join(input_names)}. {item.description}"
+
+        uow.add_dataset(new_id, name, new_desc, list(all_tags))
+        output_ids.append(new_id)
+        created_outputs.append({"id": new_id, "name": name})
+
+        # 时间序列数据继承：引用输入数据集的序列（读取时解析，首次写入输出时才物化）
+        uow.inherit_timeseries(input_ids, new_id, prefix_metric=(len(input_ids) > 1))
+
+    actor = (item.actor or "").strip() or "anonymous"
+    source = (item.source or "").strip() or "api"
+    run_id = (item.run_id or "").strip() or None
+    uow.add_record(rec_id, input_ids, item.operation, item.description, output_ids, actor=actor, source=source, run_id=run_id, client_id=item.client_id or None)
+    return _transformation_payload(rec_id, created_outputs)
+
+def create_transformation(item: RecordCreate):
+    # 单个事务：输出数据集 + 时间序列继承 + 血缘记录；client_id 查重也在写锁内，并发重放不会重复写入
+    with db.transaction():
+        uow = db.UnitOfWork()
+        payload = _prepare_transformation(item, uow, item.input_ids)
+        uow.commit()
+        version = db.get_lineage_version()
+    if not payload.get("replayed"):
+        lineage_graph.apply_record(db.get_records_by_ids([payload["record_id"]])[0], version)
+    return payload
+
+def _resolve_ref(value: str, refs: dict, failed_refs: Optional[dict] = None):
+    """
+    "$ref" -> 该条目的第一个输出，"$ref.N" -> 第 N 个输出；其它值视为数据集 id 原样返回。
+    引用的条目失败（failed_refs: ref -> 条目下标）时报告依赖失败，而不是当作未定义的引用。
+    """
+    if not value.startswith("$"):
+        return value
+    name, index = value[1:], 0
+    if name not in refs and name not in (failed_refs or {}) and "." in name:
+        base, _, suffix = name.rpartition(".")
+        if suffix.isdigit():
+            name, index = base, int(suffix)
+    if failed_refs and name in failed_refs:
+        raise ServiceError(400, f"Ref {value} depends on failed item {failed_refs[name]}")
+    outputs = refs.get(name)
+    if outputs is None or index >= len(outputs):
+        raise ServiceError(400, f"Unresolved ref {value}")
+    return outputs[index]
+
+def create_transformations_batch(batch: TransformBatch):
+    """
+    批量写入变换（语义同 create_transformation），用于回放历史血缘：
+    - 条目按顺序执行，前面条目的输出可通过临时引用（"$ref" / "$ref.N"）作为后续条目的输入
+    - 每 chunk_size 条提交一次事务；单条失败只回滚该条，引用它的后续条目也会失败
+    - 已提交的 chunk 不会因后续 chunk 出错而回滚
+    """
+    _check_chunk_size(batch.chunk_size)
+    refs = {}
+    failed_refs = {}
+    results = []
+    for start in range(0, len(batch.items), batch.chunk_size):
+        written = []
+        with db.transaction():
+            for idx in range(start, min(start + batch.chunk_size, len(batch.items))):
+                item = batch.items[idx]
+                try:
+                    if item.ref and item.ref in refs:
+                        raise ServiceError(400, f"Duplicate ref {item.ref}")
+                    input_ids = [_resolve_ref(i, refs, failed_refs) for i in item.input_ids]
+                    uow = db.UnitOfWork()
+                    payload = _prepare_transformation(item, uow, input_ids)
+                    uow.commit()
+                except Exception as e:
+                    # uow.commit() 在 SAVEPOINT 内执行，失败只回滚该条；其它异常同样按条记录，不中断批次
+                    results.append(_item_error(idx, item.ref, e))
+                    if item.ref and item.ref not in refs:
+                        failed_refs.setdefault(item.ref, idx)
+                    continue
+                if item.ref:
+                    refs[item.ref] = [o["id"] for o in payload["output_datasets"]]
+                if not payload.get("replayed"):
+                    written.append(payload["record_id"])
+                results.append({"index": idx, "ref": item.ref, "status": "ok", **payload})
+            # 事务内读取：写锁保证这段版本号只由本 chunk 的记录推进
+            version = db.get_lineage_version()
+        if written:
+            lineage_graph.apply_records(db.get_records_by_ids(written), version)
+    return _batch_summary(results)
+
+# --- 血缘查询 ---
+
+def _closure_query(dataset_id: str, depth: Optional[int], lookup):
+    if depth is not None and depth < 0:
+        raise ServiceError(400, "depth must be >= 0")
+    if not db.get_dataset_by_id(dataset_id):
+        raise _not_found(dataset_id)
+    results = lookup(dataset_id, max_depth=depth)
+    return {"dataset_id": dataset_id, "depth": depth, "count": len(results), "results": results}
+
+def list_descendants(dataset_id: str, depth: Optional[int] = None):
+    """影响分析：所有下游数据集（depth 为空表示不限层数），基于传递闭包表。"""
+    return _closure_query(dataset_id, depth, db.get_descendants)
+
+def list_ancestors(dataset_id: str, depth: Optional[int] = None):
+    """溯源：所有上游数据集（depth 为空表示不限层数），基于传递闭包表。"""
+    return _closure_query(dataset_id, depth, db.get_ancestors)
+
+def list_records(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    op_types: Optional[str] = None,
+    q: Optional[str] = None,
+    actor: Optional[str] = None,
+    source: Optional[str] = None,
+    run_id: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    direction: str = "both",
+    depth: int = 2,
+    limit: int = 50,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    include_count: Optional[bool] = None,
+):
+    """
+    查询血缘事件 records（支持分页/筛选），用于 UI/外部工具把血缘当作“可查询的数据产品”。
+    - start/end: YYYY-MM-DD 或 ISO datetime
+    - op_types: 逗号分隔，例如 Clean,Merge
+    - q: 搜索 operation_desc 或 record id
+    - actor/source/run_id: 记录来源/操作者筛选
+    - cursor: 上一页返回的 next_cursor（推荐，按 (timestamp, id) 的 keyset 分页）
+    - limit/offset: 分页（offset 为兼容旧客户端保留）
+    - include_count: 是否返回总数；默认 offset 分页返回、cursor 分页不返回（省去全量 COUNT）
+    """
+    if limit < 1 or limit > 200:
+        raise ServiceError(400, "limit must be between 1 and 200")
+    if offset < 0:
+        raise ServiceError(400, "offset must be >= 0")
+
+    start_dt = parse_datetime(start)
+    end_dt = parse_datetime(end)
+    ops = [s.strip() for s in op_types.split(",") if s.strip()] if op_types else None
+    filters = dict(start_date=start_dt, end_date=end_dt, op_types=ops, search_q=q, actor=actor, source=source, run_id=run_id)
+
+    if include_count is None:
+        include_count = not cursor
+
+    record_ids = None
+    total = None
+    if dataset_id:
+        scope_ds = db.get_dataset_by_id(dataset_id)
+        if not scope_ds:
+            raise _not_found(dataset_id)
+        try:
+            record_ids, _ = lineage_graph.scope_ids(dataset_id, direction=direction, depth=depth, **filters)
+        except ValueError as e:
+            raise ServiceError(400, str(e))
+        # 血缘范围已在内存中确定，总数无需额外查询
+        total = len(record_ids)
+    elif include_count:
+        total = db.get_records_count(**filters)
+
+    try:
+        results, next_cursor = db.get_records_page(limit=limit, cursor=cursor, offset=offset, record_ids=record_ids, **filters)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    payload = {"count": total, "limit": limit, "offset": offset, "next_cursor": next_cursor, "results": results}
+    if dataset_id:
+        payload.update({"dataset_id": dataset_id, "direction": direction, "depth": depth})
+    return payload
+
+def export_records(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    op_types: Optional[str] = None,
+    q: Optional[str] = None,
+    actor: Optional[str] = None,
+    source: Optional[str] = None,
+    run_id: Optional[str] = None,
+):
+    """
+    全部（或过滤后的）records 的迭代器，按 (timestamp, id) 升序。
+    底层逐批 fetchmany 读取，内存占用与导出条数无关。
+    """
+    start_dt = parse_datetime(start)
+    end_dt = parse_datetime(end)
+    ops = [s.strip() for s in op_types.split(",") if s.strip()] if op_types else None
+    return db.iter_records(start_date=start_dt, end_date=end_dt, op_types=ops, search_q=q, actor=actor, source=source, run_id=run_id)
+
+def list_operations(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    q: Optional[str] = None,
+    actor: Optional[str] = None,
+    source: Optional[str] = None,
+    run_id: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    direction: str = "both",
+    depth: int = 2,
+):
+    """列出 operation 类型及其次数（支持按时间 / 搜索 / 数据集血缘范围聚合），计数由 SQL GROUP BY 完成。"""
+    start_dt = parse_datetime(start)
+    end_dt = parse_datetime(end)
+    filters = dict(start_date=start_dt, end_date=end_dt, op_types=None, search_q=q, actor=actor, source=source, run_id=run_id)
+
+    if dataset_id:
+        scope_ds = db.get_dataset_by_id(dataset_id)
+        if not scope_ds:
+            raise _not_found(dataset_id)
+        try:
+            # 血缘范围取自常驻图（只有记录 id），过滤已在遍历时生效
+            record_ids, _ = lineage_graph.scope_ids(dataset_id, direction=direction, depth=depth, **filters)
+        except ValueError as e:
+            raise ServiceError(400, str(e))
+        results = db.get_operation_stats(record_ids=record_ids)
+    else:
+        results = db.get_operation_stats(**filters)
+
+    payload = {"count": len(results), "results": results}
+    if dataset_id:
+        payload.update({"dataset_id": dataset_id, "direction": direction, "depth": depth})
+    return payload
+
+def get_lineage(
+    dataset_id: str,
+    direction: str = "both",
+    depth: int = 2,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    op_types: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """
+    查询某个数据集的血缘子图（上游/下游/双向）。
+    - direction: upstream | downstream | both
+    - depth: 展开层数（按“数据集节点”计）
+    """
+    direction = (direction or "").strip().lower()
+    if direction not in ("upstream", "downstream", "both"):
+        raise ServiceError(400, "direction must be upstream, downstream, or both")
+    if depth < 0 or depth > 10:
+        raise ServiceError(400, "depth must be between 0 and 10")
+
+    root = db.get_dataset_by_id(dataset_id)
+    if not root:
+        raise _not_found(dataset_id)
+
+    start_dt = parse_datetime(start)
+    end_dt = parse_datetime(end)
+    ops = [s.strip() for s in op_types.split(",") if s.strip()] if op_types else None
+
+    # 在常驻血缘图上遍历，只为触达的数据集查询元信息
+    records, _ = lineage_graph.scope(dataset_id, direction=direction, depth=depth, start_date=start_dt, end_date=end_dt, op_types=ops, search_q=q)
+    touched_ids = {dataset_id}
+    for rec in records:
+        touched_ids.update(rec.get("input_ids", []))
+        touched_ids.update(rec.get("output_ids", []))
+    datasets = db.get_datasets_by_ids(touched_ids)
+
+    def ds_node(ds_id: str):
+        ds = datasets.get(ds_id)
+        if not ds:
+            return {"id": ds_id, "type": "dataset", "name": ds_id}
+        return {"id": ds_id, "type": "dataset", "name": ds.get("name"), "tags": ds.get("tags"), "created_at": ds.get("created_at")}
+
+    nodes = {}
+    edges = []
+    edge_set = set()
+    nodes[dataset_id] = ds_node(dataset_id)
+
+    def add_edge(source: str, target: str):
+        key = (source, target)
+        if key in edge_set:
+            return
+        edge_set.add(key)
+        edges.append({"source": source, "target": target})
+
+    for rec in records:
+        op_id = f"op:{rec['id']}"
+        nodes[op_id] = {
+            "id": op_id,
+            "type": "operation",
+            "name": rec.get("operation_name"),
+            "timestamp": rec.get("timestamp"),
+            "desc": rec.get("operation_desc"),
+            "record_id": rec.get("id"),
+            "actor": rec.get("actor"),
+            "source": rec.get("source"),
+            "run_id": rec.get("run_id"),
+        }
+        for inp in rec.get("input_ids", []):
+            if inp not in nodes:
+                nodes[inp] = ds_node(inp)
+            add_edge(inp, op_id)
+        for out in rec.get("output_ids", []):
+            if out not in nodes:
+                nodes[out] = ds_node(out)
+            add_edge(op_id, out)
+
+    return {
+        "root": dataset_id,
+        "direction": direction,
+        "depth": depth,
+        "filters": {"start": start, "end": end, "op_types": op_types, "q": q},
+        "nodes": list(nodes.values()),
+        "edges": edges,
+    }
+
+# 流式导出时每次回表查询的数据集个数
+_EXPORT_BATCH = 500
+
+def export_lineage(
+    dataset_id: str,
+    direction: str = "both",
+    depth: int = 2,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    op_types: Optional[str] = None,
+    q: Optional[str] = None,
+    actor: Optional[str] = None,
+    source: Optional[str] = None,
+    run_id: Optional[str] = None,
+):
+    """
+    血缘子图的导出行迭代器：先是触达的数据集（{"type": "dataset", ...}），
+    再按时间顺序输出 records（{"type": "record", ...}）。范围语义同 get_lineage；
+    参数校验与遍历在调用时完成（出错时抛 ServiceError），详情在迭代时逐批回表读取。
+    """
+    root = db.get_dataset_by_id(dataset_id)
+    if not root:
+        raise _not_found(dataset_id)
+
+    start_dt = parse_datetime(start)
+    end_dt = parse_datetime(end)
+    ops = [s.strip() for s in op_types.split(",") if s.strip()] if op_types else None
+
+    try:
+        record_ids, dataset_ids = lineage_graph.scope_ids(
+            dataset_id,
+            direction=direction,
+            depth=depth,
+            start_date=start_dt,
+            end_date=end_dt,
+            op_types=ops,
+            search_q=q,
+            actor=actor,
+            source=source,
+            run_id=run_id,
+        )
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+
+    def rows():
+        ds_ids = sorted(dataset_ids)
+        for i in range(0, len(ds_ids), _EXPORT_BATCH):
+            chunk = ds_ids[i : i + _EXPORT_BATCH]
+            found = db.get_datasets_by_ids(chunk)
+            for ds_id in chunk:
+                yield {"type": "dataset", **(found.get(ds_id) or {"id": ds_id})}
+        for rec in db.iter_records(record_ids=record_ids):
+            yield {"type": "record", **rec}
+
+    return rows()
+
+def lineage_report(
+    dataset_id: str,
+    direction: str = "both",
+    depth: int = 2,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    op_types: Optional[str] = None,
+    q: Optional[str] = None,
+    actor: Optional[str] = None,
+    source: Optional[str] = None,
+    run_id: Optional[str] = None,
+):
+    """生成可分享报告，返回 Markdown 文本。"""
+    root = db.get_dataset_by_id(dataset_id)
+    if not root:
+        raise _not_found(dataset_id)
+
+    start_dt = parse_datetime(start)
+    end_dt = parse_datetime(end)
+    ops = [s.strip() for s in op_types.split(",") if s.strip()] if op_types else None
+
+    try:
+        records, dataset_ids = lineage_graph.scope(
+            dataset_id,
+            direction=direction,
+            depth=depth,
+            start_date=start_dt,
+            end_date=end_dt,
+            op_types=ops,
+            search_q=q,
+            actor=actor,
+            source=source,
+            run_id=run_id,
+        )
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+
+    op_set = sorted({r.get("operation_name") for r in records if r.get("operation_name")})
+    ds_set = set(dataset_ids)
+
+    edge_set = set()
+    op_nodes = set()
+    for rec in records:
+        op_id = f"op:{rec.get('id')}"
+        op_nodes.add(op_id)
+        for i_id in rec.get("input_ids", []) or []:
+            edge_set.add((i_id, op_id))
+        for o_id in rec.get("output_ids", []) or []:
+            edge_set.add((op_id, o_id))
+
+    timestamps = [r.get("timestamp") for r in records if r.get("timestamp")]
+    time_min = min(timestamps) if timestamps else None
+    time_max = max(timestamps) if timestamps else None
+
+    title = f"DataTrace Report - {root.get('name')} ({dataset_id})"
+    lines = [
+        f"# {title}",
+        "",
+        f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+        "",
+        "## Scope",
+        f"- direction: {direction}",
+        f"- depth: {depth}",
+    ]
+    if start or end:
+        lines.append(f"- time: {start or 'N/A'} ~ {end or 'N/A'}")
+    if ops:
+        lines.append(f"- op_types: {', '.join(ops)}")
+    if q:
+        lines.append(f"- q: {q}")
+    if actor:
+        lines.append(f"- actor: {actor}")
+    if source:
+        lines.append(f"- source: {source}")
+    if run_id:
+        lines.append(f"- run_id: {run_id}")
+
+    lines += [
+        "",
+        "## Summary",
+        f"- records: {len(records)}",
+        f"- datasets: {len(ds_set)}",
+        f"- operations: {len(op_set)}",
+        f"- nodes: {len(ds_set) + len(op_nodes)}",
+        f"- edges: {len(edge_set)}",
+    ]
+    if time_min or time_max:
+        lines.append(f"- time_span: {time_min or 'N/A'} ~ {time_max or 'N/A'}")
+
+    lines += ["", "## Recent Operations"]
+    if not records:
+        lines.append("No records found.")
+    else:
+        lines.append("| Time | Operation | Actor | Inputs | Outputs | Description |")
+        lines.append("| --- | --- | --- | --- | --- | --- |")
+        recent = records[-20:]
+        for r in recent:
+            op = r.get("operation_name") or ""
+            actor_v = r.get("actor") or ""
+            inputs = ",".join(r.get("input_ids", []) or [])
+            outputs = ",".join(r.get("output_ids", []) or [])
+            desc = (r.get("operation_desc") or "").replace("\n", " ")
+            if len(desc) > 80:
+                desc = desc[:77] + "..."
+            lines.append(f"| {r.get('timestamp','')} | {op} | {actor_v} | {inputs} | {outputs} | {desc} |")
+
+    return "\n".join(lines) + "\n"
+
+# --- 时间序列 ---
+
+# 对齐查询最多合并的序列数
+_ALIGNED_MAX_SERIES = 50
+
+def get_aligned_timeseries(
+    series: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    direction: str = "upstream",
+    depth: int = 1,
+    metric: str = "value",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    resolution: str = "raw",
+    how: str = "outer",
+    fill: Optional[str] = None,
+    limit: int = 1000,
+):
+    """
+    多序列时间对齐（一次归并，返回一个对齐的帧）：
+    - series=ds1:value,ds2:temp 显式指定 (数据集, 指标)，指标缺省为 metric 参数；
+    - 或 dataset_id + direction/depth：该数据集及其血缘范围内所有数据集的 metric 指标（默认对比上游父数据集）。
+    resolution=minute|hour|day 时按汇总桶均值对齐；how=outer|inner；fill=ffill 时用前值填充缺失。
+    """
+    if limit < 1 or limit > 10000:
+        raise ServiceError(400, "limit must be between 1 and 10000")
+    if bool(series) == bool(dataset_id):
+        raise ServiceError(400, "exactly one of series / dataset_id is required")
+
+    if series:
+        pairs = []
+        for item in _split_list(series):
+            ds_id, _, name = item.partition(":")
+            pairs.append((ds_id.strip(), name.strip() or metric))
+    else:
+        if not db.get_dataset_by_id(dataset_id):
+            raise _not_found(dataset_id)
+        try:
+            _, dataset_ids = lineage_graph.scope_ids(dataset_id, direction=direction, depth=depth)
+        except ValueError as e:
+            raise ServiceError(400, str(e))
+        pairs = [(dataset_id, metric)] + [(ds_id, metric) for ds_id in sorted(dataset_ids) if ds_id != dataset_id]
+    if not pairs:
+        raise ServiceError(400, "no series requested")
+    if len(pairs) > _ALIGNED_MAX_SERIES:
+        raise ServiceError(400, f"at most {_ALIGNED_MAX_SERIES} series can be aligned at once")
+    found = db.get_datasets_by_ids(sorted({ds_id for ds_id, _ in pairs}))
+    missing = sorted({ds_id for ds_id, _ in pairs if ds_id not in found})
+    if missing:
+        raise ServiceError(404, f"Dataset {', '.join(missing)} not found")
+
+    try:
+        frame = db.get_aligned_timeseries(pairs, start=start, end=end, resolution=resolution, how=how, fill=fill or None, limit=limit)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    for col in frame["series"]:
+        col["name"] = found[col["dataset_id"]].get("name")
+    return {"resolution": resolution, "how": how, "count": len(frame["timestamps"]), **frame}
+
+def get_timeseries(
+    dataset_id: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    metric: Optional[str] = None,
+    limit: int = 1000,
+    resolution: Optional[str] = None,
+    max_points: Optional[int] = None,
+):
+    """
+    resolution：raw | minute | hour | day（汇总桶含 count/min/max/mean/last）；
+    只给 max_points 时自动选择能在 max_points 个点内回答的最细粒度。
+    """
+    if limit < 1 or limit > 10000:
+        raise ServiceError(400, "limit must be between 1 and 10000")
+    if max_points is not None and (max_points < 1 or max_points > 10000):
+        raise ServiceError(400, "max_points must be between 1 and 10000")
+    if resolution and resolution not in db.TIMESERIES_RESOLUTIONS:
+        raise ServiceError(400, f"resolution must be one of {', '.join(db.TIMESERIES_RESOLUTIONS)}")
+    ds = db.get_dataset_by_id(dataset_id)
+    if not ds:
+        raise _not_found(dataset_id)
+    try:
+        if max_points and not resolution:
+            resolution = db.choose_timeseries_resolution(dataset_id, start=start, end=end, metric=metric, max_points=max_points)
+        results = db.get_timeseries(
+            dataset_id, start=start, end=end, metric=metric, limit=limit, resolution=resolution, max_points=max_points
+        )
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    return {"dataset_id": dataset_id, "resolution": resolution or "raw", "count": len(results), "results": results}
+
+def add_timeseries(dataset_id: str, batch: TimeseriesBatch):
+    ds = db.get_dataset_by_id(dataset_id)
+    if not ds:
+        raise _not_found(dataset_id)
+    metric = batch.points[0].metric if batch.points and batch.points[0].metric else "value"
+    by_metric = {}
+    for p in batch.points:
+        by_metric.setdefault(p.metric or "value", []).append((p.timestamp, p.value))
+    try:
+        series = {name: db.parse_timeseries_points(points) for name, points in by_metric.items()}
+        inserted = db.add_timeseries_series(dataset_id, series)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    return {
+        "dataset_id": dataset_id, "inserted": inserted, "metric": metric,
+        "metrics": {name: len(points) for name, points in by_metric.items()},
+    }
+
+def materialize_timeseries(dataset_id: str):
+    """把继承（引用）的时间序列物化为该数据集的自有数据；没有继承来源时不做任何事。"""
+    ds = db.get_dataset_by_id(dataset_id)
+    if not ds:
+        raise _not_found(dataset_id)
+    sources = db.get_timeseries_links(dataset_id)
+    inserted = db.materialize_timeseries(dataset_id)
+    return {"dataset_id": dataset_id, "inserted": inserted, "sources": sources}
+
+# 流式写入每个事务提交的点数（默认值；请求可用 chunk_size 覆盖）
+INGEST_CHUNK = 50000
+_INGEST_SLICE = 1 << 20
+
+class TimeseriesIngest:
+    """
+    一次流式写入：请求体按任意大小的片段 feed()，边接收边解析（格式见 timeseries_ingest.py），
+    每累计 chunk_size 个点提交一个事务，finish() 提交剩余的点并返回结果，内存占用与请求体大小无关。
+    格式由 fmt 决定，未给出时按 content_type 推断；中途出错时抛出 400，已提交的块保留（detail 中给出已写入的点数）。
+    """
+
+    def __init__(self, dataset_id: str, fmt: Optional[str] = None, content_type: Optional[str] = None,
+                 metric: str = "value", chunk_size: int = INGEST_CHUNK):
+        if chunk_size < 1000 or chunk_size > 500000:
+            raise ServiceError(400, "chunk_size must be between 1000 and 500000")
+        content_type = (content_type or "").split(";")[0].strip().lower()
+        fmt = fmt or tsi.CONTENT_TYPES.get(content_type)
+        if fmt not in tsi.FORMATS:
+            raise ServiceError(400, f"format must be one of {', '.join(tsi.FORMATS)} (or set Content-Type)")
+        if not db.get_dataset_by_id(dataset_id):
+            raise _not_found(dataset_id)
+        self.dataset_id = dataset_id
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.inserted = 0
+        self.commits = 0
+        self.metrics = {}
+        self._parser = tsi.make_parser(fmt, default_metric=metric)
+        self._buffered = {}
+        self._pending = 0
+
+    def feed(self, piece: bytes):
+        try:
+            # 交付的片段可能很大：切成小段解析，保证缓冲不超过 chunk_size + 一小段
+            for i in range(0, len(piece), _INGEST_SLICE):
+                self._collect(self._parser.feed(piece[i : i + _INGEST_SLICE]))
+                if self._pending >= self.chunk_size:
+                    self._flush()
+        except ValueError as e:
+            raise self._error(e)
+
+    def finish(self):
+        try:
+            self._collect(self._parser.finish())
+            self._flush()
+        except ValueError as e:
+            raise self._error(e)
+        return {"dataset_id": self.dataset_id, "format": self.fmt, "inserted": self.inserted, "commits": self.commits, "metrics": self.metrics}
+
+    def _collect(self, blocks):
+        for name, times, values in blocks:
+            self._buffered.setdefault(name, []).append((times, values))
+            self.metrics[name] = self.metrics.get(name, 0) + len(times)
+            self._pending += len(times)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        series = {
+            name: (np.concatenate([np.asarray(b[0], dtype=np.int64) for b in blocks]),
+                   np.concatenate([np.asarray(b[1], dtype=np.float64) for b in blocks]))
+            for name, blocks in self._buffered.items()
+        }
+        self.inserted += db.add_timeseries_series(self.dataset_id, series)
+        self.commits += 1
+        self._buffered, self._pending = {}, 0
+
+    def _error(self, e):
+        return ServiceError(400, f"{e} ({self.inserted} points committed before the error)")
+
+def ingest_timeseries(dataset_id: str, pieces, fmt: Optional[str] = None, content_type: Optional[str] = None,
+                      metric: str = "value", chunk_size: int = INGEST_CHUNK):
+    """同步流式写入：pieces 为 bytes 或 bytes 的可迭代对象"""
+    ingest = TimeseriesIngest(dataset_id, fmt=fmt, content_type=content_type, metric=metric, chunk_size=chunk_size)
+    for piece in [pieces] if isinstance(pieces, (bytes, bytearray)) else pieces:
+        ingest.feed(bytes(piece))
+    return ingest.finish()
+
+def generate_timeseries(
+    dataset_id: str,
+    start: Optional[str] = None,
+    freq: str = "daily",
+    periods: int = 60,
+    amplitude: float = 10.0,
+    noise: float = 1.0,
+    trend: float = 0.05,
+    metric: str = "value",
+):
+    """
+    生成简单的时间序列样例（sin + trend + noise），用于小规模实验。
+    freq: daily | hourly
+    """
+    ds = db.get_dataset_by_id(dataset_id)
+    if not ds:
+        raise _not_found(dataset_id)
+    if periods < 1 or periods > 5000:
+        raise ServiceError(400, "periods must be between 1 and 5000")
+    if freq not in ("daily", "hourly"):
+        raise ServiceError(400, "freq must be daily or hourly")
+
+    if start:
+        base_dt = parse_datetime(start)
+    else:
+        base_dt = datetime.now() - (timedelta(days=periods) if freq == "daily" else timedelta(hours=periods))
+    step = timedelta(days=1) if freq == "daily" else timedelta(hours=1)
+
+    points = []
+    for i in range(periods):
+        t = base_dt + step * i
+        seasonal = amplitude * math.sin(2 * math.pi * i / max(10, periods // 3))
+        value = seasonal + (trend * i) + random.uniform(-noise, noise)
+        points.append({"timestamp": t.strftime("%Y-%m-%d %H:%M:%S"), "value": float(value)})
+    inserted = db.add_timeseries_points(dataset_id, points, metric=metric)
+    return {"dataset_id": dataset_id, "inserted": inserted, "metric": metric}
+
+def _check_analytics_args(dataset_id, limit):
+    if limit < 1 or limit > 10000:
+        raise ServiceError(400, "limit must be between 1 and 10000")
+    if not db.get_dataset_by_id(dataset_id):
+        raise _not_found(dataset_id)
+
+def resample_timeseries(
+    dataset_id: str,
+    every: str,
+    aggs: str = "mean",
+    metric: str = "value",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 1000,
+):
+    """
+    分桶聚合：every 为桶宽（30s / 15min / 1h / 1d / 1w，桶与纪元对齐），
+    aggs 为 count,sum,mean,min,max,first,last,std 的任意组合。按批读取，只返回聚合后的桶。
+    """
+    _check_analytics_args(dataset_id, limit)
+    agg_list = _split_list(aggs)
+    unknown = [a for a in agg_list if a not in tsa.RESAMPLE_AGGS]
+    if not agg_list or unknown:
+        raise ServiceError(400, f"aggs must be a subset of {','.join(tsa.RESAMPLE_AGGS)}")
+    try:
+        resampler = tsa.Resampler(tsa.parse_duration(every), agg_list)
+        for times, values in db.iter_timeseries(dataset_id, metric=metric, start=start, end=end):
+            resampler.feed(times, values)
+            if resampler.pending() >= limit:
+                break
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    results = resampler.result(timeseries_store.format_epoch_us_many)[:limit]
+    return {"dataset_id": dataset_id, "metric": metric, "every": every, "count": len(results), "results": results}
+
+def rolling_timeseries(
+    dataset_id: str,
+    window: str,
+    stats: str = "mean",
+    quantiles: Optional[str] = None,
+    min_periods: Optional[int] = None,
+    metric: str = "value",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 1000,
+):
+    """
+    滑动窗口统计：window 为点数（如 20）或时间跨度（如 1h，窗口为 (t - 1h, t]），
+    stats 为 mean,std,min,max,sum,count,diff 的任意组合，quantiles 如 0.5,0.9（结果键为 q0.5 / q0.9）。
+    窗口内点数不足 min_periods（默认：点数窗口为窗口大小，时间窗口为 1）时统计量为 null。
+    """
+    _check_analytics_args(dataset_id, limit)
+    stat_list = _split_list(stats)
+    unknown = [s for s in stat_list if s not in tsa.ROLLING_STATS]
+    if unknown:
+        raise ServiceError(400, f"stats must be a subset of {','.join(tsa.ROLLING_STATS)}")
+    try:
+        qs = [float(q) for q in _split_list(quantiles)]
+    except ValueError:
+        raise ServiceError(400, "quantiles must be numbers between 0 and 1")
+    if any(q < 0 or q > 1 for q in qs):
+        raise ServiceError(400, "quantiles must be numbers between 0 and 1")
+    if not stat_list and not qs:
+        raise ServiceError(400, "at least one of stats / quantiles is required")
+    if min_periods is not None and min_periods < 1:
+        raise ServiceError(400, "min_periods must be >= 1")
+
+    try:
+        if window.strip().isdigit():
+            points = int(window)
+            if points < 1 or points > 5000:
+                raise ValueError("window must be between 1 and 5000 points")
+            roller = tsa.Roller(stat_list, qs, window_points=points, min_periods=min_periods)
+        else:
+            roller = tsa.Roller(stat_list, qs, window_us=tsa.parse_duration(window), min_periods=min_periods)
+        for times, values in db.iter_timeseries(dataset_id, metric=metric, start=start, end=end):
+            roller.feed(times, values)
+            if roller.pending() >= limit:
+                break
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    results = roller.result(timeseries_store.format_epoch_us_many, limit=limit)
+    return {"dataset_id": dataset_id, "metric": metric, "window": window, "count": len(results), "results": results}
@@ -0,0 +1,64 @@
+import database as db
+
+def _dataset(api, name):
+    res = api.post("/datasets/", json={"name": name, "description": "", "tags": []})
+    assert res.status_code == 200, res.text
+    return res.json()["id"]
+
+def _item(ref, inputs, op="Clean", out=None):
+    item = {"ref": ref, "input_ids": inputs, "operation": op, "description": "t"}
+    if out:
+        item["outputs"] = [{"name": out}]
+    return item
+
+def test_failed_item_rolls_back_only_itself(api, monkeypatch):
+    raw = _dataset(api, "raw")
+    real_insert = db._insert_record
+
+    def flaky_insert(conn, rec_id, input_ids, op_name, *args, **kwargs):
+        if op_name == "Boom":
+            raise RuntimeError("disk on fire")
+        return real_insert(conn, rec_id, input_ids, op_name, *args, **kwargs)
+
+    monkeypatch.setattr(db, "_insert_record", flaky_insert)
+    res = api.post("/transform/batch", json={"chunk_size": 10, "items": [
+        _item("a", [raw], out="a_out"),
+        _item("b", ["$a"], op="Boom", out="b_out"),
+        _item("c", ["$a"], out="c_out"),
+    ]})
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert [r["status"] for r in body["results"]] == ["ok", "error", "ok"]
+    failed = body["results"][1]
+    assert failed["status_code"] == 500 and "disk on fire" in failed["detail"]
+
+    # SAVEPOINT 回滚了失败条目的输出数据集；同一 chunk 中前后条目照常提交
+    names = {d["name"] for d in db.get_all_datasets()}
+    assert {"a_out", "c_out"} <= names
+    assert "b_out" not in names
+    assert len(db.get_all_records()) == 2
+
+def test_ref_to_failed_item_reports_dependency_error(api):
+    raw = _dataset(api, "raw")
+    res = api.post("/transform/batch", json={"items": [
+        _item("a", ["missing-id"]),
+        _item("b", ["$a"]),
+        _item("c", ["$a.1"]),
+        _item("d", [raw]),
+        _item("e", ["$nope"]),
+    ]})
+    results = res.json()["results"]
+    assert [r["status"] for r in results] == ["error", "error", "error", "ok", "error"]
+    assert results[1]["detail"] == "Ref $a depends on failed item 0"
+    assert results[2]["detail"] == "Ref $a.1 depends on failed item 0"
+    assert results[4]["detail"] == "Unresolved ref $nope"
+
+def test_ref_chain_resolves_across_chunks(api):
+    raw = _dataset(api, "raw")
+    items = [_item("s0", [raw])] + [_item(f"s{k}", [f"$s{k - 1}"]) for k in range(1, 7)]
+    res = api.post("/transform/batch", json={"chunk_size": 3, "items": items})
+    results = res.json()["results"]
+    assert all(r["status"] == "ok" for r in results)
+    for prev, cur in zip(results, results[1:]):
+        rec = db.get_records_by_ids([cur["record_id"]])[0]
+        assert rec["input_ids"] == [prev["output_datasets"][0]["id"]]
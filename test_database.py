@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+import database as db
+
+def test_failed_commit_rolls_back_and_resets_depth(db_file):
+    conn = db._connect()
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("CREATE TABLE parent (id INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE child (pid INTEGER REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)")
+
+    # 延迟外键在 COMMIT 时才检查：COMMIT 失败后连接不能停留在打开的事务中
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction() as c:
+            c.execute("INSERT INTO child VALUES (1)")
+    assert not conn.in_transaction
+    assert db._local.tx_depth == 0
+
+    with db.transaction() as c:
+        c.execute("INSERT INTO parent VALUES (1)")
+        c.execute("INSERT INTO child VALUES (1)")
+    assert conn.execute("SELECT COUNT(*) FROM child").fetchone()[0] == 1
+
+def test_nested_failure_rolls_back_savepoint_only(db_file):
+    conn = db._connect()
+    conn.execute("CREATE TABLE t (v INTEGER)")
+    with db.transaction() as c:
+        c.execute("INSERT INTO t VALUES (1)")
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                c.execute("INSERT INTO t VALUES (2)")
+                raise RuntimeError("boom")
+        assert db._local.tx_depth == 1
+    assert [r[0] for r in conn.execute("SELECT v FROM t")] == [1]
+    assert db._local.tx_depth == 0
@@ -0,0 +1,32 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from bench_lineage import make_records
+from lineage_graph import CompactLineageGraph, DictLineageGraph
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"op_types": ["Clean", "Merge"]},
+    {"actor": "alice", "start_date": datetime(2026, 1, 5), "end_date": datetime(2026, 1, 20)},
+])
+def test_dict_and_compact_graphs_agree(filters):
+    records = make_records(5000, seed=1)
+    dict_graph, compact_graph = DictLineageGraph(), CompactLineageGraph()
+    # 前一半整批构建，后一半逐条追加（CompactLineageGraph 走 overlay / 重建路径）
+    dict_graph.extend(records[:2500])
+    compact_graph.extend(records[:2500])
+    for rec in records[2500:]:
+        dict_graph.add_record(rec)
+        compact_graph.add_record(rec)
+    assert len(dict_graph) == len(compact_graph) == 5000
+
+    rng = random.Random(2)
+    allowed = {r["id"] for r in rng.sample(records, 2000)}
+    for rec in rng.sample(records, 30):
+        for ds_id in rec["input_ids"][:1] + rec["output_ids"][:1]:
+            for direction in ("upstream", "downstream", "both"):
+                for extra in ({}, {"allowed_records": allowed}):
+                    args = (ds_id, direction, 3)
+                    assert dict_graph.bfs(*args, **filters, **extra) == compact_graph.bfs(*args, **filters, **extra)
@@ -0,0 +1,88 @@
+def test_cache_entries_expire_after_ttl(sdk, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(sdk.time, "monotonic", lambda: clock[0])
+    cache = sdk._DatasetCache(maxsize=10, ttl=5)
+    cache.put_name("raw", "id1")
+    cache.put_meta({"id": "id1", "name": "raw"})
+    clock[0] += 4.9
+    assert cache.get_id("raw") == "id1"
+    assert cache.get_meta("id1") == {"id": "id1", "name": "raw"}
+    clock[0] += 0.2
+    assert cache.get_id("raw") is None
+    assert cache.get_meta("id1") is None
+
+def test_cache_evicts_least_recently_used(sdk):
+    cache = sdk._DatasetCache(maxsize=2, ttl=60)
+    cache.put_name("a", "1")
+    cache.put_name("b", "2")
+    assert cache.get_id("a") == "1"  # a 变为最近使用
+    cache.put_name("c", "3")
+    assert cache.get_id("b") is None
+    assert (cache.get_id("a"), cache.get_id("c")) == ("1", "3")
+    # 覆盖写入同样刷新位置
+    cache.put_name("a", "9")
+    cache.put_name("d", "4")
+    assert cache.get_id("c") is None
+    assert cache.get_id("a") == "9"
+    cache.forget_name("a")
+    assert cache.get_id("a") is None
+
+def test_get_dataset_is_cached(sdk):
+    raw = sdk.get_dataset("raw")
+    assert sdk.get_dataset("raw").id == raw.id
+    assert sdk.get_dataset("raw", auto_create=False).id == raw.id
+    assert sdk.shim.calls == [("POST", "/datasets/")]
+
+    sdk.CONFIG["DATASET_CACHE_TTL"] = 0
+    sdk.clear_dataset_cache()
+    assert sdk.get_dataset("raw").id == raw.id
+    assert sdk.shim.calls.count(("POST", "/datasets/")) == 2
+
+def test_get_dataset_without_create_returns_none(sdk, monkeypatch, capsys):
+    assert sdk.get_dataset("missing", auto_create=False) is None
+    # 不存在的名称不缓存：之后创建的数据集可以查到
+    created = sdk.get_dataset("missing")
+    sdk.clear_dataset_cache()
+    assert sdk.get_dataset("missing", auto_create=False).id == created.id
+
+    # 服务端没有 /datasets/resolve（404）：按不存在处理
+    request = sdk.shim.request
+
+    def old_server(method, path, **kwargs):
+        res = request(method, path, **kwargs)
+        if path == "/datasets/resolve":
+            res.status_code, res._content = 404, b'{"detail": "Not Found"}'
+        return res
+
+    monkeypatch.setattr(sdk.shim, "request", old_server)
+    sdk.clear_dataset_cache()
+    capsys.readouterr()
+    assert sdk.get_dataset("missing", auto_create=False) is None
+    assert capsys.readouterr().out == ""
+
+    # 其它错误与 auto_create 分支一致：打印后返回 None
+    sdk.shim.down = True
+    assert sdk.get_dataset("missing", auto_create=False) is None
+    assert "Failed to get dataset missing" in capsys.readouterr().out
+
+def test_resolve_datasets_batches_cache_misses(sdk):
+    a = sdk.get_dataset("a")
+    sdk.clear_dataset_cache()
+    sdk.get_dataset("a", auto_create=False)
+    sdk.shim.calls.clear()
+
+    found = sdk.resolve_datasets(["a", "b", "a"])
+    assert list(found) == ["a", "b"]
+    assert found["a"].id == a.id and found["b"] is None
+    assert sdk.shim.calls == [("POST", "/datasets/resolve")]
+    # 解析时顺带缓存了元信息
+    assert sdk.get_dataset_info(a)["name"] == "a"
+    assert len(sdk.shim.calls) == 1
+
+    created = sdk.resolve_datasets(["a", "b", "c"], create=True)
+    assert created["a"].id == a.id
+    assert sdk.shim.calls[-1] == ("POST", "/datasets/batch")
+    # 新建的名称已进入缓存，再次解析不发请求
+    calls = len(sdk.shim.calls)
+    assert {n: d.id for n, d in sdk.resolve_datasets(["b", "c"]).items()} == {n: created[n].id for n in ("b", "c")}
+    assert len(sdk.shim.calls) == calls
@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import requests
+
+import database as db
+import timeseries_ingest as tsi
+
+@pytest.fixture
+def embedded(db_file, monkeypatch):
+    """embedded 模式的 datatrace 模块，读写 db_file 夹具的临时数据库"""
+    import datatrace as dt
+
+    monkeypatch.setattr(dt, "CONFIG", dict(dt.CONFIG, SPOOL_PATH=None, ASYNC_LOG=False))
+    monkeypatch.setattr(dt, "_client", None)
+    monkeypatch.setattr(dt, "_spool", None)
+    dt.init(mode="embedded", db_path=db_file)
+    yield dt
+    dt._stop_log_queue()
+    dt.clear_dataset_cache()
+
+def test_import_database_creates_no_file(tmp_path):
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=repo)
+    subprocess.run([sys.executable, "-c", "import database, services"], cwd=tmp_path, env=env, check=True)
+    assert not os.path.exists(tmp_path / "datatrace.db")
+
+def test_embedded_uses_configured_db(embedded, db_file):
+    assert embedded.get_client().db_path == db_file
+    raw = embedded.get_dataset("raw", tags=["src"])
+    assert db.get_dataset_by_id(raw.id)["name"] == "raw"
+    assert embedded.get_dataset("raw").id == raw.id
+
+def test_embedded_lineage_matches_http(embedded, api):
+    dt = embedded
+    raw = dt.get_dataset("raw")
+    a = dt.log([raw], "clean", "a")
+    b = dt.log([a, raw], "merge", "b")
+
+    lineage = dt.get_lineage(b, direction="upstream", depth=3)
+    assert lineage == api.get(f"/lineage/{b.id}", params={"direction": "upstream", "depth": 3}).json()
+    assert {n["id"] for n in lineage["nodes"] if n["type"] == "dataset"} == {raw.id, a.id, b.id}
+    assert {d["id"] for d in dt.get_descendants(raw)["results"]} == {a.id, b.id}
+    assert dt.get_records(dataset_id=b, direction="upstream")["count"] == 2
+    assert sorted(r["operation_name"] for r in dt.export_records()) == ["clean", "merge"]
+    assert dt.get_report(b).startswith(f"# DataTrace Report - b ({b.id})")
+
+    export = dt.get_client().get(f"/lineage/{b.id}/export", params={"direction": "upstream", "depth": 3})
+    assert export.text == api.get(f"/lineage/{b.id}/export", params={"direction": "upstream", "depth": 3}).text
+    assert [json.loads(line)["type"] for line in export.text.splitlines()].count("record") == 2
+    assert dt.get_client().get("/lineage/missing/export").status_code == 404
+
+def test_embedded_timeseries(embedded):
+    dt = embedded
+    ds = dt.get_dataset("sensor")
+    assert dt.add_timeseries(ds, [{"timestamp": "2024-01-01 00:00:00", "value": 1.0}])["inserted"] == 1
+    res = dt.ingest_timeseries(ds, points=[(f"2024-01-01 00:0{i}:00", float(i)) for i in range(1, 5)])
+    assert res == {"dataset_id": ds.id, "format": "ndjson", "inserted": 4, "commits": 1, "metrics": {"value": 4}}
+    # binary 帧：请求体为 bytes 片段的生成器
+    frames = [("temp", [1_704_067_200_000_000 + i * 60_000_000 for i in range(3)], [20.0, 21.0, 22.0])]
+    assert dt.ingest_timeseries(ds, frames=frames)["metrics"] == {"temp": 3}
+
+    got = dt.get_timeseries(ds, metric="value")
+    assert [p["value"] for p in got["results"]] == [1.0, 1.0, 2.0, 3.0, 4.0]
+    assert dt.resample_timeseries(ds, "1h", aggs=("count", "sum"))["results"][0]["count"] == 5
+    assert dt.rolling_timeseries(ds, 2, metric="temp")["count"] == 3
+
+def test_embedded_errors(embedded):
+    dt = embedded
+    client = dt.get_client()
+    with pytest.raises(requests.HTTPError) as exc:
+        dt.get_lineage("missing")
+    assert exc.value.response.status_code == 404
+    assert client.get("/timeseries/missing", params={"limit": 0}).status_code == 400
+    assert client.get("/no/such/route").status_code == 404
+    res = client.post("/transform/", json={"operation": "clean"})
+    assert res.status_code == 422
+    res = client.post(f"/timeseries/{dt.get_dataset('s').id}/ingest", data=tsi.pack_frame("v", [1], [1.0])[:-3],
+                      headers={"Content-Type": "application/octet-stream"})
+    assert res.status_code == 400 and "truncated frame" in res.json()["detail"]
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+import database as db
+
+@pytest.fixture
+def dt(sdk):
+    sdk.CONFIG.update(ASYNC_LOG=True, LOG_BATCH_SIZE=7, LOG_FLUSH_INTERVAL=0.05)
+    return sdk
+
+def test_ref_chain_across_batches(dt):
+    raw = dt.get_dataset("raw")
+    handles = [raw]
+    for k in range(30):
+        handles.append(dt.log([handles[-1]], "step", f"s{k}"))
+    assert isinstance(handles[-1], dt.PendingDataset)
+    assert dt.flush(10)
+
+    ids = [h.id for h in handles]
+    assert len(set(ids)) == len(ids)
+    # 暴力校验：每条记录的输入恰好是链上前一个数据集
+    for prev, cur in zip(ids, ids[1:]):
+        (rec,) = [r for r in db.get_all_records() if cur in r["output_ids"]]
+        assert rec["input_ids"] == [prev]
+    assert dt.shim.calls.count(("POST", "/transform/batch")) >= 30 // 7
+
+def test_failed_item_fails_its_dependents(dt):
+    raw = dt.get_dataset("raw")
+    bad = dt.log(["no-such-id"], "x", "bad")
+    dep = dt.log([bad], "y", "dep")
+    ok = dt.log([raw], "z", "ok")
+    assert dt.flush(10)
+    assert bad.future.exception() is not None
+    assert dep.future.exception() is not None
+    assert ok.id
+
+def test_worker_survives_unexpected_error(dt, monkeypatch):
+    raw = dt.get_dataset("raw")
+    real_post = dt.shim.post
+
+    def malformed(path, **kwargs):
+        res = real_post(path, **kwargs)
+        res._content = b'{"unexpected": true}'
+        return res
+
+    monkeypatch.setattr(dt.shim, "post", malformed)
+    lost = dt.log([raw], "x", "lost")
+    assert dt.flush(10)
+    assert isinstance(lost.future.exception(), KeyError)
+
+    monkeypatch.setattr(dt.shim, "post", real_post)
+    later = dt.log([raw], "y", "later")
+    assert dt.flush(10)
+    assert later.id and dt._log_queue._thread.is_alive()
+
+def test_flush_times_out_instead_of_hanging(dt, monkeypatch):
+    raw = dt.get_dataset("raw")
+    release = threading.Event()
+    real_post = dt.shim.post
+    monkeypatch.setattr(dt.shim, "post", lambda path, **kw: release.wait() and real_post(path, **kw))
+    pending = dt.log([raw], "x", "slow")
+    t0 = time.monotonic()
+    assert dt.flush(0.2) is False
+    assert time.monotonic() - t0 < 2
+    release.set()
+    assert dt.flush(10) and pending.id
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_flush_returns_when_worker_is_gone(dt, monkeypatch):
+    raw = dt.get_dataset("raw")
+
+    def die(path, **kwargs):
+        raise SystemExit  # 不属于 Exception：模拟工作线程意外退出
+
+    monkeypatch.setattr(dt.shim, "post", die)
+    dt.log([raw], "x", "kills-worker")
+    dt.flush(10)
+    dt._log_queue._thread.join(5)
+    dt.log([raw], "y", "orphan")
+    t0 = time.monotonic()
+    assert dt.flush() is False
+    assert time.monotonic() - t0 < 5
@@ -0,0 +1,67 @@
+import sqlite3
+from contextlib import closing
+
+import database as db
+
+def _records_by_output():
+    return {o: r for r in db.get_all_records() for o in r["output_ids"]}
+
+def test_spool_is_off_by_default(sdk):
+    raw = sdk.get_dataset("raw")
+    sdk.shim.down = True
+    assert sdk.CONFIG["SPOOL_PATH"] is None
+    assert sdk.log([raw], "clean", "a") is None
+
+def test_replay_maps_local_ids_after_restart(sdk, tmp_path, monkeypatch):
+    dt = sdk
+    path = str(tmp_path / "spool.db")
+    dt.CONFIG["SPOOL_RETRY_INTERVAL"] = 3600  # 不让后台重放线程抢先，由测试显式重放
+    dt.init(spool=path)
+    assert dt.CONFIG["SPOOL_PATH"] == path
+    raw = dt.get_dataset("raw")
+
+    dt.shim.down = True
+    a = dt.log([raw], "clean", "a")
+    b = dt.log([a], "merge", "b")
+    c = dt.log([a, b], "join", "c")
+    assert all(isinstance(ds, dt.SpooledDataset) and ds.id.startswith(dt.LOCAL_ID_PREFIX) for ds in (a, b, c))
+    # 离线期间不再发请求
+    assert dt.shim.calls.count(("POST", "/transform/")) == 1
+
+    with closing(sqlite3.connect(path)) as conn:
+        events = conn.execute("SELECT client_id, payload, output_ids FROM events ORDER BY seq").fetchall()
+
+    # 模拟进程重启：新的暂存实例从文件中读取待重放事件；每批一条，后续事件的本地 id 只能经 id_map 解析
+    dt.shim.down = False
+    monkeypatch.setattr(dt, "_spool", None)
+    assert dt.replay(batch_size=1) == {"replayed": 3, "failed": 0, "pending": 0}
+
+    ids = {ds.name: dt.resolve_id(ds.local_id) for ds in (a, b, c)}
+    assert not any(i.startswith(dt.LOCAL_ID_PREFIX) for i in ids.values())
+    records = _records_by_output()
+    assert records[ids["a"]]["input_ids"] == [raw.id]
+    assert records[ids["b"]]["input_ids"] == [ids["a"]]
+    assert sorted(records[ids["c"]]["input_ids"]) == sorted([ids["a"], ids["b"]])
+
+    # 重放中断后再次重放同一事件：服务端按 client_id 去重，不会重复写入
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.executemany(
+            "INSERT INTO events (client_id, payload, output_ids, created_at) VALUES (?, ?, ?, '')",
+            events,
+        )
+    before = len(db.get_all_records())
+    monkeypatch.setattr(dt, "_spool", None)
+    assert dt.replay()["replayed"] == 3
+    assert len(db.get_all_records()) == before
+
+def test_rejected_event_does_not_block_later_ones(sdk, tmp_path):
+    dt = sdk
+    dt.CONFIG["SPOOL_RETRY_INTERVAL"] = 3600
+    dt.init(spool=str(tmp_path / "spool.db"))
+    raw = dt.get_dataset("raw")
+    dt.shim.down = True
+    dt.log(["no-such-id"], "bad", "bad")
+    ok = dt.log([raw], "clean", "ok")
+    dt.shim.down = False
+    assert dt.replay() == {"replayed": 1, "failed": 1, "pending": 0}
+    assert not ok.id.startswith(dt.LOCAL_ID_PREFIX)
@@ -0,0 +1,35 @@
+import math
+import random
+
+import numpy as np
+
+import timeseries_analytics as tsa
+
+def test_time_window_quantiles_match_brute_force():
+    rng = random.Random(0)
+    times, t = [], 0
+    for _ in range(3000):
+        t += rng.choice([0, 1, 2, 5, 30])  # 含重复时间戳与不规则间隔
+        times.append(t * 1_000_000)
+    values = [rng.choice([rng.gauss(0, 1), float(rng.randint(-3, 3))]) for _ in times]
+    values[100] = math.nan
+    quantiles = (0.0, 0.1, 0.5, 0.75, 1.0)
+    window_us = 60 * 1_000_000
+
+    roller = tsa.Roller(stats=(), quantiles=quantiles, window_us=window_us, min_periods=1)
+    # 分批 feed：窗口跨批时依赖 carry 中的点
+    for lo in range(0, len(times), 700):
+        roller.feed(np.array(times[lo : lo + 700], dtype=np.int64), np.array(values[lo : lo + 700]))
+    rows = roller.result(lambda ts: ts)
+    assert len(rows) == len(times)
+
+    for i, row in enumerate(rows):
+        # 窗口为 (t_i - window, t_i] 内、且不晚于当前点的所有点
+        window = [values[j] for j in range(i + 1) if times[j] > times[i] - window_us]
+        for q in quantiles:
+            expected = np.quantile(window, q)
+            got = row[f"q{q:g}"]
+            if math.isnan(expected):
+                assert got is None
+            else:
+                assert got == expected, (i, q)
@@ -0,0 +1,85 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+import timeseries_ingest as tsi
+import timeseries_store as tss
+
+def _points(n, seed=0):
+    rng = random.Random(seed)
+    base = tss.to_epoch_us("2026-01-01 00:00:00")
+    return [(rng.choice(["temp", "rh", "value"]), base + i * 10 ** 6, round(rng.uniform(-100, 100), 3)) for i in range(n)]
+
+def _body(fmt, points):
+    if fmt == "ndjson":
+        lines = [json.dumps({"timestamp": tss.format_epoch_us(t), "value": v, "metric": m}) for m, t, v in points]
+        return ("\n".join(lines) + "\n").encode()
+    if fmt == "csv":
+        return ("timestamp,value,metric\n" + "".join(f"{tss.format_epoch_us(t)},{v},{m}\n" for m, t, v in points)).encode()
+    return b"".join(tsi.pack_frame(m, [t], [v]) for m, t, v in points)
+
+def _pieces(body, rng):
+    i = 0
+    while i < len(body):
+        step = rng.choice([1, 2, 3, 7, 16, 17, 64, 1000])
+        yield body[i : i + step]
+        i += step
+
+def _flatten(blocks):
+    out = []
+    for metric, times, values in blocks:
+        out.extend((metric, int(t), float(v)) for t, v in zip(times, values))
+    return out
+
+@pytest.mark.parametrize("fmt", tsi.FORMATS)
+def test_records_straddling_pieces(fmt):
+    """按随机大小（含单字节）切片交付，结果与逐点期望一致（同一指标内保持顺序）"""
+    points = _points(400)
+    body = _body(fmt, points)
+    for seed in range(5):
+        parser = tsi.make_parser(fmt)
+        parsed = []
+        for piece in _pieces(body, random.Random(seed)):
+            parsed.extend(_flatten(parser.feed(piece)))
+        parsed.extend(_flatten(parser.finish()))
+        by_metric = lambda rows: {m: [(t, v) for mm, t, v in rows if mm == m] for m in {"temp", "rh", "value"}}
+        assert by_metric(parsed) == by_metric(points)
+
+def test_binary_frame_split_inside_header_and_pairs():
+    times = np.arange(5, dtype=np.int64) * 10 ** 6
+    body = tsi.pack_frame("temp", times, times / 10 ** 6) + tsi.pack_frame("rh", times[:2], [1.5, 2.5])
+    parser = tsi.make_parser("binary")
+    parsed = []
+    for k in range(len(body)):
+        parsed.extend(_flatten(parser.feed(body[k : k + 1])))
+    assert parser.finish() == []
+    assert parsed == [("temp", int(t), t / 10 ** 6) for t in times] + [("rh", 0, 1.5), ("rh", 10 ** 6, 2.5)]
+
+def test_binary_truncated_frame():
+    parser = tsi.make_parser("binary")
+    parser.feed(tsi.pack_frame("temp", [0, 1], [1.0, 2.0])[:-3])
+    with pytest.raises(tsi.IngestError, match="truncated frame"):
+        parser.finish()
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_line_without_newline_is_bounded(fmt, monkeypatch):
+    monkeypatch.setattr(tsi, "MAX_LINE_BYTES", 64)
+    parser = tsi.make_parser(fmt)
+    parser.feed(_body(fmt, _points(2)))
+    with pytest.raises(tsi.IngestError, match="line 4: line exceeds 64 bytes" if fmt == "csv" else "line 3: line exceeds 64 bytes"):
+        for _ in range(10):
+            parser.feed(b"x" * 16)
+
+def test_csv_unknown_header_is_reported():
+    parser = tsi.make_parser("csv")
+    with pytest.raises(tsi.IngestError, match=r"line 1: csv header must contain timestamp and value columns \(got: time, value\)"):
+        parser.feed(b"time,value\n2026-01-01 00:00:00,1.0\n")
+
+def test_csv_headerless_and_bad_first_row():
+    parser = tsi.make_parser("csv")
+    assert _flatten(parser.feed(b"2026-01-01 00:00:00,1.5,temp\n")) == [("temp", tss.to_epoch_us("2026-01-01"), 1.5)]
+    parser = tsi.make_parser("csv")
+    with pytest.raises(tsi.IngestError, match="invalid timestamp"):
+        parser.feed(b"yesterday,1.5\n")
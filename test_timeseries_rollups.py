@@ -0,0 +1,70 @@
+import random
+
+import database as db
+import timeseries_store as tss
+
+BASE = tss.to_epoch_us("2026-01-01 00:00:00")
+MINUTE = 60 * 10 ** 6
+
+def _write(dataset_id, points, metric="value", batch=500):
+    for i in range(0, len(points), batch):
+        db.add_timeseries_points(dataset_id, [(tss.format_epoch_us(t), v) for t, v in points[i : i + batch]], metric=metric)
+
+def _tiers(dataset_id, metric="value"):
+    return dict(db._connect().execute(
+        "SELECT tier, stored FROM timeseries_rollup_tiers WHERE dataset_id = ? AND metric = ?", (dataset_id, metric)
+    ).fetchall())
+
+def _brute_force(points_by_metric, width):
+    buckets = {}
+    for metric, points in points_by_metric.items():
+        for t, v in points:
+            buckets.setdefault((t - t % width, metric), []).append((t, v))
+    results = []
+    for (bucket, metric), pts in sorted(buckets.items()):
+        values = [v for _, v in pts]
+        results.append((tss.format_epoch_us(bucket), metric, len(pts), min(values), max(values), max(pts)[1]))
+    return results
+
+def _read(dataset_id, tier, metric=None):
+    return [
+        (p["timestamp"], p["metric"], p["count"], p["min"], p["max"], p["last"])
+        for p in db.get_timeseries(dataset_id, metric=metric, resolution=tier, limit=10 ** 6)
+    ]
+
+def test_tier_not_coarser_than_spacing_is_served_from_raw(db_file):
+    rng = random.Random(3)
+    minutely = [(BASE + MINUTE * i, float(rng.randint(-100, 100))) for i in range(3000)]
+    secondly = [(BASE + 10 ** 6 * i, float(rng.randint(-100, 100))) for i in range(3000)]
+    _write("ds", minutely, metric="cpu")
+    _write("ds", secondly, metric="mem")
+
+    assert _tiers("ds", "cpu") == {"minute": 0, "hour": 1, "day": 1}
+    assert _tiers("ds", "mem") == {"minute": 1, "hour": 1, "day": 1}
+    stored = db._connect().execute(
+        "SELECT COUNT(*) FROM timeseries_rollups WHERE dataset_id = 'ds' AND tier = 'minute' AND metric = 'cpu'"
+    ).fetchone()[0]
+    assert stored == 0
+
+    by_metric = {"cpu": minutely, "mem": secondly}
+    for tier, width in db._ROLLUP_TIERS.items():
+        assert _read("ds", tier) == _brute_force(by_metric, width)
+        assert _read("ds", tier, metric="cpu") == _brute_force({"cpu": minutely}, width)
+
+def test_inherited_raw_served_tier(db_file):
+    minutely = [(BASE + MINUTE * i, float(i % 17)) for i in range(600)]
+    _write("src", minutely)
+    db.inherit_timeseries(["src"], "child")
+    assert _read("child", "minute") == _brute_force({"value": minutely}, MINUTE)
+    assert db.choose_timeseries_resolution("child", max_points=100) == "hour"
+    assert db.choose_timeseries_resolution("child", max_points=600) == "raw"
+
+def test_decision_waits_for_two_distinct_timestamps(db_file):
+    _write("ds", [(BASE, 1.0)])
+    assert _tiers("ds") == {}
+    # 尚未决定时维护全部粒度；决定跳过时删除已有的汇总行，读取改由原始块聚合
+    assert db._connect().execute("SELECT COUNT(*) FROM timeseries_rollups WHERE dataset_id = 'ds'").fetchone()[0] == 3
+    later = [(BASE + MINUTE * i, float(i)) for i in range(1, 200)]
+    _write("ds", later)
+    assert _tiers("ds") == {"minute": 0, "hour": 1, "day": 1}
+    assert _read("ds", "minute") == _brute_force({"value": [(BASE, 1.0)] + later}, MINUTE)
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+import database as db
+import timeseries_store as tss
+
+def _random_points(rng, n, t0=0):
+    times = [t0 + rng.randrange(-10 ** 12, 10 ** 12) for _ in range(n)]
+    values = [rng.choice([rng.gauss(0, 1), round(rng.uniform(-50, 50), 2), 0.0, -0.0, 1e300]) for _ in range(n)]
+    return times, values
+
+def _expected(times, values):
+    order = sorted(range(len(times)), key=lambda i: times[i])
+    return [times[i] for i in order], [values[i] for i in order]
+
+@pytest.mark.parametrize("codec", [tss.CODEC_RAW, tss.CODEC_ZLIB])
+def test_chunk_codec_roundtrip(codec):
+    rng = random.Random(codec)
+    times, values = _random_points(rng, tss.CHUNK_POINTS * 2 + 17)
+    times[5] = times[6]  # 时间相同的点保持输入顺序
+    chunks = tss.make_chunks(times, values, codec=codec)
+    assert [c[2] for c in chunks] == [tss.CHUNK_POINTS, tss.CHUNK_POINTS, 17]
+    decoded_t, decoded_v = [], []
+    for t_min, t_max, n, ts_blob, val_blob, chunk_codec in chunks:
+        assert chunk_codec == codec
+        t, v = tss.unpack(ts_blob, val_blob, chunk_codec)
+        assert (len(t), t[0], t[-1]) == (n, t_min, t_max)
+        decoded_t.extend(int(x) for x in t)
+        decoded_v.extend(float(x) for x in v)
+    assert (decoded_t, decoded_v) == _expected(times, values)
+
+def test_zlib_codec_compresses_regular_series():
+    times = [1_700_000_000_000_000 + 60_000_000 * i for i in range(tss.CHUNK_POINTS)]
+    values = [round(20 + (i % 37) * 0.25, 2) for i in range(tss.CHUNK_POINTS)]
+    (_, _, n, ts_blob, val_blob, _), = tss.make_chunks(times, values, codec=tss.CODEC_ZLIB)
+    assert len(ts_blob) + len(val_blob) < n * 16 / 4
+
+def test_legacy_raw_chunks_still_readable(db_file):
+    (t_min, t_max, n, ts_blob, val_blob, _), = tss.make_chunks([tss.to_epoch_us("2026-01-01 00:00:00")], [1.5], codec=tss.CODEC_RAW)
+    with db.transaction() as conn:
+        # 旧库中的块没有 codec 列，ALTER TABLE 后取默认值 0
+        conn.execute(
+            "INSERT INTO timeseries_chunks (dataset_id, metric, t_min, t_max, n, ts, vals) VALUES ('old', 'value', ?, ?, ?, ?, ?)",
+            (t_min, t_max, n, ts_blob, val_blob),
+        )
+    db.add_timeseries_points("old", [("2026-01-01 00:00:01", 2.5)])
+    assert [(p["timestamp"], p["value"]) for p in db.get_timeseries("old")] == [
+        ("2026-01-01 00:00:00", 1.5), ("2026-01-01 00:00:01", 2.5),
+    ]
+
+def _series(dataset_id):
+    return [(p["timestamp"], p["value"]) for p in db.get_timeseries(dataset_id, limit=10 ** 6)]
+
+def _fmt(points):
+    return [(tss.format_epoch_us(t), v) for t, v in sorted(points)]
+
+def test_compaction_respects_chunk_watermarks(db_file):
+    """小批量写入触发块合并；合并不能跨越子数据集的 chunk_watermark，结果与逐点暴力计算一致"""
+    rng = random.Random(7)
+    base = tss.to_epoch_us("2026-01-01 00:00:00")
+    used = set()
+    written = []
+    snapshots = {}
+    for k in range(60):
+        batch = []
+        while len(batch) < rng.randint(1, 40):
+            t = base + rng.randrange(10 ** 6) * 10 ** 6
+            if t not in used:
+                used.add(t)
+                batch.append((t, float(rng.randint(-999, 999)) / 8))
+        db.add_timeseries_points("src", [(tss.format_epoch_us(t), v) for t, v in batch])
+        written.extend(batch)
+        if k % 13 == 5:
+            child = f"child{k}"
+            db.inherit_timeseries(["src"], child)
+            snapshots[child] = list(written)
+
+    conn = db._connect()
+    small = conn.execute("SELECT COUNT(*) FROM timeseries_chunks WHERE dataset_id = 'src'").fetchone()[0]
+    assert small < 60  # 确实发生了合并
+    assert _series("src") == _fmt(written)
+    for child, expected in snapshots.items():
+        assert _series(child) == _fmt(expected)
@@ -0,0 +1,250 @@
+"""
+时间序列分析（服务端计算，只返回聚合结果）：
+- Resampler：按固定宽度分桶聚合（count/sum/mean/min/max/first/last/std）
+- Roller：滑动窗口统计（mean/std/min/max/sum/count/diff + 分位数），窗口按点数或时间跨度
+两者都是流式的：按时间顺序逐批 feed(times, values)，批与批之间只保留跨批所需的少量状态，
+内存占用与序列总长度无关。输入为 database.iter_timeseries 产生的批次。
+"""
+import re
+from bisect import bisect_left, insort
+
+import numpy as np
+
+RESAMPLE_AGGS = ("count", "sum", "mean", "min", "max", "first", "last", "std")
+ROLLING_STATS = ("mean", "std", "min", "max", "sum", "count", "diff")
+
+_DURATION_RE = re.compile(r"^\s*(\d+)\s*(us|ms|s|sec|min|m|h|d|w)\s*$")
+_DURATION_UNITS = {
+    "us": 1, "ms": 1000, "s": 10 ** 6, "sec": 10 ** 6, "m": 60 * 10 ** 6, "min": 60 * 10 ** 6,
+    "h": 3600 * 10 ** 6, "d": 86400 * 10 ** 6, "w": 7 * 86400 * 10 ** 6,
+}
+
+def parse_duration(text):
+    """'30s' / '15min' / '1h' / '1d' / '1w' -> 微秒；非法时抛 ValueError"""
+    m = _DURATION_RE.match(str(text or "").lower())
+    if not m or int(m.group(1)) <= 0:
+        raise ValueError(f"invalid duration: {text!r} (e.g. 30s, 15min, 1h, 1d)")
+    return int(m.group(1)) * _DURATION_UNITS[m.group(2)]
+
+def _float_or_none(x):
+    return None if np.isnan(x) else float(x)
+
+class Resampler:
+    """
+    分桶聚合。桶与纪元对齐（与 timeseries_rollups 一致），桶内统计量按批合并：
+    std 用 (n, mean, M2) 的并行合并公式，样本标准差（ddof=1，与 pandas 一致）。
+    """
+
+    def __init__(self, width, aggs=("mean",)):
+        self.width = int(width)
+        self.aggs = tuple(aggs)
+        self.rows = []
+        self._open = None  # 尚未结束的最后一个桶
+
+    def feed(self, times, values):
+        if not len(times):
+            return
+        buckets = times - times % self.width
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(times)]
+        n = (ends - starts).astype(np.float64)
+        total = np.add.reduceat(values, starts)
+        mean = total / n
+        m2 = np.add.reduceat((values - np.repeat(mean, ends - starts)) ** 2, starts)
+        parts = zip(
+            buckets[starts].tolist(), n.tolist(), total.tolist(), mean.tolist(), m2.tolist(),
+            np.minimum.reduceat(values, starts).tolist(), np.maximum.reduceat(values, starts).tolist(),
+            values[starts].tolist(), values[ends - 1].tolist(),
+        )
+        for part in parts:
+            part = list(part)
+            if self._open is not None and self._open[0] == part[0]:
+                self._open = self._merge(self._open, part)
+                continue
+            if self._open is not None:
+                self.rows.append(self._open)
+            self._open = part
+
+    @staticmethod
+    def _merge(a, b):
+        bucket, n_a, total_a, mean_a, m2_a, min_a, max_a, first_a, _ = a
+        _, n_b, total_b, mean_b, m2_b, min_b, max_b, _, last_b = b
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        mean = mean_a + delta * n_b / n
+        m2 = m2_a + m2_b + delta * delta * n_a * n_b / n
+        return [bucket, n, total_a + total_b, mean, m2, min(min_a, min_b), max(max_a, max_b), first_a, last_b]
+
+    def pending(self):
+        """已结束的桶数（调用方据此提前停止读取）"""
+        return len(self.rows)
+
+    def result(self, format_ts):
+        rows = self.rows + ([self._open] if self._open is not None else [])
+        labels = format_ts([r[0] for r in rows])
+        results = []
+        for ts, (_, n, total, mean, m2, vmin, vmax, first, last) in zip(labels, rows):
+            stats = {
+                "count": int(n), "sum": total, "mean": mean, "min": vmin, "max": vmax, "first": first, "last": last,
+                "std": (m2 / (n - 1)) ** 0.5 if n > 1 else None,
+            }
+            item = {"timestamp": ts}
+            item.update((agg, stats[agg]) for agg in self.aggs)
+            results.append(item)
+        return results
+
+def _sliding_quantiles(v, starts, ends, quantiles):
+    """
+    窗口 [starts[i], ends[i]) 的分位数（starts / ends 均单调不减），与 np.quantile 的线性插值一致。
+    随窗口滑动用 bisect 维护窗口内的有序值，每个点只插入、删除一次；含 NaN 的窗口结果为 NaN。
+    """
+    result = np.full((len(quantiles), len(starts)), np.nan)
+    if not len(starts):
+        return result
+    values = v.tolist()
+    window = []
+    nans = 0
+    lo = hi = int(starts[0])
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        while hi < end:
+            x = values[hi]
+            hi += 1
+            if x != x:
+                nans += 1
+            else:
+                insort(window, x)
+        while lo < start:
+            x = values[lo]
+            lo += 1
+            if x != x:
+                nans -= 1
+            else:
+                del window[bisect_left(window, x)]
+        n = len(window)
+        if nans or not n:
+            continue
+        for j, q in enumerate(quantiles):
+            pos = q * (n - 1)
+            k = int(pos)
+            frac = pos - k
+            if frac == 0:
+                result[j, i] = window[k]
+            else:
+                a, b = window[k], window[k + 1]
+                # 与 numpy 的 _lerp 相同的写法，结果逐位一致
+                result[j, i] = a + (b - a) * frac if frac < 0.5 else b - (b - a) * (1 - frac)
+    return result
+
+class Roller:
+    """
+    滑动窗口统计，窗口以当前点结尾：window_points 为点数窗口，window_us 为时间窗口 (t - window, t]。
+    窗口内点数不足 min_periods 时统计量为 None。批与批之间保留上一批尾部仍可能落入窗口的点。
+    """
+
+    def __init__(self, stats=("mean",), quantiles=(), window_points=None, window_us=None, min_periods=None):
+        if (window_points is None) == (window_us is None):
+            raise ValueError("exactly one of window_points / window_us is required")
+        self.stats = tuple(stats)
+        self.quantiles = tuple(quantiles)
+        self.window_points = window_points
+        self.window_us = window_us
+        self.min_periods = min_periods if min_periods is not None else (window_points or 1)
+        self.rows = []
+        self._carry_t = np.empty(0, dtype=np.int64)
+        self._carry_v = np.empty(0, dtype=np.float64)
+
+    def feed(self, times, values):
+        if not len(times):
+            return
+        k = len(self._carry_t)
+        t = np.concatenate([self._carry_t, times])
+        v = np.concatenate([self._carry_v, values])
+        idx = np.arange(len(t))
+        if self.window_points is not None:
+            starts = np.maximum(idx - self.window_points + 1, 0)
+        else:
+            starts = np.searchsorted(t, t - self.window_us, side="right")
+        ends = idx + 1
+        counts = ends - starts
+        # 只输出本批新点的结果；carry 中的点已在上一批输出
+        sel = slice(k, None)
+        starts_new, ends_new, counts_new = starts[sel], ends[sel], counts[sel]
+        valid = counts_new >= self.min_periods
+
+        out = {}
+        csum = np.r_[0.0, np.cumsum(v)]
+        sums = csum[ends_new] - csum[starts_new]
+        if "sum" in self.stats:
+            out["sum"] = sums
+        if "count" in self.stats:
+            out["count"] = counts_new.astype(np.float64)
+        if "mean" in self.stats or "std" in self.stats:
+            means = sums / counts_new
+            if "mean" in self.stats:
+                out["mean"] = means
+            if "std" in self.stats:
+                # 先减去批均值再做平方前缀和，降低大数值下的抵消误差
+                shift = v.mean()
+                csq = np.r_[0.0, np.cumsum((v - shift) ** 2)]
+                sq = csq[ends_new] - csq[starts_new]
+                centered = means - shift
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    var = (sq - counts_new * centered ** 2) / (counts_new - 1)
+                out["std"] = np.where(counts_new > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+        if "min" in self.stats or "max" in self.stats:
+            # reduceat 传入交错的 [start, end) 下标对，偶数位即为各窗口的归约结果
+            padded = np.r_[v, 0.0]
+            pairs = np.empty(2 * len(starts_new), dtype=np.intp)
+            pairs[0::2] = starts_new
+            pairs[1::2] = ends_new
+            if "min" in self.stats:
+                out["min"] = np.minimum.reduceat(padded, pairs)[0::2]
+            if "max" in self.stats:
+                out["max"] = np.maximum.reduceat(padded, pairs)[0::2]
+        if "diff" in self.stats:
+            prev = np.r_[np.nan, v[:-1]][sel]
+            out["diff"] = v[sel] - prev
+        if self.quantiles:
+            for q, col in zip(self.quantiles, self._quantiles(v, starts_new, ends_new)):
+                out[f"q{q:g}"] = col
+
+        new_t, new_v = t[sel], v[sel]
+        columns = {name: np.where(valid, col, np.nan) if name != "diff" else col for name, col in out.items()}
+        self.rows.append((new_t, new_v, columns))
+
+        if self.window_points is not None:
+            keep = max(self.window_points - 1, 1)
+            self._carry_t, self._carry_v = t[-keep:], v[-keep:]
+        else:
+            cut = np.searchsorted(t, t[-1] - self.window_us, side="right")
+            cut = min(cut, len(t) - 1)  # diff 至少需要上一个点
+            self._carry_t, self._carry_v = t[cut:], v[cut:]
+
+    def _quantiles(self, v, starts, ends):
+        """各分位数一行，返回 shape 为 (len(quantiles), len(starts)) 的数组"""
+        if self.window_points is not None and len(v) >= self.window_points:
+            # 点数窗口：完整窗口用 sliding_window_view 一次算完，前几个不完整窗口单独处理
+            full = np.lib.stride_tricks.sliding_window_view(v, self.window_points)
+            result = np.empty((len(self.quantiles), len(starts)))
+            is_full = (ends - starts) == self.window_points
+            result[:, is_full] = np.quantile(full[starts[is_full]], self.quantiles, axis=1)
+            for i in np.flatnonzero(~is_full):
+                result[:, i] = np.quantile(v[starts[i] : ends[i]], self.quantiles)
+            return result
+        return _sliding_quantiles(v, starts, ends, self.quantiles)
+
+    def pending(self):
+        return sum(len(r[0]) for r in self.rows)
+
+    def result(self, format_ts, limit=None):
+        results = []
+        for times, values, columns in self.rows:
+            labels = format_ts(times.tolist())
+            lists = {name: col.tolist() for name, col in columns.items()}
+            for i, (ts, value) in enumerate(zip(labels, values.tolist())):
+                item = {"timestamp": ts, "value": value}
+                item.update((name, _float_or_none(col[i])) for name, col in lists.items())
+                results.append(item)
+                if limit is not None and len(results) >= limit:
+                    return results
+        return results
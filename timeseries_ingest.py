@@ -0,0 +1,186 @@
+"""
+时间序列流式写入的增量解析器：请求体按任意大小的片段 feed(bytes)，每次返回已解析完整的数据块
+[(metric, times, values), ...]（times 为纪元微秒）。不完整的尾部（半行 / 半个记录）留到下一片段。
+
+支持三种格式：
+- ndjson：每行 {"timestamp": "...", "value": 1.0, "metric": "temp"}，metric 可省略
+- csv：列 timestamp,value[,metric]；首行为表头（含 timestamp 列）时按列名取值，否则按位置
+- binary：连续的帧，每帧为 uint16 指标名长度 | 指标名 UTF-8 | uint32 点数 n | n 个 (int64 纪元微秒, float64 数值)，
+  全部小端。帧内记录可以跨片段到达，因此单帧大小不受限制。
+timestamp 可为时间字符串（同 timeseries_store.to_epoch_us）或数字（纪元秒）。
+"""
+import csv
+import json
+import struct
+
+import numpy as np
+
+import timeseries_store
+
+FORMATS = ("ndjson", "csv", "binary")
+CONTENT_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+    "application/octet-stream": "binary",
+}
+
+# ndjson / csv 单行的最大字节数：没有换行的请求体不会无限缓冲
+MAX_LINE_BYTES = 1 << 20
+
+_PAIR = np.dtype([("t", "<i8"), ("v", "<f8")])
+_FRAME_HEAD = struct.Struct("<H")
+_FRAME_COUNT = struct.Struct("<I")
+
+class IngestError(ValueError):
+    """请求体格式错误（消息中带行号 / 字节偏移）"""
+
+def _epoch_us(ts):
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+        return int(round(ts * 10 ** 6))
+    return timeseries_store.to_epoch_us(ts)
+
+def pack_frame(metric, times_us, values):
+    """把一个指标的点打包成 binary 帧（客户端辅助函数）"""
+    name = metric.encode("utf-8")
+    pairs = np.empty(len(times_us), dtype=_PAIR)
+    pairs["t"] = times_us
+    pairs["v"] = values
+    return _FRAME_HEAD.pack(len(name)) + name + _FRAME_COUNT.pack(len(pairs)) + pairs.tobytes()
+
+class _LineParser:
+    def __init__(self, default_metric="value"):
+        self.default_metric = default_metric
+        self.line_no = 0
+        self._tail = b""
+
+    def feed(self, data):
+        lines = (self._tail + data).split(b"\n")
+        self._tail = lines.pop()
+        if len(self._tail) > MAX_LINE_BYTES:
+            raise IngestError(f"line {self.line_no + len(lines) + 1}: line exceeds {MAX_LINE_BYTES} bytes")
+        return self._parse_lines(lines)
+
+    def finish(self):
+        lines = [self._tail] if self._tail.strip() else []
+        self._tail = b""
+        return self._parse_lines(lines)
+
+    def _parse_lines(self, lines):
+        blocks = {}
+        for raw in lines:
+            self.line_no += 1
+            if not raw.strip():
+                continue
+            try:
+                metric, t, v = self._parse_line(raw.decode("utf-8"))
+            except (ValueError, TypeError, KeyError, IndexError, UnicodeDecodeError) as e:
+                raise IngestError(f"line {self.line_no}: {e}")
+            if metric is None:
+                continue
+            times, values = blocks.setdefault(metric, ([], []))
+            times.append(t)
+            values.append(v)
+        return [(metric, times, values) for metric, (times, values) in blocks.items()]
+
+class NdjsonParser(_LineParser):
+    def _parse_line(self, line):
+        obj = json.loads(line)
+        if not isinstance(obj, dict):
+            raise ValueError("each line must be a JSON object")
+        return obj.get("metric") or self.default_metric, _epoch_us(obj["timestamp"]), float(obj["value"])
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+class CsvParser(_LineParser):
+    def __init__(self, default_metric="value"):
+        super().__init__(default_metric)
+        self._columns = None  # (timestamp, value, metric) 的列下标
+
+    def _parse_line(self, line):
+        row = next(csv.reader([line]))
+        if self._columns is None:
+            header = [c.strip().lower() for c in row]
+            if "timestamp" in header:
+                if "value" not in header:
+                    raise ValueError("csv header must contain timestamp and value")
+                self._columns = (header.index("timestamp"), header.index("value"), header.index("metric") if "metric" in header else None)
+                return None, None, None
+            self._columns = (0, 1, 2)
+            try:
+                return self._parse_row(row)
+            except (ValueError, IndexError):
+                # 没有任何数值列的首行是列名不对的表头（如 time,value），而不是一行坏数据
+                if not any(_is_number(c) for c in row):
+                    raise ValueError(f"csv header must contain timestamp and value columns (got: {', '.join(header)})")
+                raise
+        return self._parse_row(row)
+
+    def _parse_row(self, row):
+        ti, vi, mi = self._columns
+        ts = row[ti].strip()
+        try:
+            ts = float(ts)
+        except ValueError:
+            pass
+        metric = row[mi].strip() if mi is not None and mi < len(row) else ""
+        return metric or self.default_metric, _epoch_us(ts), float(row[vi])
+
+class BinaryFrameParser:
+    def __init__(self, default_metric="value"):
+        self._buf = bytearray()
+        self._metric = None
+        self._remaining = 0
+        self._offset = 0  # 已消费的字节数，用于错误信息
+
+    def feed(self, data):
+        self._buf += data
+        blocks = []
+        while True:
+            if self._remaining == 0:
+                if len(self._buf) < _FRAME_HEAD.size:
+                    break
+                (name_len,) = _FRAME_HEAD.unpack_from(self._buf)
+                head = _FRAME_HEAD.size + name_len + _FRAME_COUNT.size
+                if len(self._buf) < head:
+                    break
+                try:
+                    self._metric = bytes(self._buf[_FRAME_HEAD.size : _FRAME_HEAD.size + name_len]).decode("utf-8")
+                except UnicodeDecodeError:
+                    raise IngestError(f"byte {self._offset}: metric name is not valid UTF-8")
+                if not self._metric:
+                    raise IngestError(f"byte {self._offset}: empty metric name")
+                (self._remaining,) = _FRAME_COUNT.unpack_from(self._buf, head - _FRAME_COUNT.size)
+                self._consume(head)
+                continue
+            k = min(self._remaining, len(self._buf) // _PAIR.itemsize)
+            if k == 0:
+                break
+            pairs = np.frombuffer(bytes(self._buf[: k * _PAIR.itemsize]), dtype=_PAIR)
+            blocks.append((self._metric, pairs["t"].astype(np.int64), pairs["v"].astype(np.float64)))
+            self._consume(k * _PAIR.itemsize)
+            self._remaining -= k
+        return blocks
+
+    def _consume(self, n):
+        del self._buf[:n]
+        self._offset += n
+
+    def finish(self):
+        if self._buf or self._remaining:
+            raise IngestError(f"byte {self._offset}: truncated frame")
+        return []
+
+def make_parser(fmt, default_metric="value"):
+    if fmt == "ndjson":
+        return NdjsonParser(default_metric)
+    if fmt == "csv":
+        return CsvParser(default_metric)
+    if fmt == "binary":
+        return BinaryFrameParser(default_metric)
+    raise ValueError(f"format must be one of {', '.join(FORMATS)}")
@@ -0,0 +1,164 @@
+"""
+时间序列列式分块存储的编码层：
+- 每个 (dataset, metric) 的数据点按时间排序后切成块（最多 CHUNK_POINTS 个点）
+- 块内时间戳为 UTC 纪元微秒（int64），数值为 float64，各自打包成小端字节 blob
+- 默认编码（CODEC_ZLIB）：时间戳存相邻差值（等间隔序列的差值全部相同），数值按字节平面重排
+  （8 个字节平面各自连续，符号/指数字节高度重复），两者再用 zlib 压缩；CODEC_RAW 为未压缩的旧格式
+- 块头记录 t_min / t_max / n，范围查询只解码与区间相交的块
+SQL 读写在 database.py 中完成，这里只负责编码、切片与多块归并。
+"""
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+CHUNK_POINTS = 4096
+
+# 块编码（timeseries_chunks.codec）：旧库中的块为 CODEC_RAW，读取时按列值解码，无需迁移数据
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CHUNK_CODEC = CODEC_ZLIB
+_ZLIB_LEVEL = 6
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+def to_epoch_us(ts):
+    """datetime 或时间字符串（YYYY-MM-DD[ HH:MM:SS[.ffffff]]，ISO 8601 亦可）-> UTC 纪元微秒"""
+    if isinstance(ts, datetime):
+        dt = ts
+    else:
+        text = str(ts).strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            raise ValueError(f"invalid timestamp: {ts!r}")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // _US
+
+def format_epoch_us(us):
+    """纪元微秒 -> 'YYYY-MM-DD HH:MM:SS'（有小数秒时带 .ffffff），与行存储的文本格式一致"""
+    dt = _EPOCH + timedelta(microseconds=int(us))
+    if dt.microsecond:
+        return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+def format_epoch_us_many(times):
+    """批量版 format_epoch_us（读取路径上逐点 strftime 是主要开销）"""
+    text = np.datetime_as_string(np.asarray(times, dtype=np.int64).astype("datetime64[us]"), unit="us")
+    return [t.replace("T", " ").removesuffix(".000000") for t in text.tolist()]
+
+def _shuffle(blob, width=8):
+    """字节平面重排：第 k 个平面为每个元素的第 k 个字节"""
+    return b"".join(blob[k::width] for k in range(width))
+
+def _unshuffle(blob, width=8):
+    out = bytearray(len(blob))
+    plane = len(blob) // width
+    for k in range(width):
+        out[k::width] = blob[k * plane : (k + 1) * plane]
+    return bytes(out)
+
+def _encode(ts, vals, codec):
+    """已按时间排序的一块 -> (ts_blob, val_blob)；ts / vals 为小端字节"""
+    if codec == CODEC_RAW:
+        return ts, vals
+    return zlib.compress(ts, _ZLIB_LEVEL), zlib.compress(_shuffle(vals), _ZLIB_LEVEL)
+
+def _delta_bytes(times):
+    """int64 时间戳 -> 首个值 + 相邻差值（小端字节）"""
+    return np.diff(times, prepend=np.int64(0)).astype("<i8").tobytes()
+
+def make_chunks(times, values, codec=None):
+    """
+    (epoch_us 序列, 数值序列) -> [(t_min, t_max, n, ts_blob, val_blob, codec), ...]，
+    块内按时间升序（时间相同时保持输入顺序）；codec 缺省为 CHUNK_CODEC。
+    """
+    codec = CHUNK_CODEC if codec is None else codec
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(times, kind="stable")
+    times, values = times[order].astype("<i8"), values[order].astype("<f8")
+    chunks = []
+    for i in range(0, len(times), CHUNK_POINTS):
+        ts, vals = times[i : i + CHUNK_POINTS], values[i : i + CHUNK_POINTS]
+        ts_blob = ts.tobytes() if codec == CODEC_RAW else _delta_bytes(ts)
+        chunks.append((int(ts[0]), int(ts[-1]), len(ts)) + _encode(ts_blob, vals.tobytes(), codec) + (codec,))
+    return chunks
+
+def unpack(ts_blob, val_blob, codec=CODEC_RAW):
+    """解码一个块，返回 (times, values) 两个 ndarray"""
+    if codec == CODEC_ZLIB:
+        deltas, vals = zlib.decompress(ts_blob), _unshuffle(zlib.decompress(val_blob))
+        return np.cumsum(np.frombuffer(deltas, dtype="<i8")).astype(np.int64), np.frombuffer(vals, dtype="<f8")
+    if codec != CODEC_RAW:
+        raise ValueError(f"unknown chunk codec: {codec!r}")
+    return np.frombuffer(ts_blob, dtype="<i8"), np.frombuffer(val_blob, dtype="<f8")
+
+def slice_range(times, values, lo=None, hi=None):
+    """块内按 [lo, hi] 截取（times 已排序）"""
+    i = 0 if lo is None else int(np.searchsorted(times, lo, side="left"))
+    j = len(times) if hi is None else int(np.searchsorted(times, hi, side="right"))
+    return times[i:j], values[i:j]
+
+def median_spacing(times):
+    """相邻不同时间戳间距的中位数（微秒）；不足两个不同时间戳时返回 None"""
+    distinct = np.unique(np.asarray(times, dtype=np.int64))
+    return int(np.median(np.diff(distinct))) if len(distinct) > 1 else None
+
+def bucket_stats(times, values, width):
+    """
+    按宽度为 width 微秒的桶聚合：返回 [(bucket_start, count, sum, min, max, last_t, last_v), ...]，按桶升序。
+    last 取桶内时间最大的点（时间相同时取输入中靠后的一个）。
+    """
+    if not len(times):
+        return []
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(times, kind="stable")
+    times, values = times[order], values[order]
+    buckets = times - times % width
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return list(zip(
+        buckets[starts].tolist(),
+        np.diff(np.r_[starts, len(times)]).tolist(),
+        np.add.reduceat(values, starts).tolist(),
+        np.minimum.reduceat(values, starts).tolist(),
+        np.maximum.reduceat(values, starts).tolist(),
+        times[ends].tolist(),
+        values[ends].tolist(),
+    ))
+
+def concat_sorted(segments):
+    """把多个已排序片段合并为一对按时间排序的 numpy 数组 (times, values)"""
+    if not segments:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    times = np.concatenate([np.asarray(s[0], dtype=np.int64) for s in segments])
+    values = np.concatenate([np.asarray(s[1], dtype=np.float64) for s in segments])
+    order = np.argsort(times, kind="stable")
+    return times[order], values[order]
+
+def merge_segments(segments, limit=None):
+    """
+    归并多个已排序的片段：segments = [(times, values), ...]。
+    时间相同的点保持片段先后顺序。返回按时间排序的 [(epoch_us, value, 片段序号, 片段内下标), ...]，最多 limit 个。
+    """
+    if not any(len(s[0]) for s in segments):
+        return []
+    times = np.concatenate([np.asarray(s[0], dtype=np.int64) for s in segments])
+    values = np.concatenate([np.asarray(s[1], dtype=np.float64) for s in segments])
+    seg = np.concatenate([np.full(len(s[0]), k, dtype=np.int64) for k, s in enumerate(segments)])
+    starts = np.cumsum([0] + [len(s[0]) for s in segments])[:-1]
+    if limit is not None and limit < len(times):
+        # 只需前 limit 个：先按时间选出候选，再稳定排序
+        cut = np.partition(times, limit - 1)[limit - 1]
+        keep = np.nonzero(times <= cut)[0]
+        order = keep[np.argsort(times[keep], kind="stable")][:limit]
+    else:
+        order = np.argsort(times, kind="stable")
+    pos = order - starts[seg[order]]
+    return list(zip(times[order].tolist(), values[order].tolist(), seg[order].tolist(), pos.tolist()))